@@ -1,17 +1,21 @@
 from ..tree_walker.values import ParametricMessage
 from ..tree_walker.runtime import as_sophie_list
-from ..tree_walker.scheduler import NativeObjectProxy
+from ..tree_walker.scheduler import NativeObjectProxy, off_loop
+
+def _read_lines(path):
+	with open(path, "r") as fh: return list(fh)
+
+def _read_file(path):
+	with open(path, "r") as fh: return fh.read()
 
 class FileSystem:
 	@staticmethod
-	def read_lines(path, target:ParametricMessage):
-		with open(path, "r") as fh: lines = list(fh)
-		target.dispatch_with(as_sophie_list(lines))
+	async def read_lines(path, target:ParametricMessage):
+		target.dispatch_with(as_sophie_list(await off_loop(_read_lines, path)))
 	
 	@staticmethod
-	def read_file(path, target:ParametricMessage):
-		with open(path, "r") as fh: text = fh.read()
-		target.dispatch_with(text)
+	async def read_file(path, target:ParametricMessage):
+		target.dispatch_with(await off_loop(_read_file, path))
 
 filesystem = NativeObjectProxy(FileSystem(), pin=False)
 
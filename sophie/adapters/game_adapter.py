@@ -83,7 +83,7 @@ class GameLoop:
 
 	def play(self, size, fps):
 		pygame.init()
-		width, height = force(size['x']), force(size['y'])
+		width, height = _xy(size)
 		display = pygame.display.set_mode((width, height))
 		self.display_actor = NativeObjectProxy(DisplayProxy(display))
 		self.clock = pygame.time.Clock()
@@ -122,12 +122,13 @@ class GameLoop:
 				self._on_tick.dispatch_with(self.display_actor)
 			events.accept_message("next_frame", ())
 		
-def _force_rgb(color):
-	f = lambda field: int(force(color[field])) & 255
-	return f("red"), f("green"), f("blue")
+# The fields of `rgb` and `xy` are strict, so the constructor has already forced them.
 
-def _force_xy(xy):
-	return force(xy["x"]), force(xy["y"])
+def _rgb(color):
+	return tuple(int(c) & 255 for c in (color.red, color.green, color.blue))
+
+def _xy(xy):
+	return xy.x, xy.y
 
 class DisplayProxy:
 	
@@ -136,39 +137,37 @@ class DisplayProxy:
 	
 	def draw(self, pic):
 		for step in iterate_list(pic):
-			tag = step.pop("").nom.text
-			getattr(self, "_"+tag)(*map(force, step.values()))
+			getattr(self, "_"+step.TAG.nom.text)(*map(force, step))
 		pygame.display.flip()
 	
 	def _fill(self, color):
-		self._display.fill(_force_rgb(color))
+		self._display.fill(_rgb(color))
 	
 	def _stroke(self, color, strokes):
-		rgb = _force_rgb(color)
+		rgb = _rgb(color)
 		for stroke in iterate_list(strokes):
-			tag = stroke.pop("").nom.text
-			getattr(self, "_stroke_"+tag)(rgb, *map(force, stroke.values()))
+			getattr(self, "_stroke_"+stroke.TAG.nom.text)(rgb, *map(force, stroke))
 	
 	def _stroke_line(self, color, start, stop):
-		draw.line(self._display, color, _force_xy(start), _force_xy(stop))
+		draw.line(self._display, color, _xy(start), _xy(stop))
 	
 	def _stroke_polyline(self, color, xys):
-		draw.lines(self._display, color, False, *map(_force_xy, iterate_list(xys)))
+		draw.lines(self._display, color, False, *map(_xy, iterate_list(xys)))
 	
 	def _stroke_box(self, color, corner, measure):
-		draw.rect(self._display, color, pygame.Rect(_force_xy(corner), _force_xy(measure)), width=1)
+		draw.rect(self._display, color, pygame.Rect(_xy(corner), _xy(measure)), width=1)
 	
 	def _stroke_fill_box(self, color, corner, measure):
-		self._display.fill(color, pygame.Rect(_force_xy(corner), _force_xy(measure)))
+		self._display.fill(color, pygame.Rect(_xy(corner), _xy(measure)))
 	
 	def _stroke_circle(self, color, center, radius):
-		draw.circle(self._display, color, _force_xy(center), radius, width=1)
+		draw.circle(self._display, color, _xy(center), radius, width=1)
 	
 	def _stroke_ellipse(self, color, corner, measure):
-		draw.ellipse(self._display, color, pygame.Rect(_force_xy(corner), _force_xy(measure)))
+		draw.ellipse(self._display, color, pygame.Rect(_xy(corner), _xy(measure)))
 	
 	def _stroke_arc(self, color, corner, measure, start_angle, stop_angle):
-		rect = pygame.Rect(_force_xy(corner), _force_xy(measure))
+		rect = pygame.Rect(_xy(corner), _xy(measure))
 		draw.arc(self._display, color, rect, start_angle, stop_angle)
 	
 	def _stroke_hlin(self, color, x1, x2, y):
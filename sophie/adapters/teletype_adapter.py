@@ -2,7 +2,7 @@ import sys
 import random
 from ..tree_walker.values import ParametricMessage
 from ..tree_walker.runtime import iterate_list
-from ..tree_walker.scheduler import NativeObjectProxy
+from ..tree_walker.scheduler import NativeObjectProxy, off_loop
 
 class Console:
 	@staticmethod
@@ -12,8 +12,8 @@ class Console:
 		sys.stdout.flush()
 
 	@staticmethod
-	def read(target:ParametricMessage):
-		target.dispatch_with(input())
+	async def read(target:ParametricMessage):
+		target.dispatch_with(await off_loop(input))
 
 	@staticmethod
 	def random(target:ParametricMessage):
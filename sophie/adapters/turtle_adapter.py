@@ -14,11 +14,9 @@ class Worker:
 		tortoise.accept_message("begin", ())
 		stepCount = 0
 		block = []
-		for record in iterate_list(drawing["steps"]):
+		for step in iterate_list(drawing.steps):
 			stepCount += 1
-			step = dict(record)  # Make a copy because of (deliberate) aliasing.
-			tag = step.pop("")
-			block.append((tag, *map(force, step.values())))  # Insertion-order is assured.
+			block.append((step.TAG, *map(force, step)))  # Fields are in declaration order.
 			if len(block) == 100:
 				tortoise.accept_message("block", (block,))
 				block = []
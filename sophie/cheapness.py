@@ -0,0 +1,125 @@
+"""
+Find expressions which cost less to evaluate than to delay, and which can neither fail nor diverge.
+The run-time evaluates these on the spot rather than making thunks of them.
+
+An expression is "ready" if its value is in hand with no work to speak of:
+literals, strict parameters, and match-subjects. Total primitive operations
+over ready operands are cheap and ready. So are record constructors over cheap
+arguments (ready, for strict fields), and lists of cheap elements.
+
+Division, modulus, and exponentiation are out because they can fail or take ages.
+So is any operator which some module overloads, since that might call arbitrary code.
+Strictness must already be known, so this runs after `analyze_demand`.
+It also relies on the type-checker to guarantee that operands are of primitive type.
+"""
+
+from boozetools.support.foundation import Visitor
+from . import syntax
+from .resolution import RoadMap
+
+_TOTAL_BINARY = {"+", "-", "*", "==", "!=", "<", "<=", ">", ">=", "<=>"}
+_TOTAL_UNARY = {"-", "NOT"}
+
+def analyze_cheapness(roadmap:RoadMap):
+	modules = [roadmap.preamble, *roadmap.each_module]
+	overloaded = {op.nom.key() for module in modules for op in module.user_operators}
+	for module in modules: Cheapness(overloaded).visit(module)
+
+class Cheapness(Visitor):
+	""" Each visit to an expression marks what is cheap within, and answers whether the expression is ready. """
+	def __init__(self, overloaded:set[str]):
+		self._overloaded = overloaded
+
+	def visit_Module(self, module:syntax.Module):
+		for sub in module.top_subs: self.visit(sub)
+		for actor in module.actors:
+			for behavior in actor.behaviors: self.visit(behavior)
+		for expr in module.main: self.visit(expr)
+
+	def visit_UserFunction(self, sub:syntax.Subroutine):
+		for inner in sub.where: self.visit(inner)
+		self.visit(sub.expr)
+
+	visit_UserOperator = visit_UserProcedure = visit_UserFunction
+
+	def _cheap(self, expr:syntax.ValueExpression, ready:bool) -> bool:
+		if ready: expr.cheap = True
+		return ready
+
+	@staticmethod
+	def visit_Literal(expr:syntax.Literal): return True
+
+	@staticmethod
+	def visit_Lookup(expr:syntax.Lookup):
+		sym = expr.ref.dfn
+		return type(sym) is syntax.Subject or (isinstance(sym, syntax.FormalParameter) and sym.is_strict)
+
+	def visit_BinExp(self, expr:syntax.BinExp):
+		lhs, rhs = self.visit(expr.lhs), self.visit(expr.rhs)
+		glyph = expr.op.text
+		return self._cheap(expr, lhs and rhs and glyph in _TOTAL_BINARY and glyph not in self._overloaded)
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp):
+		arg = self.visit(expr.arg)
+		glyph = expr.op.text
+		return self._cheap(expr, arg and glyph in _TOTAL_UNARY and glyph not in self._overloaded)
+
+	def visit_ShortCutExp(self, expr:syntax.ShortCutExp):
+		lhs, rhs = self.visit(expr.lhs), self.visit(expr.rhs)
+		return self._cheap(expr, lhs and rhs)
+
+	def visit_Cond(self, expr:syntax.Cond):
+		parts = [self.visit(expr.if_part), self.visit(expr.then_part), self.visit(expr.else_part)]
+		return self._cheap(expr, all(parts))
+
+	def visit_Call(self, expr:syntax.Call):
+		self.visit(expr.fn_exp)
+		ready = [self.visit(arg) for arg in expr.args]
+		dfn = expr.fn_exp.ref.dfn if type(expr.fn_exp) is syntax.Lookup else None
+		if not isinstance(dfn, (syntax.RecordSymbol, syntax.RecordTag)): return False
+		# The constructor forces any strict fields, so those arguments must be ready.
+		fields = dfn.spec.fields
+		return self._cheap(expr, all(r if f.is_strict else a.cheap for f, a, r in zip(fields, expr.args, ready)))
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList):
+		for elt in expr.elts: self.visit(elt)
+		return self._cheap(expr, all(elt.cheap for elt in expr.elts))
+
+	def visit_FieldReference(self, expr:syntax.FieldReference):
+		# The field itself might be a thunk, so reading it is not ready.
+		self.visit(expr.lhs)
+		return False
+
+	def visit_BindMethod(self, expr:syntax.BindMethod):
+		self.visit(expr.receiver)
+		return False
+
+	def visit_AsTask(self, expr:syntax.AsTask):
+		self.visit(expr.proc_ref)
+		return False
+
+	def visit_LambdaForm(self, expr:syntax.LambdaForm):
+		self.visit(expr.function)
+		return False
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr):
+		self.visit(expr.subject.expr)
+		for alt in expr.alternatives:
+			for inner in alt.where: self.visit(inner)
+			self.visit(alt.sub_expr)
+		if expr.otherwise is not None: self.visit(expr.otherwise)
+		return False
+
+	def visit_DoBlock(self, expr:syntax.DoBlock):
+		for actor in expr.actors: self.visit(actor.expr)
+		for step in expr.steps: self.visit(step)
+		return False
+
+	def visit_AssignMember(self, expr:syntax.AssignMember):
+		self.visit(expr.expr)
+		return False
+
+	@staticmethod
+	def visit_Skip(expr): return False
+	@staticmethod
+	def visit_Absurdity(expr): return False
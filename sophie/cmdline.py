@@ -25,6 +25,15 @@ EXPERIMENT = "to skip type-checking"
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+def mailbox_limit(text:str):
+	""" Parse [KIND=]N[:POLICY] into a pair (kind, (N, policy)). """
+	kind, _, rest = text.rpartition("=")
+	size, _, policy = rest.partition(":")
+	policy = policy or "block"
+	if not size.isdigit() or int(size) < 1 or policy not in ("block", "drop", "signal"):
+		raise argparse.ArgumentTypeError("expected [KIND=]N[:block|drop|signal] with N at least 1, not %r" % text)
+	return kind or "*", (int(size), policy)
+
 parser = argparse.ArgumentParser(
 	prog="sophie",
 	description="Interpreter for the Sophie programming langauge.",
@@ -33,8 +42,26 @@ parser.add_argument("program", help="try examples/turtle.sg for example.")
 parser.add_argument('-c', "--check", action="count", help="Check the program verbosely but do not actually execute the program.")
 parser.add_argument('-t', "--translate", action="store_true", help="Translate the program into input for the VM.")
 parser.add_argument('-x', "--experimental", action="store_true", help="Opt into experiment-mode, which is presently %s."%EXPERIMENT)
+parser.add_argument('-e', "--engine", choices=["walk", "closure", "stack", "tiered"], default="walk", help="Choose how the Python run-time evaluates expressions. The tree-walker is the reference.")
+parser.add_argument("--memo", action="append", default=[], metavar="NAME", help="Remember the results of the named function, and report hit-rates after. May be given more than once.")
+parser.add_argument("--memo-size", type=int, default=100_000, metavar="N", help="Remember at most this many results for each memoized function.")
+parser.add_argument("--speculate", type=int, default=0, metavar="STEPS", help="Stack engine only: Try evaluating each would-be thunk right away, giving up after this many steps.")
+parser.add_argument("--processes", type=int, default=0, metavar="N", help="Place user-defined actors in N worker processes, to use more than one core.")
+parser.add_argument("--stats", action="store_true", help="Report what the scheduler and actors did, after the program finishes.")
+parser.add_argument("--stats-sample", metavar="FILE", help="Also append scheduler statistics to this file as lines of JSON, every so often while the program runs.")
+parser.add_argument("--stats-interval", type=float, default=1.0, metavar="SECONDS", help="How often to sample for --stats-sample.")
+parser.add_argument("--scheduler", choices=["shared", "stealing", "asyncio"], default="shared", help="Choose how tasks find a thread: from one shared queue, by work-stealing, or as callbacks on an asyncio event loop.")
+parser.add_argument("--mailbox", action="append", type=mailbox_limit, default=[], metavar="[KIND=]N[:POLICY]", help="Let actors of this kind (or all, without KIND) keep at most N messages waiting. When full, a sender may block (the default), drop the oldest, or signal an error. May be given more than once.")
+parser.add_argument("--quantum", type=int, default=0, metavar="N", help="Let an actor handle at most N messages in one turn before others get a go.")
 
 def run(args):
+	if args.speculate and args.engine != "stack": parser.error("--speculate goes with the stack engine.")
+	if args.processes:
+		import multiprocessing
+		if "fork" not in multiprocessing.get_all_start_methods(): parser.error("--processes needs a platform that can fork.")
+		# Forking copies only the thread that forks. These threads might hold locks just then.
+		if args.scheduler == "asyncio": parser.error("--processes does not go with --scheduler asyncio.")
+		if args.stats_sample: parser.error("--processes does not go with --stats-sample.")
 	from .diagnostics import Report, TooManyIssues
 	from .resolution import RoadMap, Yuck
 	report = Report(verbose=args.check)
@@ -56,17 +83,30 @@ def run(args):
 		print(" *"*35, file=sys.stderr)
 		print("Giving up after a few issues. One crisis at a time, eh?", file=sys.stderr)
 		return 1
+	from .fusion import fuse
+	from .demand import analyze_demand
+	from .optimize import optimize
+	fuse(roadmap, report)
+	analyze_demand(roadmap)
+	optimize(roadmap, report, args.memo)
+	if not args.experimental:
+		from .cheapness import analyze_cheapness
+		analyze_cheapness(roadmap)
 	if args.check:
 		print("Looks plausible to me.", file=sys.stderr)
+	elif args.translate:
+		from .intermediate import translate
+		translate(roadmap)
 	else:
-		from .demand import analyze_demand
-		analyze_demand(roadmap)
-		if args.translate:
-			from .intermediate import translate
-			translate(roadmap)
-		else:
-			from .tree_walker.executive import run_program
-			run_program(roadmap)
+		from .tree_walker.executive import run_program, report_memo_tables, ENGINES
+		from .tree_walker.scheduler import STATS
+		if args.stats or args.stats_sample: STATS.enable()
+		if args.stats_sample: STATS.start_sampling(args.stats_sample, args.stats_interval)
+		try: run_program(roadmap, ENGINES[args.engine], args.memo, args.memo_size, args.speculate, args.scheduler, args.processes, dict(args.mailbox), args.quantum)
+		finally:
+			STATS.stop_sampling()
+			if args.stats: STATS.report(sys.stderr)
+		if args.memo: report_memo_tables()
 
 def main():
 	if len(sys.argv) > 1:
@@ -13,19 +13,77 @@ from .resolution import RoadMap, TopDown
 
 
 def analyze_demand(roadmap:RoadMap):
-	call_graph = DeterminedCallGraphPass(roadmap).graph
+	graph_pass = DeterminedCallGraphPass(roadmap)
+	call_graph = graph_pass.graph
 	outer = {udf:set() for udf in call_graph.keys()}
-	for component in strongly_connected_components_hashable(call_graph):
-		again = [True]
-		while any(again):
-			again = [DemandPass(udf, outer).grew for udf in component]
+	# Stricter functions may make for stricter signatures on functional parameters, and vice-versa.
+	grew = True
+	while grew:
+		for component in strongly_connected_components_hashable(call_graph):
+			again = [True]
+			while any(again):
+				again = [DemandPass(udf, outer).grew for udf in component]
+		grew = _sign_functional_parameters(graph_pass)
+
+def _sign_functional_parameters(graph_pass:"DeterminedCallGraphPass") -> bool:
+	"""
+	A parameter of a function which is only ever called directly by name can only hold
+	whatever the call sites pass in. If all of those are strict in some argument position,
+	then so is a call through that parameter. This works out the greatest such signature
+	for each parameter, and reports whether any of them grew.
+	
+	Anything else may take any function at all, so it gets the empty signature.
+	"""
+	every = frozenset(range(graph_pass.max_arity))
+	closed = {udf: sites for udf, sites in graph_pass.sites.items() if udf not in graph_pass.escaped}
+	signature = {param: None for udf in closed for param in udf.params}  # None: No evidence yet.
+	
+	def sign(actual) -> Optional[frozenset]:
+		if isinstance(actual, syntax.LambdaForm):
+			return _strict_positions(actual.function.params)
+		if not isinstance(actual, syntax.Lookup): return frozenset()
+		dfn = actual.ref.dfn
+		if isinstance(dfn, syntax.FormalParameter): return signature.get(dfn, frozenset())
+		if isinstance(dfn, syntax.UserFunction) and dfn.params: return _strict_positions(dfn.params)
+		if isinstance(dfn, (syntax.RecordSymbol, syntax.RecordTag)): return frozenset(dfn.spec.strictures)
+		if isinstance(dfn, syntax.FFI_Alias) and callable(dfn.val): return every  # Primitives force everything.
+		return frozenset()
+	
+	changed = True
+	while changed:
+		changed = False
+		for udf, sites in closed.items():
+			for i, param in enumerate(udf.params):
+				known = signature[param]
+				for args in sites:
+					it = sign(args[i])
+					if it is not None: known = it if known is None else known & it
+				if known != signature[param]:
+					signature[param] = known
+					changed = True
+	
+	grew = False
+	for param, known in signature.items():
+		strictures = tuple(sorted(known or ()))
+		if strictures != param.strictures:
+			param.strictures = strictures
+			grew = True
+	return grew
+
+def _strict_positions(params) -> frozenset:
+	return frozenset(i for i, p in enumerate(params) if p.is_strict)
 
 
 class DeterminedCallGraphPass(TopDown):
 	graph : dict[Optional[syntax.UserFunction],set]
+	sites : dict[syntax.UserFunction, list[list[syntax.ValueExpression]]]  # Arguments at each call by name
+	escaped : set[syntax.UserFunction]  # Those mentioned other than by calling them
 	
 	def __init__(self, roadmap:RoadMap):
 		self.graph = {None:set()}
+		self.sites = {}
+		self.escaped = set()
+		self.max_arity = 0
 		
 		self.analyze_module(roadmap.preamble)
 		for module in roadmap.each_module:
@@ -37,6 +95,8 @@ class DeterminedCallGraphPass(TopDown):
 		for udf in module.all_fns:
 			if isinstance(udf, syntax.UserFunction):
 				self.graph[udf] = set()
+				self.sites[udf] = []
+				if type(udf) is not syntax.UserFunction: self.escaped.add(udf)
 		self.tour(module.top_subs)
 		self.tour(module.actors)
 		for expr in module.main:
@@ -58,25 +118,33 @@ class DeterminedCallGraphPass(TopDown):
 		self.visit(proc.expr, None)
 	
 	def visit_Call(self, call: syntax.Call, src):
+		self.max_arity = max(self.max_arity, len(call.args))
 		if isinstance(call.fn_exp, syntax.Lookup):
 			target = call.fn_exp.ref.dfn
 			if isinstance(target, syntax.UserFunction):
 				self.graph[src].add(target)
+				self.sites[target].append(call.args)
 		elif isinstance(call.fn_exp, syntax.LambdaForm):
-			self.graph[src].add(call.fn_exp.function)
-		self.visit(call.fn_exp, src)
+			function = call.fn_exp.function
+			self.graph[src].add(function)
+			self.sites[function].append(call.args)
+			self.visit_UserFunction(function)
+		else:
+			self.visit(call.fn_exp, src)
 		for a in call.args:
 			self.visit(a, src)
 	
 	def visit_Lookup(self, lu:syntax.Lookup, src):
 		# If the dfn has no parameters, then make a link,
 		# for it corresponds to calling a 0-ary function.
+		# Otherwise, the function is a value which anything might call.
 		dfn = lu.ref.dfn
 		if isinstance(dfn, syntax.UserFunction):
-			if not dfn.params:
-				self.graph[src].add(dfn)
+			if dfn.params: self.escaped.add(dfn)
+			else: self.graph[src].add(dfn)
 	
 	def visit_LambdaForm(self, lf:syntax.LambdaForm, _src):
+		self.escaped.add(lf.function)
 		self.visit_UserFunction(lf.function)
 
 	def visit_MatchExpr(self, mx:syntax.MatchExpr, src):
@@ -139,9 +207,10 @@ class DemandPass(Visitor):
 			elif isinstance(target, syntax.FFI_Alias):
 				return self._union(call.args)
 			elif isinstance(target, syntax.FormalParameter):
-				return {target}
-			elif isinstance(target, (syntax.TypeCase, syntax.RecordSymbol)):
-				return EMPTY
+				# Whatever the parameter holds will force the arguments in its signature.
+				return {target}.union(*[self.visit(call.args[i]) for i in target.strictures if i < len(call.args)])
+			elif isinstance(target, (syntax.RecordTag, syntax.RecordSymbol)):
+				return self._union(call.args[i] for i in target.spec.strictures)
 			elif isinstance(target, syntax.UserActor):
 				# This is a rough spot. In general, the params to a syntax.UserActor
 				# will eventually be strict, but the stricture happens later when the
@@ -152,6 +221,11 @@ class DemandPass(Visitor):
 				assert False, type(target)  # How to analyze this target?
 		elif isinstance(call.fn_exp, syntax.BindMethod):
 			return self.visit(call.fn_exp) | self._union(call.args)
+		elif isinstance(call.fn_exp, syntax.LambdaForm):
+			# Calling a lambda on the spot is much like calling a named function.
+			function = call.fn_exp.function
+			eager = [self.visit(actual) for formal, actual in zip(function.params, call.args) if formal.is_strict]
+			return self._outer.get(function, EMPTY).union(*eager)
 		return self.visit(call.fn_exp)
 
 	def visit_MatchExpr(self, mx:syntax.MatchExpr):
@@ -0,0 +1,241 @@
+"""
+Fuse pipelines of the preamble's list functions, so they stop building lists only to take them apart.
+
+Calls are recognized by the identity of the preamble symbol, not merely the name.
+These rewrites apply, innermost first, for as long as any of them does:
+
+	map(f, map(g, xs))                -->  map({x | f(g(x))}, xs)
+	filter(p, filter(q, xs))          -->  filter({x | q(x) and p(x)}, xs)
+	reduce(fn, a, map(g, xs))         -->  reduce({acc, x | fn(acc, g(x))}, a, xs)
+	reduce(fn, a, filter(p, xs))      -->  reduce({acc, x | fn(acc, x) if p(x) else acc}, a, xs)
+	reduce(fn, a, iota(lo, hi))       -->  reduce_range(fn, a, lo, hi)
+	reduce(fn, a, take(n, xs))        -->  reduce_take(fn, a, n, xs)
+	reduce(fn, a, take_while(p, xs))  -->  reduce_while(fn, a, p, xs)
+	sum(xs), length(xs)               -->  the equivalent reduce, if that will fuse.
+
+Function arguments must be names or lambda-forms, since the fused code evaluates them once per element.
+Each rewrite forces no more than the original would have, in no different an order that anyone could see.
+
+This runs after type-checking but before demand analysis, which therefore sees the fused code.
+"""
+
+from boozetools.support.foundation import Visitor
+from . import syntax
+from .ontology import Nom, MemoSchedule, SELF
+from .diagnostics import Report
+from .resolution import RoadMap
+
+_PRODUCERS = ("map", "filter", "iota", "take", "take_while")
+_FUNCTIONAL = (syntax.Lookup, syntax.LambdaForm)
+
+def fuse(roadmap:RoadMap, report:Report):
+	preamble = {sub.nom.text: sub for sub in roadmap.preamble.top_subs}
+	top_level = {sub for module in [roadmap.preamble, *roadmap.each_module] for sub in module.top_subs}
+	for module in [roadmap.preamble, *roadmap.each_module]:
+		fusion = Fusion(module, preamble, top_level)
+		report.info("Fuse", module.source_path, "fused %d" % fusion.fused)
+
+class Fusion(Visitor):
+	""" Each visit to an expression returns its replacement, which may be the same expression. """
+	def __init__(self, module:syntax.Module, preamble:dict, top_level:set):
+		self._module = module
+		self._preamble = preamble
+		self._top_level = top_level
+		self.fused = 0
+		for sub in module.top_subs: self.visit(sub)
+		for actor in module.actors:
+			for behavior in actor.behaviors: self.visit(behavior)
+		module.main = [self.visit(expr) for expr in module.main]
+
+	# Definitions:
+
+	def visit_UserFunction(self, sub:syntax.Subroutine):
+		for inner in sub.where: self.visit(inner)
+		sub.expr = self.visit(sub.expr)
+
+	visit_UserOperator = visit_UserProcedure = visit_UserFunction
+
+	# Expressions which contain nothing to fuse:
+
+	@staticmethod
+	def visit_Literal(expr): return expr
+	@staticmethod
+	def visit_Lookup(expr): return expr
+	@staticmethod
+	def visit_Skip(expr): return expr
+	@staticmethod
+	def visit_Absurdity(expr): return expr
+
+	# Expressions which might:
+
+	def visit_BinExp(self, expr:syntax.Binary):
+		expr.lhs, expr.rhs = self.visit(expr.lhs), self.visit(expr.rhs)
+		return expr
+
+	visit_ShortCutExp = visit_BinExp
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp):
+		expr.arg = self.visit(expr.arg)
+		return expr
+
+	def visit_Cond(self, expr:syntax.Cond):
+		expr.if_part = self.visit(expr.if_part)
+		expr.then_part = self.visit(expr.then_part)
+		expr.else_part = self.visit(expr.else_part)
+		return expr
+
+	def visit_FieldReference(self, expr:syntax.FieldReference):
+		expr.lhs = self.visit(expr.lhs)
+		return expr
+
+	def visit_BindMethod(self, expr:syntax.BindMethod):
+		expr.receiver = self.visit(expr.receiver)
+		return expr
+
+	def visit_AsTask(self, expr:syntax.AsTask):
+		expr.proc_ref = self.visit(expr.proc_ref)
+		return expr
+
+	def visit_LambdaForm(self, expr:syntax.LambdaForm):
+		self.visit(expr.function)
+		return expr
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList):
+		expr.elts = [self._keep(e, self.visit(e)) for e in expr.elts]
+		return expr
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr):
+		expr.subject.expr = self.visit(expr.subject.expr)
+		for alt in expr.alternatives:
+			for inner in alt.where: self.visit(inner)
+			alt.sub_expr = self.visit(alt.sub_expr)
+		if expr.otherwise is not None: expr.otherwise = self.visit(expr.otherwise)
+		return expr
+
+	def visit_DoBlock(self, expr:syntax.DoBlock):
+		for actor in expr.actors: actor.expr = self.visit(actor.expr)
+		expr.steps = [self.visit(step) for step in expr.steps]
+		return expr
+
+	def visit_AssignMember(self, expr:syntax.AssignMember):
+		expr.expr = self.visit(expr.expr)
+		return expr
+
+	def visit_Call(self, expr:syntax.Call):
+		expr.fn_exp = self.visit(expr.fn_exp)
+		expr.args = [self._keep(a, self.visit(a)) for a in expr.args]
+		while True:
+			it = self._fuse(expr)
+			if it is None: return expr
+			self.fused += 1
+			expr = self._keep(expr, it)
+
+	# The rewrites:
+
+	def _callee(self, expr:syntax.ValueExpression):
+		""" The name of the preamble function this calls, if any. """
+		if type(expr) is syntax.Call and type(expr.fn_exp) is syntax.Lookup:
+			dfn = expr.fn_exp.ref.dfn
+			name = dfn.nom.text
+			if self._preamble.get(name) is dfn and len(expr.args) == len(dfn.params): return name
+
+	def _fuse(self, expr:syntax.Call):
+		outer = self._callee(expr)
+		if outer in ("sum", "length"):
+			[xs] = expr.args
+			if self._callee(xs) not in _PRODUCERS: return
+			spot = expr.left()
+			if outer == "sum": fn = self._global("add", expr)
+			else: fn = self._lambda(expr, ("n", "x"), lambda n, x: syntax.BinExp(self._ref(n), Nom("+", spot), syntax.Literal(1, spot)))
+			return self._call("reduce", expr, fn, syntax.Literal(0, spot), xs)
+		if outer not in ("map", "filter", "reduce"): return
+		*front, xs = expr.args
+		inner = self._callee(xs)
+		if inner not in _PRODUCERS: return
+		if outer == "reduce":
+			fn, a = front
+			if not isinstance(fn, _FUNCTIONAL): return
+			if inner == "map":
+				g, ys = xs.args
+				if not isinstance(g, _FUNCTIONAL): return
+				step = self._lambda(expr, ("acc", "x"), lambda acc, x: self._apply(fn, self._ref(acc), self._apply(g, self._ref(x))))
+				return self._call("reduce", expr, step, a, ys)
+			if inner == "filter":
+				p, ys = xs.args
+				if not isinstance(p, _FUNCTIONAL): return
+				step = self._lambda(expr, ("acc", "x"), lambda acc, x: syntax.Cond(
+					self._apply(fn, self._ref(acc), self._ref(x)), Nom("if", expr.left()), self._apply(p, self._ref(x)), self._ref(acc),
+				))
+				return self._call("reduce", expr, step, a, ys)
+			if inner == "iota": return self._call("reduce_range", expr, fn, a, *xs.args)
+			if inner == "take": return self._call("reduce_take", expr, fn, a, *xs.args)
+			if inner == "take_while": return self._call("reduce_while", expr, fn, a, *xs.args)
+		elif outer == inner == "map":
+			[f], (g, ys) = front, xs.args
+			if not isinstance(f, _FUNCTIONAL) or not isinstance(g, _FUNCTIONAL): return
+			return self._call("map", expr, self._lambda(expr, ("x",), lambda x: self._apply(f, self._apply(g, self._ref(x)))), ys)
+		elif outer == inner == "filter":
+			[p], (q, ys) = front, xs.args
+			if not isinstance(p, _FUNCTIONAL) or not isinstance(q, _FUNCTIONAL): return
+			both = self._lambda(expr, ("x",), lambda x: syntax.ShortCutExp(self._apply(q, self._ref(x)), Nom("AND", expr.left()), self._apply(p, self._ref(x))))
+			return self._call("filter", expr, both, ys)
+
+	# Building blocks for the rewrites. They fill in what the resolver would have.
+
+	@staticmethod
+	def _keep(expr:syntax.ValueExpression, it:syntax.ValueExpression) -> syntax.ValueExpression:
+		# A replacement uses nothing the original did not, so it may capture the same.
+		if it.captures is None: it.captures = expr.captures
+		return it
+
+	def _global(self, name:str, near:syntax.ValueExpression) -> syntax.Lookup:
+		return self._ref(self._preamble[name], near.left())
+
+	@staticmethod
+	def _ref(sym:syntax.Symbol, spot:int=None) -> syntax.Lookup:
+		ref = syntax.PlainReference(Nom(sym.nom.text, sym.nom.left() if spot is None else spot))
+		ref.dfn = sym
+		return syntax.Lookup(ref)
+
+	def _call(self, name:str, near:syntax.Call, *args:syntax.ValueExpression) -> syntax.Call:
+		for a in args:
+			if a.captures is None: a.captures = self._free(a)
+		return syntax.Call(self._global(name, near), list(args))
+
+	def _apply(self, fn:syntax.ValueExpression, *args:syntax.ValueExpression) -> syntax.Call:
+		for a in args: a.captures = self._free(a)
+		return syntax.Call(fn, list(args))
+
+	def _lambda(self, near:syntax.ValueExpression, names:tuple, build) -> syntax.LambdaForm:
+		spot = near.left()
+		params = [syntax.FormalParameter(None, Nom(name, spot), None) for name in names]
+		body = build(*params)
+		form = syntax.LambdaForm(Nom("{", spot), params, body, Nom("}", spot))
+		function = form.function
+		function.source_path = self._module.source_path
+		function.captures = set(self._free(body)).difference(params)
+		function.memo_schedule = MemoSchedule(tuple(range(len(params))), tuple(function.captures))
+		self._module.all_fns.append(function)
+		form.captures = tuple(function.captures)
+		return form
+
+	def _free(self, expr:syntax.ValueExpression) -> tuple:
+		""" The local symbols an expression built by these rewrites refers to. """
+		kind = type(expr)
+		if kind is syntax.Lookup:
+			dfn = expr.ref.dfn
+			if dfn is SELF or isinstance(dfn, (syntax.FormalParameter, syntax.Subject, syntax.NewActor)): return (dfn,)
+			if isinstance(dfn, syntax.Subroutine) and dfn not in self._top_level: return (dfn,)
+			return ()
+		if kind is syntax.LambdaForm: return tuple(expr.function.captures)
+		if kind is syntax.Call:
+			found = list(self._free(expr.fn_exp))
+			for a in expr.args: found.extend(s for s in self._free(a) if s not in found)
+			return tuple(found)
+		if expr.captures is not None: return expr.captures
+		if kind is syntax.Cond: parts = (expr.if_part, expr.then_part, expr.else_part)
+		elif kind is syntax.BinExp or kind is syntax.ShortCutExp: parts = (expr.lhs, expr.rhs)
+		else: parts = ()
+		found = []
+		for part in parts: found.extend(s for s in self._free(part) if s not in found)
+		return tuple(found)
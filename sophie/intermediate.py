@@ -200,8 +200,8 @@ class VMActorScope(VMScope):
 		emit(1 + len(behavior.params), quote(behavior.nom.text))
 		inner.declare(SELF)
 		inner.declare_several(behavior.params)
-		behavior.captures.discard(SELF)
 		for member in behavior.captures:
+			if member is SELF: continue
 			assert isinstance(member, syntax.FormalParameter)
 			inner.emit_reads_member(member)
 		inner.write_inner_functions(behavior.where)
@@ -520,7 +520,8 @@ class LazyContext(Context):
 	
 	@staticmethod
 	def _thunk_it(expr:syntax.ValueExpression, scope: VMFunctionScope):
-		scope.make_thunk(expr)
+		if expr.cheap: FORCE.visit(expr, scope)
+		else: scope.make_thunk(expr)
 	
 	visit_Call = _thunk_it
 	visit_BinExp = _thunk_it
@@ -547,20 +548,31 @@ class LazyContext(Context):
 
 def _prepare_arguments_for_call(call: syntax.Call, scope: VMFunctionScope):
 	# If the thing we're calling is syntactically:
-	#     a function by name, then find and respect its strictness declarations.
+	#     a function or record constructor by name, then find and respect its strictness declarations.
+	#     a parameter with a known signature, then respect that.
 	#     a bound method, then evaluate all arguments eagerly.
 	#     anything else, then delay everything and rely on the calling convention.
 	# There's probably a way to break this out into a pass of its own, but meh.
 	
 	if isinstance(call.fn_exp, syntax.Lookup):
 		sym = call.fn_exp.ref.dfn
-		if isinstance(sym, syntax.UserFunction):
-			for param, arg in zip(sym.params, call.args):
+		if isinstance(sym, syntax.UserFunction): params = sym.params
+		elif isinstance(sym, (syntax.RecordSymbol, syntax.RecordTag)): params = sym.spec.fields
+		else: params = ()
+		if params:
+			for param, arg in zip(params, call.args):
 				if param.is_strict:
 					FORCE.visit(arg, scope)
 				else:
 					DELAY.visit(arg, scope)
 			return
+		if isinstance(sym, syntax.FormalParameter) and sym.strictures:
+			for i, arg in enumerate(call.args):
+				if i in sym.strictures:
+					FORCE.visit(arg, scope)
+				else:
+					DELAY.visit(arg, scope)
+			return
 	if isinstance(call.fn_exp, syntax.BindMethod):
 		for arg in call.args: FORCE.visit(arg, scope)
 		return
@@ -7,7 +7,7 @@ to get help from the IDE to make sure those fields stay sane,
 but in consequence these abstract base classes need to remain
 separate from the rest.
 """
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 
 class Phrase:
 	def left(self) -> int:
@@ -52,7 +52,13 @@ class TermSymbol(Symbol): pass
 class TypeExpression(Phrase):
 	def dispatch_token(self): raise NotImplementedError(type(self))
 
-class ValueExpression(Phrase): pass
+class ValueExpression(Phrase):
+	# For arguments and list elements, the resolver notes which local terms the expression uses,
+	# so the run-time can delay it without holding on to the rest of the frame.
+	captures: Optional[tuple[TermSymbol, ...]] = None
+	# Cheap expressions cost less to evaluate than to delay, and can neither fail nor diverge.
+	# So there is no point making a thunk for them. The cheapness pass marks the less obvious ones.
+	cheap: bool = False
 
 
 SELF = TermSymbol(Nom("SELF", None))
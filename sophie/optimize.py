@@ -0,0 +1,484 @@
+"""
+A few classic optimizations over the resolved (and type-checked) syntax tree.
+Everything here is optional: the run-time must give the same answers with or without it.
+
+* Fold arithmetic, comparisons, and logic on literal operands, as the primitive operators would.
+* Inline small, non-recursive top-level functions where the call and all its arguments are simple,
+  except those the user asked to memoize, whose calls must stay calls to do any good.
+* Drop where-clause definitions which nothing uses.
+* Hoist lists of constants out of functions, so they get built once rather than per call.
+* Lift where-clause functions that capture nothing local up to the top level,
+  so they are not built afresh each time the enclosing function runs.
+
+Delayed expressions (arguments and list elements) carry the `captures` the resolver
+worked out for them. A replacement never uses more than the expression it replaces,
+so it may inherit the original's captures. Inlined code gets its captures worked out
+afresh, in terms of the arguments it was given.
+"""
+
+from copy import copy
+from typing import Sequence, Iterable
+from boozetools.support.foundation import Visitor, strongly_connected_components_hashable
+from . import syntax
+from .ontology import Nom, MemoSchedule
+from .diagnostics import Report
+from .resolution import RoadMap
+from .tree_walker.runtime import PRIMITIVE_BINARY, PRIMITIVE_UNARY, SHORTCUT
+
+INLINE_SIZE = 12  # Bodies with more nodes than this stay where they are.
+INLINE_DEPTH = 4  # Inlined code may itself inline calls, but only so deep.
+
+_SIMPLE = (syntax.Literal, syntax.Lookup)
+_INLINE_GRAMMAR = {
+	syntax.Literal, syntax.Lookup, syntax.BinExp, syntax.UnaryExp, syntax.ShortCutExp,
+	syntax.Cond, syntax.Call, syntax.FieldReference, syntax.ExplicitList,
+}
+
+def optimize(roadmap:RoadMap, report:Report, memoize:Iterable[str]=()):
+	memoize = set(memoize)
+	for module in [roadmap.preamble, *roadmap.each_module]:
+		opt = Optimizer(module, memoize)
+		report.info("Optimize", module.source_path, opt.summary())
+
+def _foldable(value) -> bool:
+	# Only results the engines and the VM are sure to represent the same as if computed at run-time.
+	if isinstance(value, (bool, float)): return True
+	if isinstance(value, int): return abs(value) < 2**63
+	if isinstance(value, str): return len(value) <= 256
+	return False
+
+def _worth_trying(glyph:str, a, b) -> bool:
+	# Some operations on small literals make enormous results, which might never be needed.
+	if glyph == "^": return not isinstance(b, (int, float)) or abs(b) <= 64
+	if glyph == "*": return not (isinstance(a, str) or isinstance(b, str))
+	return True
+
+def _size(expr:syntax.ValueExpression) -> int:
+	""" Number of nodes, or something too big, if the expression is outside the inlining grammar. """
+	kind = type(expr)
+	if kind not in _INLINE_GRAMMAR: return INLINE_SIZE + 1
+	if kind is syntax.BinExp or kind is syntax.ShortCutExp: return 1 + _size(expr.lhs) + _size(expr.rhs)
+	if kind is syntax.UnaryExp: return 1 + _size(expr.arg)
+	if kind is syntax.Cond: return 1 + _size(expr.if_part) + _size(expr.then_part) + _size(expr.else_part)
+	if kind is syntax.Call: return 1 + _size(expr.fn_exp) + sum(map(_size, expr.args))
+	if kind is syntax.FieldReference: return 1 + _size(expr.lhs)
+	if kind is syntax.ExplicitList: return 1 + sum(map(_size, expr.elts))
+	return 1
+
+def _mentions(expr:syntax.ValueExpression) -> set:
+	""" The symbols an expression within the inlining grammar refers to. """
+	kind = type(expr)
+	if kind is syntax.Lookup: return {expr.ref.dfn}
+	if kind is syntax.BinExp or kind is syntax.ShortCutExp: return _mentions(expr.lhs) | _mentions(expr.rhs)
+	if kind is syntax.UnaryExp: return _mentions(expr.arg)
+	if kind is syntax.Cond: return _mentions(expr.if_part) | _mentions(expr.then_part) | _mentions(expr.else_part)
+	if kind is syntax.Call: return _mentions(expr.fn_exp).union(*map(_mentions, expr.args))
+	if kind is syntax.FieldReference: return _mentions(expr.lhs)
+	if kind is syntax.ExplicitList: return set().union(*map(_mentions, expr.elts))
+	return set()
+
+def _inlinable(module:syntax.Module, memoize:set[str]) -> set[syntax.UserFunction]:
+	candidates = {
+		sub for sub in module.top_subs
+		if type(sub) is syntax.UserFunction and sub.params and not sub.where and _size(sub.expr) <= INLINE_SIZE
+		and sub.nom.text not in memoize
+	}
+	graph = {sub: _mentions(sub.expr) & candidates for sub in candidates}
+	for scc in strongly_connected_components_hashable(graph):
+		if len(scc) > 1 or scc[0] in graph[scc[0]]: candidates.difference_update(scc)
+	return candidates
+
+class Substitute(Visitor):
+	""" Copy an inlining-grammar expression, with arguments in place of the parameters. """
+	def __init__(self, args:dict[syntax.FormalParameter, syntax.ValueExpression]):
+		self._args = args
+
+	def _delayed(self, expr:syntax.ValueExpression) -> syntax.ValueExpression:
+		it = self.visit(expr)
+		if expr.captures is not None:
+			uses = []
+			for sym in expr.captures:
+				for c in self._args[sym].captures or ():
+					if c not in uses: uses.append(c)
+			it.captures = tuple(uses)
+		return it
+
+	@staticmethod
+	def visit_Literal(expr:syntax.Literal):
+		return copy(expr)
+
+	def visit_Lookup(self, expr:syntax.Lookup):
+		return copy(self._args.get(expr.ref.dfn, expr))
+
+	def visit_BinExp(self, expr:syntax.Binary):
+		it = copy(expr)
+		it.lhs, it.rhs = self.visit(expr.lhs), self.visit(expr.rhs)
+		return it
+
+	visit_ShortCutExp = visit_BinExp
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp):
+		it = copy(expr)
+		it.arg = self.visit(expr.arg)
+		return it
+
+	def visit_Cond(self, expr:syntax.Cond):
+		it = copy(expr)
+		it.if_part, it.then_part, it.else_part = self.visit(expr.if_part), self.visit(expr.then_part), self.visit(expr.else_part)
+		return it
+
+	def visit_Call(self, expr:syntax.Call):
+		it = copy(expr)
+		it.fn_exp, it.args = self.visit(expr.fn_exp), [self._delayed(a) for a in expr.args]
+		return it
+
+	def visit_FieldReference(self, expr:syntax.FieldReference):
+		it = copy(expr)
+		it.lhs = self.visit(expr.lhs)
+		return it
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList):
+		it = copy(expr)
+		it.elts = [self._delayed(e) for e in expr.elts]
+		return it
+
+class Optimizer(Visitor):
+	"""
+	Each visit to an expression returns its replacement, which may be the same expression.
+	Visits to other things rearrange them in place.
+	"""
+	def __init__(self, module:syntax.Module, memoize:set[str]=frozenset()):
+		self._module = module
+		self._inlinable = _inlinable(module, memoize)
+		self._constants = set()
+		self._in_function = False
+		self._depth = 0
+		self.folded = self.inlined = self.dropped = self.hoisted = self.lifted = 0
+		for sub in list(module.top_subs): self.visit(sub)
+		for actor in module.actors:
+			for behavior in actor.behaviors: self.visit(behavior)
+		module.main = [self.visit(expr) for expr in module.main]
+		self._drop_dead_where_and_lift()
+
+	def summary(self):
+		return "folded %d, inlined %d, dropped %d, hoisted %d, lifted %d" % (self.folded, self.inlined, self.dropped, self.hoisted, self.lifted)
+
+	def _replace(self, expr:syntax.ValueExpression, it:syntax.ValueExpression) -> syntax.ValueExpression:
+		if it.captures is None: it.captures = expr.captures
+		return it
+
+	def _fold(self, expr:syntax.ValueExpression, value) -> syntax.ValueExpression:
+		self.folded += 1
+		return self._replace(expr, syntax.Literal(value, expr.left()))
+
+	# Definitions:
+
+	def visit_UserFunction(self, sub:syntax.Subroutine):
+		prior = self._in_function
+		self._in_function = prior or bool(sub.params)
+		for inner in sub.where: self.visit(inner)
+		sub.expr = self.visit(sub.expr)
+		self._in_function = prior
+
+	visit_UserOperator = visit_UserProcedure = visit_UserFunction
+
+	# Expressions:
+
+	@staticmethod
+	def visit_Literal(expr): return expr
+	@staticmethod
+	def visit_Lookup(expr): return expr
+	@staticmethod
+	def visit_Skip(expr): return expr
+	@staticmethod
+	def visit_Absurdity(expr): return expr
+
+	def visit_BinExp(self, expr:syntax.BinExp):
+		expr.lhs, expr.rhs = self.visit(expr.lhs), self.visit(expr.rhs)
+		glyph = expr.op.text
+		if glyph in PRIMITIVE_BINARY and glyph != "<=>" and type(expr.lhs) is syntax.Literal and type(expr.rhs) is syntax.Literal:
+			a, b = expr.lhs.value, expr.rhs.value
+			if not _worth_trying(glyph, a, b): return expr
+			try: value = PRIMITIVE_BINARY[glyph](a, b)
+			except (ArithmeticError, TypeError, ValueError): return expr  # Leave the run-time to deal with it.
+			if _foldable(value): return self._fold(expr, value)
+		return expr
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp):
+		expr.arg = self.visit(expr.arg)
+		if type(expr.arg) is syntax.Literal:
+			try: value = PRIMITIVE_UNARY[expr.op.text](expr.arg.value)
+			except (ArithmeticError, TypeError): return expr
+			if _foldable(value): return self._fold(expr, value)
+		return expr
+
+	def visit_ShortCutExp(self, expr:syntax.ShortCutExp):
+		expr.lhs, expr.rhs = self.visit(expr.lhs), self.visit(expr.rhs)
+		if type(expr.lhs) is syntax.Literal and isinstance(expr.lhs.value, bool):
+			self.folded += 1
+			if expr.lhs.value == SHORTCUT[expr.op.text]: return self._replace(expr, expr.lhs)
+			else: return self._replace(expr, expr.rhs)
+		return expr
+
+	def visit_Cond(self, expr:syntax.Cond):
+		expr.if_part = self.visit(expr.if_part)
+		expr.then_part = self.visit(expr.then_part)
+		expr.else_part = self.visit(expr.else_part)
+		if type(expr.if_part) is syntax.Literal and isinstance(expr.if_part.value, bool):
+			self.folded += 1
+			return self._replace(expr, expr.then_part if expr.if_part.value else expr.else_part)
+		return expr
+
+	def visit_Call(self, expr:syntax.Call):
+		expr.fn_exp = self.visit(expr.fn_exp)
+		expr.args = [self._replace(a, self.visit(a)) for a in expr.args]
+		callee = expr.fn_exp.ref.dfn if type(expr.fn_exp) is syntax.Lookup else None
+		if callee in self._inlinable and self._depth < INLINE_DEPTH and all(type(a) in _SIMPLE for a in expr.args):
+			self.inlined += 1
+			body = Substitute(dict(zip(callee.params, expr.args))).visit(callee.expr)
+			self._depth += 1
+			body = self.visit(body)
+			self._depth -= 1
+			return self._replace(expr, body)
+		return expr
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList):
+		expr.elts = [self._replace(e, self.visit(e)) for e in expr.elts]
+		if self._in_function and all(self._is_constant(e) for e in expr.elts):
+			return self._replace(expr, self._hoist(expr))
+		return expr
+
+	def _is_constant(self, expr:syntax.ValueExpression) -> bool:
+		return type(expr) is syntax.Literal or (type(expr) is syntax.Lookup and expr.ref.dfn in self._constants)
+
+	def _hoist(self, expr:syntax.ExplicitList) -> syntax.Lookup:
+		""" Make the list into a top-level constant, and refer to that instead. """
+		self.hoisted += 1
+		nom = Nom(syntax._gensym(), expr.left())
+		sub = syntax.UserFunction(nom, (), None, expr, None)
+		sub.source_path = self._module.source_path
+		sub.captures = set()
+		sub.memo_schedule = MemoSchedule((), ())
+		self._module.top_subs.append(sub)
+		self._module.all_fns.append(sub)
+		self._constants.add(sub)
+		ref = syntax.PlainReference(nom)
+		ref.dfn = sub
+		return syntax.Lookup(ref)
+
+	def visit_FieldReference(self, expr:syntax.FieldReference):
+		expr.lhs = self.visit(expr.lhs)
+		return expr
+
+	def visit_BindMethod(self, expr:syntax.BindMethod):
+		expr.receiver = self.visit(expr.receiver)
+		return expr
+
+	def visit_AsTask(self, expr:syntax.AsTask):
+		expr.proc_ref = self.visit(expr.proc_ref)
+		return expr
+
+	def visit_LambdaForm(self, expr:syntax.LambdaForm):
+		self.visit(expr.function)
+		return expr
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr):
+		expr.subject.expr = self.visit(expr.subject.expr)
+		for alt in expr.alternatives:
+			for inner in alt.where: self.visit(inner)
+			alt.sub_expr = self.visit(alt.sub_expr)
+		if expr.otherwise is not None: expr.otherwise = self.visit(expr.otherwise)
+		return expr
+
+	def visit_DoBlock(self, expr:syntax.DoBlock):
+		for actor in expr.actors: actor.expr = self.visit(actor.expr)
+		expr.steps = [self.visit(step) for step in expr.steps]
+		return expr
+
+	def visit_AssignMember(self, expr:syntax.AssignMember):
+		expr.expr = self.visit(expr.expr)
+		return expr
+
+	# Dead where-clauses:
+
+	def _drop_dead_where_and_lift(self):
+		sweep = Sweep()
+		module = self._module
+		for sub in module.top_subs: sweep.visit(sub)
+		for actor in module.actors:
+			for behavior in actor.behaviors: sweep.visit(behavior)
+		for expr in module.main: sweep.visit(expr)
+		self.dropped = len(sweep.dead)
+		if sweep.dead:
+			module.all_fns[:] = [sub for sub in module.all_fns if sub not in sweep.dead]
+			module.all_procs[:] = [sub for sub in module.all_procs if sub not in sweep.dead]
+		lift = Lift(module)
+		self.lifted = len(lift.lifted)
+		if sweep.dead or lift.lifted:
+			Prune(sweep.dead | lift.lifted).tour(sweep.live)
+
+class Lift:
+	"""
+	A where-clause function which captures nothing, or else only other such functions, may as well be global.
+	Then the enclosing function need not make a new closure for it on every call.
+	Lifted functions get names like `outer:inner` so they stay distinct at the top level.
+	Functions in the where-clauses of case-alternatives stay put, as do thunks,
+	because a global thunk would hold on to its value for the life of the program.
+	"""
+	def __init__(self, module:syntax.Module):
+		self._module = module
+		self.lifted = set()
+		for sub in list(module.top_subs): self._lift_from(sub, sub.nom.text)
+		for actor in module.actors:
+			for behavior in actor.behaviors: self._lift_from(behavior, actor.nom.text + ":" + behavior.nom.text)
+
+	def _lift_from(self, sub:syntax.Subroutine, path:str):
+		movable = {inner for inner in sub.where if not inner.is_thunk()}
+		settled = False
+		while not settled:
+			settled = True
+			for inner in list(movable):
+				if not inner.captures <= movable | self.lifted:
+					movable.remove(inner)
+					settled = False
+		if movable:
+			sub.where = tuple(inner for inner in sub.where if inner not in movable)
+			for inner in sorted(movable, key=lambda x: x.nom.spot):
+				inner.nom = Nom(path + ":" + inner.nom.text, inner.nom.spot)
+				self._module.top_subs.append(inner)
+			self.lifted.update(movable)
+		for inner in sub.where: self._lift_from(inner, path + ":" + inner.nom.text)
+		for inner in movable: self._lift_from(inner, inner.nom.text)
+
+class Sweep(Visitor):
+	"""
+	Find which where-clause definitions get used, starting from the expressions that surely run.
+	A definition only used by other unused definitions is just as dead.
+	"""
+	def __init__(self):
+		self.used = set()
+		self.live = []
+		self.dead = set()
+
+	def visit_UserFunction(self, sub:syntax.Subroutine):
+		self.live.append(sub)
+		self.visit(sub.expr)
+		sub.where = self._where(sub.where)
+
+	visit_UserOperator = visit_UserProcedure = visit_UserFunction
+
+	def _where(self, where:Sequence[syntax.Subroutine]) -> Sequence[syntax.Subroutine]:
+		pending = list(where)
+		progress = True
+		while progress:
+			progress = False
+			for sub in list(pending):
+				if sub in self.used:
+					pending.remove(sub)
+					self.visit(sub)
+					progress = True
+		if not pending: return where
+		self.dead.update(pending)
+		return tuple(sub for sub in where if sub not in pending)
+
+	def visit_Lookup(self, expr:syntax.Lookup): self.used.add(expr.ref.dfn)
+	def visit_Literal(self, expr): pass
+	def visit_Skip(self, expr): pass
+	def visit_Absurdity(self, expr): pass
+
+	def visit_Binary(self, expr:syntax.Binary):
+		self.visit(expr.lhs)
+		self.visit(expr.rhs)
+
+	visit_BinExp = visit_ShortCutExp = visit_Binary
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp): self.visit(expr.arg)
+
+	def visit_Cond(self, expr:syntax.Cond):
+		self.visit(expr.if_part)
+		self.visit(expr.then_part)
+		self.visit(expr.else_part)
+
+	def visit_Call(self, expr:syntax.Call):
+		self.visit(expr.fn_exp)
+		for a in expr.args: self.visit(a)
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList):
+		for e in expr.elts: self.visit(e)
+
+	def visit_FieldReference(self, expr:syntax.FieldReference): self.visit(expr.lhs)
+	def visit_BindMethod(self, expr:syntax.BindMethod): self.visit(expr.receiver)
+	def visit_AsTask(self, expr:syntax.AsTask): self.visit(expr.proc_ref)
+	def visit_LambdaForm(self, expr:syntax.LambdaForm): self.visit(expr.function)
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr):
+		self.visit(expr.subject.expr)
+		for alt in expr.alternatives:
+			self.visit(alt.sub_expr)
+			alt.where = self._where(alt.where)
+		if expr.otherwise is not None: self.visit(expr.otherwise)
+
+	def visit_DoBlock(self, expr:syntax.DoBlock):
+		for actor in expr.actors: self.visit(actor.expr)
+		for step in expr.steps: self.visit(step)
+
+	def visit_AssignMember(self, expr:syntax.AssignMember): self.visit(expr.expr)
+
+class Prune(Visitor):
+	""" Forget captures of definitions which are dropped or lifted, so nothing tries to capture what is no longer local. """
+	def __init__(self, dead:set):
+		self._dead = dead
+
+	def tour(self, subs:Sequence[syntax.Subroutine]):
+		for sub in subs:
+			sub.captures.difference_update(self._dead)
+			self.visit(sub.expr)
+
+	def _prune(self, expr:syntax.ValueExpression):
+		if expr.captures is not None and not self._dead.isdisjoint(expr.captures):
+			expr.captures = tuple(sym for sym in expr.captures if sym not in self._dead)
+
+	def visit_Lookup(self, expr): pass
+	def visit_Literal(self, expr): pass
+	def visit_Skip(self, expr): pass
+	def visit_Absurdity(self, expr): pass
+	def visit_LambdaForm(self, expr): pass  # The sweep found the function itself.
+
+	def visit_Binary(self, expr:syntax.Binary):
+		self.visit(expr.lhs)
+		self.visit(expr.rhs)
+
+	visit_BinExp = visit_ShortCutExp = visit_Binary
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp): self.visit(expr.arg)
+
+	def visit_Cond(self, expr:syntax.Cond):
+		self.visit(expr.if_part)
+		self.visit(expr.then_part)
+		self.visit(expr.else_part)
+
+	def visit_Call(self, expr:syntax.Call):
+		self.visit(expr.fn_exp)
+		for a in expr.args:
+			self._prune(a)
+			self.visit(a)
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList):
+		for e in expr.elts:
+			self._prune(e)
+			self.visit(e)
+
+	def visit_FieldReference(self, expr:syntax.FieldReference): self.visit(expr.lhs)
+	def visit_BindMethod(self, expr:syntax.BindMethod): self.visit(expr.receiver)
+	def visit_AsTask(self, expr:syntax.AsTask): self.visit(expr.proc_ref)
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr):
+		self.visit(expr.subject.expr)
+		for alt in expr.alternatives: self.visit(alt.sub_expr)
+		if expr.otherwise is not None: self.visit(expr.otherwise)
+
+	def visit_DoBlock(self, expr:syntax.DoBlock):
+		for actor in expr.actors: self.visit(actor.expr)
+		for step in expr.steps: self.visit(step)
+
+	def visit_AssignMember(self, expr:syntax.AssignMember): self.visit(expr.expr)
@@ -40,6 +40,17 @@ class _RootFrame(_CaptureFrame):
 
 _ROOT_FRAME = _RootFrame()
 
+class _BeginFrame(_CaptureFrame):
+	""" Begin-expressions capture nothing, but they can still declare match-subjects and cast members. """
+	def __init__(self):
+		self._locals = set()
+	
+	def declare(self, term: TermSymbol) -> None:
+		self._locals.add(term)
+	
+	def use(self, term: TermSymbol) -> bool:
+		return term in self._locals
+
 class _SubroutineFrame(_CaptureFrame):
 	_outer: _CaptureFrame
 	_locals: set[TermSymbol]
@@ -62,6 +73,13 @@ class _SubroutineFrame(_CaptureFrame):
 		else:
 			return False
 
+class _ThunkFrame(_SubroutineFrame):
+	""" A delayed expression is like a subroutine with neither parameters nor where-clause. """
+	def __init__(self, outer: _CaptureFrame):
+		self._outer = outer
+		self._locals = set()
+		self._captures = set()
+
 class _ActorFrame(_CaptureFrame):
 	def __init__(self, actor: syntax.UserActor):
 		self._here = {SELF} | set(actor.fields)
@@ -264,7 +282,10 @@ class Resolver(TopDown):
 		for a in module.assumptions: self.note_assumption(a)
 		self._memoize(module.top_subs, self._module_scope)
 		for uda in module.actors: self.define_actor(uda)
-		self.tour(module.main, self._module_scope)
+		for expr in module.main:
+			self._current_frame = _BeginFrame()
+			self.visit(expr, self._module_scope)
+		self._current_frame = _ROOT_FRAME
 	
 	def _imported_scope(self, nom: Nom) -> Optional[Scope]:
 		im = self._aliased_imports.symbol(nom.key())
@@ -446,6 +467,20 @@ class Resolver(TopDown):
 		self._current_frame.use(dfn)
 		lu.dfn = ref.dfn = dfn
 	
+	def visit_Call(self, expr: syntax.Call, scope: Scope):
+		self.visit(expr.fn_exp, scope)
+		for a in expr.args: self._delayed(a, scope)
+	
+	def visit_ExplicitList(self, expr: syntax.ExplicitList, scope: Scope):
+		for e in expr.elts: self._delayed(e, scope)
+	
+	def _delayed(self, expr: syntax.ValueExpression, scope: Scope):
+		prior = self._current_frame
+		frame = self._current_frame = _ThunkFrame(prior)
+		self.visit(expr, scope)
+		self._current_frame = prior
+		expr.captures = tuple(frame._captures)
+	
 	def visit_LambdaForm(self, lf: syntax.LambdaForm, scope: Scope):
 		fn = lf.function
 		self._memoize([fn], scope)
@@ -500,6 +535,7 @@ class Resolver(TopDown):
 			for new_actor in db.actors:
 				self.visit(new_actor.expr, inner)
 				self._install(cast, new_actor)
+				self._current_frame.declare(new_actor)
 		else:
 			inner = outer
 		for s in db.steps:
@@ -507,6 +543,7 @@ class Resolver(TopDown):
 	
 	def visit_AssignMember(self, am:syntax.AssignMember, env):
 		am.dfn = self._lookup_member(am.nom)
+		self._current_frame.use(SELF)
 		return self.visit(am.expr, env)
 	
 	def visit_MatchExpr(self, mx:syntax.MatchExpr, outer:Scope):
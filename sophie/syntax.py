@@ -108,6 +108,8 @@ class FreeType(TypeExpression):
 	def dispatch_token(self): return None
 	
 class FormalParameter(TermSymbol):
+	# A parameter which holds a function may come to know which arguments that function is sure to force.
+	strictures: tuple[int, ...] = ()
 	def __init__(self, stricture, nom:Nom, type_expr: Optional[TypeExpression]):
 		super().__init__(nom)
 		self.is_strict = stricture is not None
@@ -122,6 +124,9 @@ class FormalParameter(TermSymbol):
 def FieldDefinition(nom:Nom, type_expr: Optional[TypeExpression]):
 	return FormalParameter(None, nom, type_expr)
 
+def StrictFieldDefinition(stricture:Nom, nom:Nom, type_expr: Optional[TypeExpression]):
+	return FormalParameter(stricture, nom, type_expr)
+
 class OpaqueSymbol(TypeDefinition):
 	pass
 
@@ -130,6 +135,7 @@ class RecordSpec:
 	def __init__(self, fields: list[FormalParameter]):
 		assert all(isinstance(f, FormalParameter) for f in fields)
 		self.fields = fields
+		self.strictures = tuple(i for i, f in enumerate(fields) if f.is_strict)
 	
 	def field_names(self):
 		return [f.nom.text for f in self.fields]
@@ -297,6 +303,7 @@ class UserActor(TermSymbol):
 		return [f.nom.text for f in self.fields]
 
 class Literal(ValueExpression):
+	cheap = True
 	def __init__(self, value: Any, spot: int):
 		assert isinstance(spot, int) or spot is None, type(spot)
 		self.value, self._spot = value, spot
@@ -311,6 +318,7 @@ def falsehood(token:Nom): return Literal(False, token.spot)
 class Lookup(ValueExpression):
 	# Reminder: This AST node exists in opposition to TypeCall so I can write
 	# behavior for references in value context vs. references in type context.
+	cheap = True
 	ref:Reference
 	def __init__(self, ref: Reference): self.ref = ref
 	def __str__(self): return str(self.ref)
@@ -460,6 +468,7 @@ class NewActor(TermSymbol):
 class DoBlock(ValueExpression):
 	# The value of a do-block does not depend on when it runs.
 	# Its consequence may so depend, but by definition steps run in sequence.
+	cheap = True
 
 	def __init__(self, actors:list[NewActor], keyword:Nom, steps:list[ValueExpression]):
 		self.actors = actors
@@ -479,6 +488,7 @@ class AssignMember(Reference):
 class LambdaForm(ValueExpression):
 	# This is essentially a special kind of literal constant.
 	# It happens to be connected to a function definition.
+	cheap = True
 	def __init__(self, left:Nom, params:list[FormalParameter], body:ValueExpression, right:Nom):
 		assert params
 		self._left, self._right = left.left(), right.right()
@@ -0,0 +1,430 @@
+"""
+A fourth engine: Tiered translation into Python source text.
+
+Everything starts out exactly as in the closure compiler. But each function
+counts its calls, and once it has been called `TIER_UP` times, its body is
+translated into the text of a Python function, which goes through `compile()`
+and takes over from the closures. Cold code never pays for translation.
+
+In the generated code, parameters, captures, where-bindings, and case-subjects
+are Python local variables. Parameters which the demand analysis marks strict
+arrive already forced, so they get used as plain values. Globals are bound into
+the function's namespace as constants. Case-matches become `if`-chains on the tag.
+
+Arithmetic is written inline, on the bet that the operands are primitive.
+If that bet ever fails (with a `TypeError`) the function falls back to a second
+translation which dispatches every operator the general way, as the other engines do.
+
+A function which calls itself in tail position (and has no where-clauses)
+becomes a `while`-loop, so that tail-recursion costs neither stack nor thunks.
+
+A few constructs (do-blocks, member assignment, absurdity, and thunks with where-clauses
+of their own) are not translated. Functions using them stay with their closures.
+"""
+import keyword
+import re
+from operator import attrgetter
+from typing import Optional, Sequence
+from boozetools.support.foundation import Visitor
+from .. import syntax
+from .types import ARGS, LAZY_VALUE, STRICT_VALUE
+from .evaluator import _ABSENT, Blackhole, THUNK_TYPES
+from .values import Constructor, Primitive, BoundMethod, MEMO_TABLES
+from .runtime import GLOBAL_SCOPE, PRIMITIVE_BINARY, PRIMITIVE_UNARY, OperatorSite, known_strictures
+from . import runtime
+from .compiler import (
+	CODE, Template, Compiler, ClosureCompiler,
+	CompiledThunk, CompiledTailCall, CompiledClosure, _force,
+)
+
+class TieredTemplate(Template):
+	"""
+	Runs the closure-compiled body until the function has been called `TIER_UP` times.
+	After that, if the body translates, the translation takes over.
+	"""
+	TIER_UP = 100
+	fast : Optional[CODE] = None
+
+	def __init__(self, sub:syntax.Subroutine):
+		super().__init__(sub)
+		self.calls = 0
+
+	def apply(self, args: ARGS, captures:Sequence[LAZY_VALUE]) -> LAZY_VALUE:
+		fast = self.fast or self._count()
+		if fast is None: return super().apply(args, captures)
+		return CompiledTailCall(fast, self._frame(args, captures))
+
+	def call(self, args: ARGS, captures:Sequence[LAZY_VALUE]=()) -> LAZY_VALUE:
+		""" For a caller who will force the result straight away: Skip the thunk. """
+		fast = self.fast or self._count()
+		if fast is None: return super().apply(args, captures)
+		return fast(self._frame(args, captures))
+
+	def _count(self) -> Optional[CODE]:
+		self.calls += 1
+		if self.calls == self.TIER_UP: self.fast = translate(self, True)
+		return self.fast
+
+	def _frame(self, args: ARGS, captures:Sequence[LAZY_VALUE]) -> list:
+		if self.strictures:
+			args = list(args)
+			for i in self.strictures: args[i] = _force(args[i])
+		return [*args, *captures]
+
+	def retry(self, frame:list) -> LAZY_VALUE:
+		""" Inline arithmetic met a non-primitive operand. Dispatch operators generally from now on. """
+		self.fast = translate(self, False)
+		return self.fast(frame)
+
+class TieredCompiler(Compiler):
+	TEMPLATE = TieredTemplate
+
+TieredTemplate.COMPILER = TieredCompiler
+
+class SourceCompiler(ClosureCompiler):
+	""" Start out as the closure compiler; translate hot functions into Python source. """
+	COMPILER = TieredCompiler
+
+###############################################################################
+
+def translate(template:TieredTemplate, speculate:bool) -> Optional[CODE]:
+	try: source, namespace, name = Translator(template, speculate).function()
+	except _Decline: return None
+	exec(compile(source, "<%s>"%name, "exec"), namespace)
+	return namespace[name]
+
+class _Decline(Exception):
+	""" Something in this function does not translate. It keeps its closures. """
+
+_INLINE_BINARY = {
+	"^":"**", "*":"*", "/":"/", "DIV":"//", "MOD":"%", "+":"+", "-":"-",
+	"==":"==", "!=":"!=", "<=":"<=", "<":"<", ">=":">=", ">":">",
+}
+_INLINE_UNARY = {"-":"-", "NOT":"not "}
+_SHORTCUT = {"AND":"and", "OR":"or"}
+
+def _binary(glyph:str):
+	op, site = PRIMITIVE_BINARY[glyph], OperatorSite(glyph)
+	def binary(a, b):
+		try: return op(a, b)
+		except TypeError: return _force(site.binary(a, b))
+	return binary
+
+def _unary(glyph:str):
+	op, site = PRIMITIVE_UNARY[glyph], OperatorSite(glyph)
+	def unary(a):
+		try: return op(a)
+		except TypeError: return _force(site.unary(a))
+	return unary
+
+def _closure(template:TieredTemplate, captures:tuple) -> CompiledClosure:
+	closure = CompiledClosure(template)
+	closure._captures = captures
+	return closure
+
+def _explicit_list(elts:tuple) -> STRICT_VALUE:
+	tail = runtime.NIL
+	for elt in reversed(elts): tail = runtime.CONS.apply((elt, tail))
+	return tail
+
+_HELPERS = {
+	"_force": _force,
+	"_Thunk": CompiledThunk,
+	"_Closure": CompiledClosure,
+	"_closure": _closure,
+	"_list": _explicit_list,
+	"_BoundMethod": BoundMethod,
+}
+
+class Translator(Visitor):
+	"""
+	Each visit method returns the text of a Python expression which computes the same thing
+	as the closure compiler would for the same node. With `strict` set, the expression must
+	evaluate to a strict value. Otherwise, it may evaluate to a thunk, but it must not
+	call on anything the closure compiler would not have called on right away.
+	"""
+	def __init__(self, template:TieredTemplate, speculate:bool):
+		self.template = template
+		self.sub = template.sub
+		self.speculate = speculate
+		self.speculated = False
+		self.namespace = dict(_HELPERS)
+		self.constants = {}  # id -> name
+		self.names = {}  # symbol -> identifier
+		self.strict_names = set()
+		self.lines = []
+		self.lambdas = []  # (mentioned, declared) for each lambda being generated.
+		self.loop = not _has_where(self.sub) and _tail_calls_self(self.sub, self.sub.expr)
+
+	def function(self):
+		sub = self.sub
+		params = [self.local(p) for p in sub.params]
+		unpack = params + [self.local(c) for c in self.template.captures]
+		for i in sub.strictures: self.strict_names.add(params[i])
+		if self.loop:
+			self.emit(1, "while True:")
+			self.body(sub.where, sub.expr, 2)
+		else: self.body(sub.where, sub.expr, 1)
+		if self.speculated:
+			self.lines = [(1, "try:")] + [(depth+1, text) for depth, text in self.lines]
+			self.emit(1, "except TypeError:")
+			self.emit(2, "return %s(frame)" % self.constant(self.template.retry))
+		if unpack: self.lines.insert(0, (1, "%s, = frame" % ", ".join(unpack)))
+		name = "sophie_" + _identifier(sub.nom.text)
+		text = ["def %s(frame):"%name] + ["\t"*depth + text for depth, text in self.lines]
+		return "\n".join(text), self.namespace, name
+
+	def emit(self, depth:int, text:str):
+		self.lines.append((depth, text))
+
+	def local(self, sym:syntax.Symbol) -> str:
+		if sym not in self.names:
+			self.names[sym] = name = "%s_%d" % (_identifier(sym.nom.text), len(self.names))
+			# A function's closure is never a thunk.
+			if isinstance(sym, syntax.Subroutine) and not sym.is_thunk(): self.strict_names.add(name)
+		name = self.names[sym]
+		if self.lambdas: self.lambdas[-1][1].add(name)
+		return name
+
+	def constant(self, value) -> str:
+		key = id(value)
+		if key not in self.constants:
+			self.constants[key] = name = "_k%d" % len(self.constants)
+			self.namespace[name] = value
+		return self.constants[key]
+
+	# Statements:
+
+	def body(self, where:Sequence[syntax.Subroutine], expr:syntax.ValueExpression, depth:int):
+		self.where(where, depth)
+		self.tail(expr, depth)
+
+	def where(self, where:Sequence[syntax.Subroutine], depth:int):
+		# In the same order as `Compiler.where`, so every name is bound before it gets captured.
+		for sub in where: self.local(sub)
+		thunks = [sub for sub in where if sub.is_thunk()]
+		functions = [sub for sub in where if not sub.is_thunk()]
+		for sub in thunks:
+			if sub.where: raise _Decline(sub)
+			self.emit(depth, "%s = %s" % (self.names[sub], self.thunk(sub.expr)))
+		for sub in functions:
+			if sub in MEMO_TABLES: raise _Decline(sub)
+			self.emit(depth, "%s = _Closure(%s)" % (self.names[sub], self.constant(TieredTemplate(sub))))
+		for sub in functions:
+			self.emit(depth, "%s._captures = %s" % (self.names[sub], self.captures(sub)))
+
+	def tail(self, expr:syntax.ValueExpression, depth:int):
+		if isinstance(expr, syntax.Cond):
+			self.emit(depth, "if %s:" % self.visit(expr.if_part, True))
+			self.tail(expr.then_part, depth+1)
+			self.emit(depth, "else:")
+			self.tail(expr.else_part, depth+1)
+		elif isinstance(expr, syntax.MatchExpr):
+			subject = self.local(expr.subject)
+			self.emit(depth, "%s = %s" % (subject, self.visit(expr.subject.expr, True)))
+			self.strict_names.add(subject)
+			cases = list(expr.dispatch.items())
+			last = None if expr.otherwise is not None else cases.pop()[1]
+			for i, (tag, alt) in enumerate(cases):
+				self.emit(depth, "%s %s.TAG is %s:" % ("elif" if i else "if", subject, self.constant(tag)))
+				self.body(alt.where, alt.sub_expr, depth+1)
+			if cases: self.emit(depth, "else:")
+			else: depth -= 1
+			if last is None: self.tail(expr.otherwise, depth+1)
+			else: self.body(last.where, last.sub_expr, depth+1)
+		elif self.loop and _is_self_call(self.sub, expr):
+			params = [self.names[p] for p in self.sub.params]
+			args = [
+				self.visit(arg, True) if i in self.sub.strictures else self.delayed(arg)
+				for i, arg in enumerate(expr.args)
+			]
+			self.emit(depth, "%s, = %s," % (", ".join(params), ", ".join(args)))
+			# Keep the frame current, so it holds on to nothing the loop is done with.
+			# That also lets a retry pick up from this iteration.
+			self.emit(depth, "frame[:%d] = %s," % (len(params), ", ".join(params)))
+			self.emit(depth, "continue")
+		else:
+			self.emit(depth, "return %s" % self.visit(expr, False))
+
+	# Expressions:
+
+	def delayed(self, expr:syntax.ValueExpression) -> str:
+		if (expr.cheap and not isinstance(expr, syntax.DoBlock)) or self.is_field_of_strict(expr):
+			return self.visit(expr, False)
+		return self.thunk(expr)
+
+	def is_field_of_strict(self, expr:syntax.ValueExpression) -> bool:
+		# Reading a field out of a record in hand costs less than making a thunk to do it later.
+		return (
+			isinstance(expr, syntax.FieldReference)
+			and isinstance(expr.lhs, syntax.Lookup)
+			and self.names.get(expr.lhs.ref.dfn) in self.strict_names
+		)
+
+	def thunk(self, expr:syntax.ValueExpression) -> str:
+		# Code in a lambda may run anywhere, long after this function's `try` is gone,
+		# so it makes no bets on operand types.
+		# In a loop, the lambda must keep the values its variables have right now.
+		self.lambdas.append((set(), set()))
+		text = self.visit(expr, False)
+		mentioned, declared = self.lambdas.pop()
+		free = sorted(mentioned - declared)
+		if self.lambdas: self.lambdas[-1][0].update(free)
+		if self.loop and free: params = "".join(", %s=%s" % (name, name) for name in free)
+		else: params = ""
+		return "_Thunk(lambda _%s: %s, None)" % (params, text)
+
+	def captures(self, sub:syntax.Subroutine) -> str:
+		if not all(sym in self.names for sym in sub.captures): raise _Decline(sub)
+		names = [self.mention(self.names[sym]) for sym in sub.captures]
+		return "(%s)" % "".join(name + ", " for name in names)
+
+	def mention(self, name:str) -> str:
+		if self.lambdas: self.lambdas[-1][0].add(name)
+		return name
+
+	def visit_Literal(self, expr:syntax.Literal, strict:bool) -> str:
+		value = expr.value
+		if type(value) in (bool, int, str): return repr(value)
+		return self.constant(value)
+
+	def visit_Lookup(self, expr:syntax.Lookup, strict:bool) -> str:
+		sym = expr.ref.dfn
+		if sym in self.names:
+			name = self.mention(self.names[sym])
+			if strict and name not in self.strict_names: return "_force(%s)" % name
+			return name
+		value = GLOBAL_SCOPE[sym]
+		if type(value) in THUNK_TYPES and strict:
+			# A global which has been evaluated already may as well be a constant.
+			inner = value.value
+			if inner is _ABSENT or type(inner) is Blackhole or type(inner) in THUNK_TYPES:
+				return "_force(%s)" % self.constant(value)
+			value = inner
+		return self.constant(value)
+
+	def visit_LambdaForm(self, expr:syntax.LambdaForm, strict:bool) -> str:
+		template = TieredTemplate(expr.function)
+		return "_closure(%s, %s)" % (self.constant(template), self.captures(expr.function))
+
+	def visit_BinExp(self, expr:syntax.BinExp, strict:bool) -> str:
+		lhs, rhs = self.visit(expr.lhs, True), self.visit(expr.rhs, True)
+		glyph = expr.op.text
+		if self.speculate and not self.lambdas and glyph in _INLINE_BINARY:
+			self.speculated = True
+			return "(%s %s %s)" % (lhs, _INLINE_BINARY[glyph], rhs)
+		return "%s(%s, %s)" % (self.constant(_binary(glyph)), lhs, rhs)
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp, strict:bool) -> str:
+		arg = self.visit(expr.arg, True)
+		glyph = expr.op.text
+		if self.speculate and not self.lambdas and glyph in _INLINE_UNARY:
+			self.speculated = True
+			return "(%s%s)" % (_INLINE_UNARY[glyph], arg)
+		return "%s(%s)" % (self.constant(_unary(glyph)), arg)
+
+	def visit_ShortCutExp(self, expr:syntax.ShortCutExp, strict:bool) -> str:
+		lhs, rhs = self.visit(expr.lhs, True), self.visit(expr.rhs, True)
+		return "(%s %s %s)" % (lhs, _SHORTCUT[expr.op.text], rhs)
+
+	def visit_Call(self, expr:syntax.Call, strict:bool) -> str:
+		callee = self.known_global(expr.fn_exp)
+		if type(callee) is Primitive:
+			# All primitive parameters are strict, and primitives run when applied anyway.
+			args = ", ".join(self.visit(arg, True) for arg in expr.args)
+			return "%s(%s)" % (self.constant(callee._fn), args)
+		strictures = known_strictures(expr)
+		args = "(%s)" % "".join(
+			(self.visit(arg, True) if i in strictures else self.delayed(arg)) + ", "
+			for i, arg in enumerate(expr.args)
+		)
+		if type(callee) is Constructor:
+			return "%s(%s)" % (self.constant(callee.record), args)
+		if strict and type(callee) is CompiledClosure and isinstance(callee._template, TieredTemplate):
+			return "_force(%s.call(%s))" % (self.constant(callee._template), args)
+		text = "%s.apply(%s)" % (self.visit(expr.fn_exp, True), args)
+		return "_force(%s)" % text if strict else text
+
+	def known_global(self, expr:syntax.ValueExpression):
+		if isinstance(expr, syntax.Lookup) and expr.ref.dfn not in self.names:
+			return GLOBAL_SCOPE.get(expr.ref.dfn)
+
+	def visit_Cond(self, expr:syntax.Cond, strict:bool) -> str:
+		if_part = self.visit(expr.if_part, True)
+		then_part, else_part = self.visit(expr.then_part, strict), self.visit(expr.else_part, strict)
+		return "(%s if %s else %s)" % (then_part, if_part, else_part)
+
+	def visit_FieldReference(self, expr:syntax.FieldReference, strict:bool) -> str:
+		lhs = self.visit(expr.lhs, True)
+		field = expr.field_name.text
+		if keyword.iskeyword(field): text = "%s(%s)" % (self.constant(attrgetter(field)), lhs)
+		else: text = "%s.%s" % (lhs, field)
+		return "_force(%s)" % text if strict else text
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList, strict:bool) -> str:
+		return "_list((%s))" % "".join(self.delayed(e) + ", " for e in expr.elts)
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr, strict:bool) -> str:
+		# As an expression, a match becomes a chain of conditional expressions.
+		cases = list(expr.dispatch.items())
+		if any(alt.where for tag, alt in cases) or len(cases) + (expr.otherwise is not None) < 2:
+			raise _Decline(expr)
+		subject = self.local(expr.subject)
+		scrutinee = self.visit(expr.subject.expr, True)
+		self.strict_names.add(subject)
+		if expr.otherwise is None: last = self.visit(cases.pop()[1].sub_expr, strict)
+		else: last = self.visit(expr.otherwise, strict)
+		text = []
+		for i, (tag, alt) in enumerate(cases):
+			test = "(%s := %s)"%(subject, scrutinee) if i == 0 else subject
+			text.append("%s if %s.TAG is %s else " % (self.visit(alt.sub_expr, strict), test, self.constant(tag)))
+		return "(%s%s)" % ("".join(text), last)
+
+	@staticmethod
+	def visit_Skip(expr:syntax.Skip, strict:bool) -> str:
+		return "None"
+
+	def visit_BindMethod(self, expr:syntax.BindMethod, strict:bool) -> str:
+		return "_BoundMethod(%s, %r)" % (self.visit(expr.receiver, True), expr.method_name.text)
+
+	def visit_AsTask(self, expr:syntax.AsTask, strict:bool) -> str:
+		return "%s.as_task()" % self.visit(expr.proc_ref, True)
+
+	@staticmethod
+	def visit_ValueExpression(expr:syntax.ValueExpression, strict:bool) -> str:
+		# Do-blocks, member assignment, and absurdity.
+		raise _Decline(expr)
+
+def _identifier(text:str) -> str:
+	text = re.sub(r"\W", "", text)
+	return text if text.isidentifier() and not keyword.iskeyword(text) else "v"+text
+
+def _has_where(sub:syntax.Subroutine) -> bool:
+	""" Is there a where-clause anywhere in the function? Then it cannot become a loop. """
+	if sub.where: return True
+	def scan(expr):
+		if isinstance(expr, syntax.MatchExpr):
+			return any(alt.where or scan(alt.sub_expr) for alt in expr.dispatch.values()) or (
+				expr.otherwise is not None and scan(expr.otherwise)
+			)
+		if isinstance(expr, syntax.Cond): return scan(expr.then_part) or scan(expr.else_part)
+		return False
+	return scan(sub.expr)
+
+def _tail_calls_self(sub:syntax.Subroutine, expr:syntax.ValueExpression) -> bool:
+	if isinstance(expr, syntax.Cond):
+		return _tail_calls_self(sub, expr.then_part) or _tail_calls_self(sub, expr.else_part)
+	if isinstance(expr, syntax.MatchExpr):
+		branches = [alt.sub_expr for alt in expr.dispatch.values()]
+		if expr.otherwise is not None: branches.append(expr.otherwise)
+		return any(_tail_calls_self(sub, branch) for branch in branches)
+	return _is_self_call(sub, expr)
+
+def _is_self_call(sub:syntax.Subroutine, expr:syntax.ValueExpression) -> bool:
+	return (
+		sub.params
+		and isinstance(expr, syntax.Call)
+		and isinstance(expr.fn_exp, syntax.Lookup)
+		and expr.fn_exp.ref.dfn is sub
+		and len(expr.args) == len(sub.params)
+	)
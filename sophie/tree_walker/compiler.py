@@ -0,0 +1,430 @@
+"""
+A second engine for the Python-based runtime.
+
+Rather than dispatch on the type of each node every time it gets evaluated,
+this compiles each expression (once) into a nest of Python closures.
+Each closure has its children pre-bound, so running a node is one direct call.
+The ordinary tree-walker remains the reference for what everything means;
+this engine should give the same answers, only faster.
+
+Compiled code makes the same kinds of run-time values (with a few subclasses)
+so the adapters and the scheduler cannot tell the difference.
+
+Activation frames are plain Python lists. Every local symbol gets a fixed slot
+at compile time: First the parameters, then the captured values, and then
+where-bindings, match-subjects, and cast members in order of appearance.
+(Thunk-like where-bindings share the frame of their enclosing subroutine.
+Delayed arguments and list elements get a little frame of their own,
+holding just the captures the resolver found for them.)
+Thus each lookup is classified once as either a slot in the frame
+or a global, and global values are bound directly into the compiled code.
+"""
+from operator import attrgetter
+from typing import Callable, Optional, Sequence
+from boozetools.support.foundation import Visitor
+from .. import syntax
+from ..ontology import SELF, TermSymbol
+from ..diagnostics import trace_absurdity
+from .types import ENV, LAZY_VALUE, STRICT_VALUE, ARGS
+from .evaluator import Thunk, THUNK_TYPES, TAIL_CALL_TYPES, Engine, perform, _ABSENT, Blackhole, PER_THREAD, WAITERS, wake_waiters
+from .values import Closure, BoundMethod, memoize, MemoThunk, ActorClass, ActorTemplate, UserDefinedActor
+from .scheduler import per_thread
+from .runtime import (
+	GLOBAL_SCOPE, PRIMITIVE_BINARY, PRIMITIVE_UNARY, SHORTCUT, OperatorSite, known_strictures,
+)
+from . import runtime
+
+FRAME = list[LAZY_VALUE]
+CODE = Callable[[FRAME], LAZY_VALUE]
+CLOSER = Callable[[FRAME], None]
+
+# Compiled code for these never produces a thunk, so there is nothing to force.
+_ALREADY_STRICT = {
+	syntax.Literal, syntax.LambdaForm, syntax.BinExp, syntax.UnaryExp, syntax.ShortCutExp,
+	syntax.ExplicitList, syntax.BindMethod, syntax.AsTask, syntax.DoBlock, syntax.Skip,
+}
+
+class CompiledThunk(Thunk):
+	""" A thunk over compiled code rather than over syntax. """
+	CLAIM = "code"
+	
+	def __init__(self, code:CODE, frame:Optional[FRAME]):
+		self.code = code
+		self.frame = frame
+		self.value = _ABSENT
+
+	def force(self):
+		# Thunk.force, but with the common cases inline.
+		value = self.value
+		if value is _ABSENT:
+			code = self.__dict__.pop("code", None)
+			if code is not None:
+				self.value = PER_THREAD.hole
+				try:
+					value = code(self.frame)
+					while type(value) is CompiledTailCall: value = value.code(value.frame)
+				except BaseException:
+					self.abandon(code)
+					raise
+				self.value = value
+				del self.frame
+				if WAITERS: wake_waiters(self)
+				return value
+		elif type(value) is not Blackhole: return value
+		return super().force()
+
+	def compute(self, code:CODE) -> LAZY_VALUE:
+		value = code(self.frame)
+		while type(value) is CompiledTailCall: value = value.code(value.frame)
+		return value
+
+class CompiledTailCall:
+	"""
+	The body of a closure, not yet run. Same idea as the tree-walker's TailCall:
+	Whoever gets one runs it right away, so there is nothing to memoize.
+	Were these thunks instead, each would keep the next alive as its value,
+	and a thunk that forced a long tail-recursion would hold the whole chain.
+	"""
+	__slots__ = ("code", "frame")
+	def __init__(self, code:CODE, frame:FRAME):
+		self.code = code
+		self.frame = frame
+	
+	def force(self) -> LAZY_VALUE:
+		# The general-purpose force treats these like any other kind of thunk.
+		return self.code(self.frame)
+
+THUNK_TYPES.add(CompiledTailCall)
+TAIL_CALL_TYPES.add(CompiledTailCall)
+
+_LAZY = {CompiledThunk, CompiledTailCall, MemoThunk}  # Memoized closures return a MemoThunk.
+
+def _force(it:LAZY_VALUE) -> STRICT_VALUE:
+	# Equivalent to the general-purpose force, which pays for an abstract-base-class instance check.
+	while type(it) in _LAZY: it = it.force()
+	return it
+
+class Layout:
+	""" The compile-time picture of an activation frame: Which symbol lives in which slot. """
+	def __init__(self, params:Sequence[TermSymbol]=(), captures:Sequence[TermSymbol]=()):
+		self.slots = {}
+		for sym in params: self.allocate(sym)
+		for sym in captures: self.allocate(sym)
+		self._nr_given = len(self.slots)
+	
+	def allocate(self, sym:TermSymbol) -> int:
+		assert sym not in self.slots, sym
+		self.slots[sym] = slot = len(self.slots)
+		return slot
+	
+	def padding(self) -> tuple:
+		""" Room for the slots which get filled in after the frame is built. """
+		return (None,) * (len(self.slots) - self._nr_given)
+
+class Template:
+	"""
+	Everything about a subroutine that does not depend on a particular activation.
+	Top-level subroutines compile on first use; nested ones compile with their parent.
+	"""
+	COMPILER : type["Compiler"]
+	close : Optional[CLOSER]
+	body : Optional[CODE]
+	padding : tuple
+	capture_slots : tuple[int, ...] = ()  # Where to find the captures in the enclosing frame.
+
+	def __init__(self, sub:syntax.Subroutine):
+		self.sub = sub
+		self.captures = tuple(sub.captures)
+		self.strictures = sub.strictures
+		self.close = self.body = None
+
+	def compile(self):
+		layout = Layout(self.sub.params, self.captures)
+		compiler = self.COMPILER(layout)
+		self.close = compiler.where(self.sub.where)
+		self.body = compiler.tail(self.sub.expr)
+		self.padding = layout.padding()
+
+	def apply(self, args: ARGS, captures:Sequence[LAZY_VALUE]) -> LAZY_VALUE:
+		if self.body is None: self.compile()
+		if self.strictures:
+			args = list(args)
+			for i in self.strictures: args[i] = _force(args[i])
+		frame = [*args, *captures, *self.padding]
+		if self.close is not None: self.close(frame)
+		# As in the tree-walker, the body comes back delayed to keep the Python stack flat.
+		return self.body(frame)
+
+class CompiledClosure(Closure):
+	_captures : list[LAZY_VALUE]
+	
+	def __init__(self, template:Template):
+		super().__init__(template.sub)
+		self._template = template
+
+	def perform_capture(self, frame:FRAME):
+		self._captures = [frame[i] for i in self._template.capture_slots]
+
+	def captured(self) -> Sequence[LAZY_VALUE]:
+		return self._captures
+
+	def apply(self, args: ARGS) -> LAZY_VALUE:
+		return self._template.apply(args, self._captures)
+
+class CompiledActor(UserDefinedActor):
+	def handle(self, message, args):
+		template = BEHAVIORS[self._vtable[message]]
+		per_thread.current_actor = self
+		captures = [self.state[sym] for sym in template.captures]
+		# The tree-walker evaluates a behavior directly, so a do-block inside a case runs now.
+		perform(_force(template.apply(args, captures)))
+
+class CompiledActorTemplate(ActorTemplate):
+	ACTOR = CompiledActor
+
+class CompiledActorClass(ActorClass):
+	TEMPLATE = CompiledActorTemplate
+
+BEHAVIORS : dict[syntax.UserProcedure, Template] = {}
+
+###############################################################################
+
+class Compiler(Visitor):
+	"""
+	Each visit method returns a closure which, given a frame, does the same thing
+	as the corresponding tree-walker method would do given the same node and frame.
+	"""
+	TEMPLATE = Template
+	
+	def __init__(self, layout:Layout):
+		self.layout = layout
+
+	def strict(self, expr:syntax.ValueExpression) -> CODE:
+		code = self.visit(expr)
+		if type(expr) in _ALREADY_STRICT: return code
+		def strict(frame):
+			# Same as _force(code(frame)) but this is the hottest spot in the engine.
+			it = code(frame)
+			while type(it) in _LAZY: it = it.force()
+			return it
+		return strict
+
+	def tail(self, expr:syntax.ValueExpression) -> CODE:
+		""" Like `delayed`, but for a result that will be forced exactly once, and soon. """
+		code = self.visit(expr)
+		if expr.cheap: return code
+		def tail_call(frame): return CompiledTailCall(code, frame)
+		return tail_call
+
+	def delayed(self, expr:syntax.ValueExpression) -> CODE:
+		if expr.cheap: return self.visit(expr)
+		if expr.captures is None:
+			code = self.visit(expr)
+			def delay(frame): return CompiledThunk(code, frame)
+			return delay
+		# The thunk gets a frame of its own with just the captures, so it holds on to nothing else.
+		layout = Layout((), expr.captures)
+		code = type(self)(layout).visit(expr)
+		slots = tuple(self.layout.slots[sym] for sym in expr.captures)
+		padding = layout.padding()
+		if len(slots) == 1 and not padding:
+			[slot] = slots
+			def delay_1(frame): return CompiledThunk(code, [frame[slot]])
+			return delay_1
+		def delay_n(frame): return CompiledThunk(code, [*[frame[i] for i in slots], *padding])
+		return delay_n
+
+	def where(self, where:Sequence[syntax.Subroutine]) -> Optional[CLOSER]:
+		if not where: return None
+		slots = [self.layout.allocate(sub) for sub in where]
+		thunks = [(slot, self.visit(sub.expr), self.where(sub.where)) for slot, sub in zip(slots, where) if sub.is_thunk()]
+		functions = [(slot, self.template(sub)) for slot, sub in zip(slots, where) if not sub.is_thunk()]
+		def close(frame):
+			for slot, code, _ in thunks: frame[slot] = CompiledThunk(code, frame)
+			for slot, template in functions: frame[slot] = memoize(CompiledClosure(template))
+			for _, _, inner in thunks:
+				if inner is not None: inner(frame)
+			for slot, _ in functions: frame[slot].perform_capture(frame)
+		return close
+
+	def template(self, sub:syntax.Subroutine) -> Template:
+		template = self.TEMPLATE(sub)
+		template.compile()
+		template.capture_slots = tuple(self.layout.slots[sym] for sym in template.captures)
+		return template
+
+	@staticmethod
+	def visit_Literal(expr:syntax.Literal) -> CODE:
+		value = expr.value
+		def literal(_): return value
+		return literal
+
+	def visit_Lookup(self, expr:syntax.Lookup) -> CODE:
+		sym = expr.ref.dfn
+		if sym in self.layout.slots:
+			slot = self.layout.slots[sym]
+			def local(frame): return frame[slot]
+			return local
+		else:
+			value = GLOBAL_SCOPE[sym]
+			def global_(_): return value
+			return global_
+
+	def visit_LambdaForm(self, expr:syntax.LambdaForm) -> CODE:
+		template = self.template(expr.function)
+		def lambda_form(frame):
+			closure = CompiledClosure(template)
+			closure.perform_capture(frame)
+			return closure
+		return lambda_form
+
+	def visit_BinExp(self, expr:syntax.BinExp) -> CODE:
+		lhs, rhs = self.strict(expr.lhs), self.strict(expr.rhs)
+		op = PRIMITIVE_BINARY[expr.op.text]
+		site = OperatorSite(expr.op.text)
+		def bin_exp(frame):
+			a, b = lhs(frame), rhs(frame)
+			try: return op(a, b)
+			except TypeError: return _force(site.binary(a, b))
+		return bin_exp
+
+	def visit_UnaryExp(self, expr:syntax.UnaryExp) -> CODE:
+		arg = self.strict(expr.arg)
+		op = PRIMITIVE_UNARY[expr.op.text]
+		site = OperatorSite(expr.op.text)
+		def unary_exp(frame):
+			a = arg(frame)
+			try: return op(a)
+			except TypeError: return _force(site.unary(a))
+		return unary_exp
+
+	def visit_ShortCutExp(self, expr:syntax.ShortCutExp) -> CODE:
+		lhs, rhs = self.strict(expr.lhs), self.strict(expr.rhs)
+		decisive = SHORTCUT[expr.op.text]
+		def shortcut_exp(frame):
+			a = lhs(frame)
+			return a if a == decisive else rhs(frame)
+		return shortcut_exp
+
+	def visit_Call(self, expr:syntax.Call) -> CODE:
+		fn_exp = self.strict(expr.fn_exp)
+		strictures = known_strictures(expr)
+		args = [self.strict(a) if i in strictures else self.delayed(a) for i, a in enumerate(expr.args)]
+		if len(args) == 1:
+			[a0] = args
+			def call(frame): return fn_exp(frame).apply((a0(frame),))
+		elif len(args) == 2:
+			a0, a1 = args
+			def call(frame): return fn_exp(frame).apply((a0(frame), a1(frame)))
+		else:
+			def call(frame): return fn_exp(frame).apply([a(frame) for a in args])
+		return call
+
+	def visit_Cond(self, expr:syntax.Cond) -> CODE:
+		if_part = self.strict(expr.if_part)
+		then_part, else_part = self.visit(expr.then_part), self.visit(expr.else_part)
+		def cond(frame): return (then_part if if_part(frame) else else_part)(frame)
+		return cond
+
+	def visit_FieldReference(self, expr:syntax.FieldReference) -> CODE:
+		lhs = self.strict(expr.lhs)
+		get = attrgetter(expr.field_name.text)
+		def field_ref(frame): return get(lhs(frame))
+		return field_ref
+
+	def visit_ExplicitList(self, expr:syntax.ExplicitList) -> CODE:
+		elts = [self.delayed(e) for e in reversed(expr.elts)]
+		def explicit_list(frame):
+			tail = runtime.NIL
+			for elt in elts: tail = runtime.CONS.apply((elt(frame), tail))
+			return tail
+		return explicit_list
+
+	def visit_MatchExpr(self, expr:syntax.MatchExpr) -> CODE:
+		scrutinee = self.strict(expr.subject.expr)
+		subject = self.layout.allocate(expr.subject)
+		dispatch = {
+			tag: (self.where(alt.where), self.visit(alt.sub_expr))
+			for tag, alt in expr.dispatch.items()
+		}
+		otherwise = None if expr.otherwise is None else self.visit(expr.otherwise)
+		def match_expr(frame):
+			frame[subject] = value = scrutinee(frame)
+			try: close, code = dispatch[value.TAG]
+			except KeyError: return otherwise(frame)
+			if close is not None: close(frame)
+			return code(frame)
+		return match_expr
+
+	def visit_DoBlock(self, expr:syntax.DoBlock) -> CODE:
+		actors = [(self.strict(na.expr), self.layout.allocate(na)) for na in expr.actors]
+		steps = [self.strict(s) for s in expr.steps]
+		def do_block(frame):
+			for template, slot in actors: frame[slot] = template(frame).instantiate()
+			for step in steps: perform(step(frame))
+		return do_block
+
+	@staticmethod
+	def visit_Skip(_:syntax.Skip) -> CODE:
+		def skip(_): return None
+		return skip
+
+	def visit_BindMethod(self, expr:syntax.BindMethod) -> CODE:
+		receiver = self.strict(expr.receiver)
+		method_name = expr.method_name.text
+		def bind_method(frame): return BoundMethod(receiver(frame), method_name)
+		return bind_method
+
+	def visit_AsTask(self, expr:syntax.AsTask) -> CODE:
+		proc_ref = self.strict(expr.proc_ref)
+		def as_task(frame): return proc_ref(frame).as_task()
+		return as_task
+
+	def visit_AssignMember(self, expr:syntax.AssignMember) -> CODE:
+		member, value = expr.dfn, self.strict(expr.expr)
+		actor = self.layout.slots[SELF]
+		def assign_member(frame): frame[actor].state[member] = value(frame)
+		return assign_member
+
+	@staticmethod
+	def visit_Absurdity(expr:syntax.Absurdity) -> CODE:
+		def absurdity(frame):
+			trace_absurdity(frame, expr)
+			exit()
+		return absurdity
+
+Template.COMPILER = Compiler
+
+###############################################################################
+
+def _begin(expr:syntax.ValueExpression, where:Sequence[syntax.Subroutine], compiler_class=Compiler) -> CODE:
+	""" Compile and run an expression with a frame all its own, as for a begin-expression. """
+	def begin(_):
+		compiler = compiler_class(Layout())
+		close = compiler.where(where)
+		code = compiler.visit(expr)
+		frame = list(compiler.layout.padding())
+		if close is not None: close(frame)
+		return code(frame)
+	return begin
+
+class ClosureCompiler(Engine):
+	""" Compile each expression into Python closures before running it. """
+	COMPILER = Compiler
+	
+	def close(self, frame:ENV, where):
+		# Top-level subroutines compile lazily, so code only compiles if it runs.
+		# By then, every global symbol they could mention has its value.
+		for sub in where:
+			if sub.is_thunk(): frame[sub] = CompiledThunk(_begin(sub.expr, sub.where, self.COMPILER), None)
+			else:
+				assert not sub.captures
+				frame[sub] = closure = memoize(CompiledClosure(self.COMPILER.TEMPLATE(sub)))
+				closure.perform_capture([])
+
+	def strict(self, expr:syntax.ValueExpression, frame:ENV) -> STRICT_VALUE:
+		return _force(_begin(expr, (), self.COMPILER)(None))
+
+	def actor(self, uda:syntax.UserActor):
+		for behavior in uda.behaviors: BEHAVIORS[behavior] = Template(behavior)
+		return CompiledActorClass(uda) if uda.fields else CompiledActorTemplate(uda, ())
@@ -3,7 +3,10 @@ The generic machinery that everything needs,
 without the specific methods corresponding to particular syntax.
 """
 
-from typing import Union
+from abc import ABC, abstractmethod
+from threading import Lock, Event, get_ident, local
+from time import sleep
+from typing import Union, Iterable
 from .. import syntax
 from .types import SophieValue, LAZY_VALUE, STRICT_VALUE, ENV
 
@@ -17,21 +20,31 @@ def evaluate(expr:EVALUABLE, frame:ENV) -> LAZY_VALUE:
 	except KeyError: raise NotImplementedError(type(expr), expr)
 	return fn(expr, frame)
 
-_NO_DELAY = {syntax.Literal, syntax.Lookup, syntax.DoBlock, syntax.LambdaForm}
-
 def delay(expr: syntax.ValueExpression, frame: ENV) -> LAZY_VALUE:
-	# For certain kinds of expression, there is no profit to delay:
-	if type(expr) in _NO_DELAY: return evaluate(expr, frame)
+	# For cheap expressions, there is no profit to delay:
+	if expr.cheap: return evaluate(expr, frame)
 	# In less trivial cases, make a thunk and pass that instead.
+	# If the resolver says what it uses, the thunk keeps only that much of the frame.
+	captures = expr.captures
+	if captures is not None: frame = {sym: frame[sym] for sym in captures}
 	return Thunk(expr, frame)
 
+def tail_call(expr: syntax.ValueExpression, frame: ENV) -> LAZY_VALUE:
+	""" Like `delay`, but for a result that will be forced exactly once, and soon. """
+	if expr.cheap: return evaluate(expr, frame)
+	return TailCall(expr, frame)
+
 def force(it:LAZY_VALUE) -> STRICT_VALUE:
 	"""
 	Force repeatedly until the result is no longer a thunk, then return that result.
-	This simulates tail-call elimination, now that closures promptly return thunks.
+	This simulates tail-call elimination, now that closures promptly return tail-calls.
 	"""
-	while isinstance(it, Thunk): it = it.force()
-	return it
+	# Exact type tests, because isinstance against an abstract base class is slow.
+	while True:
+		kind = type(it)
+		if kind is TailCall: it = evaluate(it.expr, it.frame)
+		elif kind in THUNK_TYPES: it = it.force()
+		else: return it
 
 EVALUATE = {}
 
@@ -45,9 +58,45 @@ def attach_evaluation_methods(python_scope):
 
 _ABSENT = object()
 
+class InfiniteLoop(Exception):
+	""" Forcing a thunk required the value of that very same thunk. """
+
+class Blackhole:
+	"""
+	Stands in for the value of a thunk while some thread evaluates it.
+	Other threads wanting that value wait until it is published.
+	If the thread doing the evaluation finds its own blackhole, that's an infinite loop.
+	Each thread needs only the one.
+	"""
+	__slots__ = ("owner",)
+	def __init__(self):
+		self.owner = get_ident()
+
+class _PerThread(local):
+	def __init__(self):
+		self.hole = Blackhole()
+
+PER_THREAD = _PerThread()
+
+_WAITER_LOCK = Lock()
+WAITERS = {}  # id(thunk) -> Event, for just those thunks some thread is waiting on.
+_WAITING_ON = {}  # thread-ident -> Blackhole, to catch cycles that span threads.
 
 class Thunk(SophieValue):
-	""" A kind of not-yet-value which can be forced. """
+	"""
+	A kind of not-yet-value which can be forced.
+	
+	Any thread may force a thunk, but only one thread evaluates it. That thread claims
+	the thunk by popping its expression out of the instance dictionary, which is atomic,
+	so the uncontended case takes no lock. It then puts its Blackhole in place of the value
+	until the real value is published.
+	"""
+	CLAIM = "expr"  # Name of the attribute whose removal stakes the claim.
+	
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		THUNK_TYPES.add(cls)
+	
 	def __init__(self, expr: syntax.ValueExpression, frame:ENV):
 		assert isinstance(expr, syntax.ValueExpression), type(expr)
 		self.expr = expr
@@ -55,18 +104,111 @@ class Thunk(SophieValue):
 		self.value = _ABSENT
 	
 	def __str__(self):
-		if self.value is _ABSENT:
-			return "<Thunk: %s>" % self.expr
+		if self.value is _ABSENT or type(self.value) is Blackhole:
+			return "<Thunk: %s>" % self.__dict__.get(self.CLAIM, "(under evaluation)")
 		else:
 			return str(self.value)
 	
 	def force(self):
-		if self.value is _ABSENT:
-			self.value = evaluate(self.expr, self.frame)
-			del self.expr
-			del self.frame
-		return self.value
+		while True:
+			value = self.value
+			if value is _ABSENT:
+				token = self.__dict__.pop(self.CLAIM, None)
+				if token is None: sleep(0)  # Someone else just now claimed it. The blackhole is on its way.
+				else: return self.evaluate(token)
+			elif type(value) is Blackhole: self.await_value(value)
+			else: return value
+	
+	def evaluate(self, token) -> LAZY_VALUE:
+		""" Having claimed the thunk, work out and publish its value. """
+		self.value = PER_THREAD.hole
+		try: value = self.compute(token)
+		except BaseException:
+			self.abandon(token)
+			raise
+		self.publish(value)
+		return value
+	
+	def compute(self, expr:syntax.ValueExpression) -> LAZY_VALUE:
+		value = evaluate(expr, self.frame)
+		while type(value) is TailCall: value = evaluate(value.expr, value.frame)
+		return value
+	
+	def publish(self, value:LAZY_VALUE):
+		self.value = value
+		del self.frame
+		if WAITERS: wake_waiters(self)
+	
+	def abandon(self, token):
+		""" Evaluation failed. Put things back so any waiters can try for themselves. """
+		setattr(self, self.CLAIM, token)
+		self.value = _ABSENT
+		if WAITERS: wake_waiters(self)
 	
+	def await_value(self, hole:Blackhole):
+		""" Park until the value is published (or evaluation fails). """
+		me = get_ident()
+		with _WAITER_LOCK:
+			owner = hole.owner
+			while owner != me:
+				waiting = _WAITING_ON.get(owner)
+				if waiting is None: break
+				owner = waiting.owner
+			else: raise InfiniteLoop(str(self))
+			event = WAITERS.get(id(self))
+			if event is None: event = WAITERS[id(self)] = Event()
+			_WAITING_ON[me] = hole
+		# Waiters post the event before checking the value one last time.
+		# Publishers set the value before checking for events. So nobody misses out.
+		try:
+			if self.value is hole: event.wait()
+		finally:
+			with _WAITER_LOCK: del _WAITING_ON[me]
+			wake_waiters(self)
+
+def wake_waiters(thunk:Thunk):
+	with _WAITER_LOCK: event = WAITERS.pop(id(thunk), None)
+	if event is not None: event.set()
+
+THUNK_TYPES = {Thunk}
+
+class TailCall:
+	"""
+	The body of a closure, not yet evaluated. This is how `Closure.apply` keeps the
+	Python stack flat without paying for a thunk: There is nothing to memoize, because
+	whoever gets one runs it right away. Only `force` and thunks' `compute` methods ever see these.
+	"""
+	__slots__ = ("expr", "frame")
+	def __init__(self, expr: syntax.ValueExpression, frame:ENV):
+		self.expr = expr
+		self.frame = frame
+	
+	def force(self) -> LAZY_VALUE:
+		return evaluate(self.expr, self.frame)
+
+TAIL_CALL_TYPES = {TailCall}  # Each engine's kind of pending closure-body. None may be published as a thunk's value.
+
+class Engine(ABC):
+	"""
+	The parts of running a program which depend on the evaluation strategy.
+	The executive prepares and runs each module in terms of these methods.
+	"""
+	@abstractmethod
+	def close(self, frame:ENV, where:Iterable[syntax.Subroutine]):
+		""" Bind run-time values for these subroutines into the given frame. """
+	
+	@abstractmethod
+	def strict(self, expr:syntax.ValueExpression, frame:ENV) -> STRICT_VALUE:
+		""" Evaluate a (top-level) expression completely. """
+	
+	@abstractmethod
+	def actor(self, uda:syntax.UserActor) -> SophieValue:
+		""" The run-time manifestation of an actor definition. """
+	
+	def speculate(self, budget:int):
+		""" Let `delay` spend up to this many steps evaluating on the spot. Zero turns that off. """
+		if budget: raise NotImplementedError("Only the stack engine speculates.")
+
 def perform(action):
 	# In principle, you could schedule a function that
 	# evaluates to a reference to a procedure.
@@ -3,64 +3,126 @@ I decided to factor out the run-time from the executive.
 This is the overall control for the run-time.
 """
 import sys
-from collections import deque
+from time import monotonic
+from typing import Callable, Iterable
 from .. import syntax
-from .evaluator import Thunk, force, perform
-from .values import Constructor, Primitive, ActorClass, ActorTemplate, close
+from .types import STRICT_VALUE
+from .evaluator import Engine, force, perform
+from .values import Constructor, Primitive, Record, record_class, MemoTable, MEMO_TABLES
 from .runtime import (
-	_strict, GLOBAL_SCOPE,
+	GLOBAL_SCOPE, TreeWalker,
 	is_sophie_list, iterate_list,
 	reset_runtime, install_overrides
 )
+from .compiler import ClosureCompiler
+from .machine import StackMachine
+from .codegen import SourceCompiler
 from ..resolution import RoadMap
-from .scheduler import MAIN_QUEUE, SimpleTask
+from .scheduler import MAIN_QUEUE, LIMITS, SimpleTask
+from . import placement
 
 DRIVERS = {}
 
-def run_program(roadmap:RoadMap):
+ENGINES = {
+	"walk": TreeWalker(),
+	"closure": ClosureCompiler(),
+	"stack": StackMachine(),
+	"tiered": SourceCompiler(),
+}
+
+MEMO_SIZE = 100_000  # entries per memoized function, by default.
+
+def run_program(roadmap:RoadMap, engine:Engine=ENGINES["walk"], memoize:Iterable[str]=(), memo_size:int=MEMO_SIZE, speculate:int=0, scheduler:str="shared", processes:int=0, mailboxes:dict=None, quantum:int=0):
 	DRIVERS.clear()
 	GLOBAL_SCOPE.clear()
+	engine.speculate(speculate)
+	MAIN_QUEUE.set_mode(scheduler)
+	LIMITS.configure(mailboxes, quantum)
+	_set_memo_tables(roadmap, set(memoize), memo_size)
 	_set_strictures(roadmap.preamble)
-	_prepare(roadmap.preamble)
+	_prepare(roadmap.preamble, engine)
 	reset_runtime(roadmap.export_scopes[roadmap.preamble])
 	for module in roadmap.each_module:
 		_set_strictures(module)
-		_prepare(module)
+		_prepare(module, engine)
 		for d in module.foreign:
 			if d.linkage is not None:
 				py_module = sys.modules[d.source.value]
 				linkage = [GLOBAL_SCOPE[ref.dfn] for ref in d.linkage]
 				DRIVERS.update(py_module.sophie_init(*linkage) or ())
 		install_overrides(module.user_operators)
-		for expr in module.main:
-			MAIN_QUEUE.execute(SimpleTask(_display, expr))
+	# Process placement forks here, so every worker has the whole prepared program.
+	if processes: placement.start(processes)
+	try:
+		for module in roadmap.each_module:
+			for expr in module.main:
+				MAIN_QUEUE.execute(SimpleTask(_display, engine, expr))
+	finally:
+		if processes: placement.stop()
 
-def _display(expr):
-	result = _strict(expr, GLOBAL_SCOPE)
+FLUSH_INTERVAL = 0.1  # seconds; how long a streaming display may sit in the buffer.
+CHUNK_SIZE = 1000  # pieces of text per write, in a streaming display.
+
+def _display(engine:Engine, expr):
+	result = engine.strict(expr, GLOBAL_SCOPE)
 	if hasattr(result, "perform"):
 		perform(result)
 		return
+	out = sys.stdout
 	if is_sophie_list(result):
-		result = list(iterate_list(result))
-	elif isinstance(result, dict):
-		tag = result.get("")
-		if tag in DRIVERS:
-			DRIVERS[tag](result)
+		# Write each item as soon as it's ready, and hold on to none of them after.
+		# (Rebinding `result` lets go of the head of the list.)
+		# The text comes out the same as printing a Python list of the items would be.
+		result = iterate_list(result)
+		chunk = ["["]
+		separator, deadline = "", monotonic() + FLUSH_INTERVAL
+		for item in result:
+			chunk.append(separator)
+			if isinstance(item, Record): write_dethunked(item, chunk.append)
+			else: chunk.append(repr(item))
+			separator = ", "
+			if len(chunk) > CHUNK_SIZE or monotonic() > deadline:
+				out.write("".join(chunk))
+				out.flush()
+				chunk.clear()
+				deadline = monotonic() + FLUSH_INTERVAL
+		chunk.append("]\n")
+		out.write("".join(chunk))
+	elif isinstance(result, Record):
+		if result.TAG in DRIVERS:
+			DRIVERS[result.TAG](result)
 			return
-		dethunk(result)
-	if result is not None:
+		write_dethunked(result, out.write)
+		out.write("\n")
+	elif result is not None:
 		print(result)
 
 
+def _set_memo_tables(roadmap:RoadMap, names:set[str], size:int):
+	MEMO_TABLES.clear()
+	found = set()
+	for module in roadmap.each_module:
+		for udf in module.all_fns:
+			# A lifted function's name is qualified by where it came from, as in `outer:inner`.
+			short = udf.nom.text.rpartition(":")[2]
+			if udf.params and (udf.nom.text in names or short in names):
+				MEMO_TABLES[udf] = MemoTable(udf, size)
+				found.update((udf.nom.text, short))
+	for name in sorted(names - found):
+		print("No function called %r with parameters to memoize." % name, file=sys.stderr)
+
+def report_memo_tables():
+	for table in MEMO_TABLES.values(): print(table, file=sys.stderr)
+
 def _set_strictures(module):
 	for udf in module.all_fns + module.all_procs:
 		udf.strictures = tuple(i for i, p in enumerate(udf.params) if p.is_strict)
 
-def _prepare(module:syntax.Module):
+def _prepare(module:syntax.Module, engine:Engine):
 	for ifs in module.foreign: _prepare_foreign(ifs)
 	for typ in module.types: _prepare_type(typ)
-	for actor in module.actors: _prepare_actor(actor)
-	close(GLOBAL_SCOPE, module.top_subs)
+	for actor in module.actors: GLOBAL_SCOPE[actor] = engine.actor(actor)
+	engine.close(GLOBAL_SCOPE, module.top_subs)
 	install_overrides(module.user_operators)
 
 def _prepare_foreign(ifs:syntax.ImportForeign):
@@ -70,30 +132,35 @@ def _prepare_foreign(ifs:syntax.ImportForeign):
 			GLOBAL_SCOPE[dfn] = native_object
 
 def _prepare_type(typ:syntax.TypeDefinition):
-	def construct(dfn): GLOBAL_SCOPE[dfn] = Constructor(dfn, dfn.spec.field_names())
+	def construct(dfn): GLOBAL_SCOPE[dfn] = Constructor(dfn, dfn.spec.field_names(), dfn.spec.strictures)
 	if isinstance(typ, syntax.RecordSymbol):construct(typ)
 	elif isinstance(typ, syntax.VariantSymbol):
 		for case in typ.type_cases:
 			if isinstance(case, syntax.RecordTag): construct(case)
-			elif isinstance(case, syntax.EnumTag): GLOBAL_SCOPE[case] = {"": case}
+			elif isinstance(case, syntax.EnumTag): GLOBAL_SCOPE[case] = record_class(case, ())()
 	
-def _prepare_actor(actor):
-	GLOBAL_SCOPE[actor] = ActorClass(actor) if actor.fields else ActorTemplate(actor, ())
 
-
-def dethunk(result:dict):
+def write_dethunked(value:STRICT_VALUE, write:Callable[[str], object]):
 	"""
-	This can be considered as (most of) the first and most trivial I/O driver.
-	Its entire job is to push a program to completion by evaluating every thunk it produces.
-	There should be a better way, but it will probably be the consequence of an I/O subsystem.
+	Writes out the repr of a value with every thunk forced, but depth-first as it goes.
+	Thunks get forced only as the writing reaches them, so output appears as it is produced,
+	and nothing already written need stay in memory. Only the open records pend.
 	"""
-	dict_queue = deque()
-	dict_queue.append(result)
-	while dict_queue:
-		work_dict = dict_queue.popleft()
-		for k,v in work_dict.items():
-			if isinstance(v, Thunk): work_dict[k] = v = force(v)
-			if isinstance(v, dict): dict_queue.append(v)
+	pending = [("", value)]
+	while pending:
+		text, value = pending.pop()
+		write(text)
+		if value is _CLOSE: continue
+		value = force(value)
+		if isinstance(value, Record) and value.FIELDS:
+			write(value.TAG.nom.text + "(")
+			pending.append((")", _CLOSE))
+			for i in reversed(range(len(value.FIELDS))):
+				field = value.FIELDS[i]
+				pending.append(((", " if i else "") + field + "=", getattr(value, field)))
+		else: write(repr(value))
+
+_CLOSE = object()
 
 ###############################################################################
 
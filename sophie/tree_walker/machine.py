@@ -0,0 +1,448 @@
+"""
+A third engine for the Python-based runtime: The same meaning as the tree-walker,
+but with the continuation kept on the heap in a list, in the manner of a CEK machine.
+
+The tree-walker (and the closure engine) use Python's own stack to remember what
+to do with the value of a sub-expression, so deep non-tail recursion such as
+`total(xs) = xs.head + total(xs.tail)` runs out of Python stack on long lists.
+Here, every place that would make a nested call to get a strict value instead
+pushes a continuation and carries on in the same loop. Thunks get forced the same way,
+with an update-continuation to memoize the result. Nesting depth is then limited
+only by memory.
+
+Native code (primitives, adapters, the scheduler) still calls `force` the ordinary way.
+That starts a fresh machine, so the Python stack grows only at such boundaries.
+
+Optionally, this engine evaluates optimistically: See `speculate` below.
+"""
+import sys
+from threading import local
+from time import sleep
+from typing import Iterable, Sequence
+from .. import syntax
+from ..ontology import SELF
+from ..diagnostics import trace_absurdity, Annotation
+from .types import ENV, LAZY_VALUE, STRICT_VALUE, ARGS
+from .evaluator import Thunk, Engine, perform, _ABSENT, THUNK_TYPES, Blackhole, PER_THREAD
+from .values import Closure, Primitive, Constructor, memoize, MemoThunk, BoundMethod, ActorClass, ActorTemplate, UserDefinedActor
+from .scheduler import per_thread
+from .runtime import GLOBAL_SCOPE, PRIMITIVE_BINARY, PRIMITIVE_UNARY, SHORTCUT, operator_site
+from . import runtime
+
+STACK = list  # of (continuation, datum) pairs
+
+class _Jump:
+	""" Returned by a step to mean "Now evaluate this expression in this environment." """
+	__slots__ = ("expr", "env")
+	def __init__(self, expr:syntax.ValueExpression, env:ENV):
+		self.expr = expr
+		self.env = env
+
+class StackThunk(Thunk):
+	""" Forcing one of these from outside the machine runs a machine just for it. """
+	def compute(self, expr:syntax.ValueExpression):
+		if BUDGET and OPTIMISM.busy: raise _Abandon  # Native code wants this mid-speculation, which could take any amount of work.
+		return _run(_Jump(expr, self.frame))
+
+def _run(start:LAZY_VALUE) -> STRICT_VALUE:
+	""" The machine proper. Runs until the start-value is strict and the stack is empty. """
+	stack = []
+	value = start
+	try:
+		while True:
+			kind = type(value)
+			if kind is _Jump:
+				expr = value.expr
+				value = STEP[type(expr)](expr, value.env, stack)
+			elif kind is StackThunk:
+				inner = value.value
+				if inner is _ABSENT:
+					# Claim the thunk the same way Thunk.force does, but evaluate it right here.
+					expr = value.__dict__.pop("expr", None)
+					if expr is None: sleep(0)
+					else:
+						value.value = PER_THREAD.hole
+						stack.append((_update, (value, expr)))
+						value = STEP[type(expr)](expr, value.frame, stack)
+				elif type(inner) is Blackhole: value.await_value(inner)
+				else: value = inner
+			elif kind is MemoThunk:
+				# Likewise, so the memo-table gets the strict value.
+				inner = value.value
+				if inner is _ABSENT:
+					args = value.__dict__.pop("args", None)
+					if args is None: sleep(0)
+					else:
+						value.value = PER_THREAD.hole
+						stack.append((_update, (value, args)))
+						value = value.compute(args)
+				elif type(inner) is Blackhole: value.await_value(inner)
+				else: value = inner
+			elif kind in THUNK_TYPES: value = value.force()
+			elif stack:
+				k, datum = stack.pop()
+				value = k(value, datum, stack)
+			else: return value
+	except BaseException:
+		_unwind(stack)
+		raise
+
+def _unwind(stack:STACK):
+	""" Put back any thunks the machine had claimed, so someone can try them again later. """
+	for k, datum in reversed(stack):
+		if k is _update:
+			thunk, expr = datum
+			thunk.abandon(expr)
+
+def _update(value, datum, stack:STACK):
+	datum[0].publish(value)
+	return value
+
+def _strict(expr:syntax.ValueExpression, env:ENV) -> STRICT_VALUE:
+	return _run(_Jump(expr, env))
+
+###############################################################################
+
+def _lookup(expr:syntax.Lookup, env:ENV):
+	sym = expr.ref.dfn
+	try: return env[sym]
+	except KeyError:
+		try: return GLOBAL_SCOPE[sym]
+		except KeyError:
+			ann = Annotation(expr, "This wasn't found; compiler bug")
+			print(ann.path, file=sys.stderr)
+			print(ann.illustrate(), file=sys.stderr)
+			raise
+
+def _lambda(expr:syntax.LambdaForm, env:ENV):
+	closure = StackClosure(expr.function)
+	closure.perform_capture(env)
+	return closure
+
+def delay(expr:syntax.ValueExpression, env:ENV) -> LAZY_VALUE:
+	# Same policy as the tree-walker.
+	kind = type(expr)
+	if kind is syntax.Literal: return expr.value
+	if kind is syntax.Lookup: return _lookup(expr, env)
+	if kind is syntax.LambdaForm: return _lambda(expr, env)
+	if kind is syntax.DoBlock: return _do_block(expr, env)
+	if expr.cheap: return _strict(expr, env)
+	captures = expr.captures
+	if captures is not None: env = {sym: env[sym] for sym in captures}
+	if BUDGET: return _speculate(expr, env)
+	return StackThunk(expr, env)
+
+def close(env:ENV, where:Iterable[syntax.Subroutine]):
+	for sub in where:
+		env[sub] = StackThunk(sub.expr, env) if sub.is_thunk() else memoize(StackClosure(sub))
+	for sub in where:
+		if sub.is_thunk(): close(env, sub.where)
+		else: env[sub].perform_capture(env) # NOQA
+
+def _enter(closure:"StackClosure", args:ARGS) -> _Jump:
+	sub = closure._sub
+	inner = dict(zip(sub.params, args))
+	inner.update(closure._captures)
+	close(inner, sub.where)
+	return _Jump(sub.expr, inner)
+
+class StackClosure(Closure):
+	def apply(self, args: ARGS) -> LAZY_VALUE:
+		# Called from outside the machine. Inside, the Call step enters closures directly.
+		for i in self._sub.strictures: _force(args[i])
+		jump = _enter(self, args)
+		# A procedure's do-block runs now, as in the tree-walker, leaving nothing more to perform.
+		if type(jump.expr) is syntax.DoBlock: return _do_block(jump.expr, jump.env)
+		return StackThunk(jump.expr, jump.env)
+
+def _force(it:LAZY_VALUE) -> STRICT_VALUE:
+	if type(it) not in THUNK_TYPES: return it
+	if BUDGET and OPTIMISM.busy: raise _Abandon
+	return _run(it)
+
+###############################################################################
+# Each step either returns a value (which may be lazy) or a _Jump,
+# having pushed whatever continuation will consume the result.
+
+def _step_literal(expr:syntax.Literal, env:ENV, stack:STACK):
+	return expr.value
+
+def _step_lookup(expr:syntax.Lookup, env:ENV, stack:STACK):
+	return _lookup(expr, env)
+
+def _step_lambda_form(expr:syntax.LambdaForm, env:ENV, stack:STACK):
+	return _lambda(expr, env)
+
+def _step_bin_exp(expr:syntax.BinExp, env:ENV, stack:STACK):
+	stack.append((_bin_exp_lhs, (expr, env)))
+	return _Jump(expr.lhs, env)
+
+def _bin_exp_lhs(a, datum, stack:STACK):
+	expr, env = datum
+	stack.append((_bin_exp_rhs, (expr, a)))
+	return _Jump(expr.rhs, env)
+
+def _bin_exp_rhs(b, datum, stack:STACK):
+	expr, a = datum
+	try: return PRIMITIVE_BINARY[expr.op.text](a, b)
+	except TypeError: return operator_site(expr).binary(a, b)
+
+def _step_unary_exp(expr:syntax.UnaryExp, env:ENV, stack:STACK):
+	stack.append((_unary_exp, expr))
+	return _Jump(expr.arg, env)
+
+def _unary_exp(arg, expr:syntax.UnaryExp, stack:STACK):
+	try: return PRIMITIVE_UNARY[expr.op.text](arg)
+	except TypeError: return operator_site(expr).unary(arg)
+
+def _step_shortcut_exp(expr:syntax.ShortCutExp, env:ENV, stack:STACK):
+	stack.append((_shortcut_exp, (expr, env)))
+	return _Jump(expr.lhs, env)
+
+def _shortcut_exp(lhs, datum, stack:STACK):
+	expr, env = datum
+	return lhs if lhs == SHORTCUT[expr.op.text] else _Jump(expr.rhs, env)
+
+def _step_call(expr:syntax.Call, env:ENV, stack:STACK):
+	stack.append((_call, (expr, env)))
+	return _Jump(expr.fn_exp, env)
+
+def _call(function, datum, stack:STACK):
+	expr, env = datum
+	if type(function) is StackClosure: strictures = function._sub.strictures
+	elif type(function) is Primitive: strictures = range(len(expr.args))
+	elif type(function) is Constructor and function.strictures: strictures = function.strictures
+	else: return function.apply([delay(a, env) for a in expr.args])
+	# The callee is in hand, so its strict arguments need no thunks: evaluate them right here.
+	args = [None if i in strictures else delay(a, env) for i, a in enumerate(expr.args)]
+	return _strict_args(None, (function, args, strictures, 0, expr, env), stack)
+
+def _strict_args(value, datum, stack:STACK):
+	# Evaluate the strict arguments one at a time, in order, then make the call.
+	function, args, strictures, i, expr, env = datum
+	if i: args[strictures[i-1]] = value
+	if i < len(strictures):
+		stack.append((_strict_args, (function, args, strictures, i+1, expr, env)))
+		return _Jump(expr.args[strictures[i]], env)
+	if type(function) is StackClosure: return _enter(function, args)
+	return function.apply(args)
+
+def _step_cond(expr:syntax.Cond, env:ENV, stack:STACK):
+	stack.append((_cond, (expr, env)))
+	return _Jump(expr.if_part, env)
+
+def _cond(if_part, datum, stack:STACK):
+	expr, env = datum
+	return _Jump(expr.then_part if if_part else expr.else_part, env)
+
+def _step_field_ref(expr:syntax.FieldReference, env:ENV, stack:STACK):
+	stack.append((_field_ref, expr.field_name.text))
+	return _Jump(expr.lhs, env)
+
+def _field_ref(lhs, key:str, stack:STACK):
+	return getattr(lhs, key)
+
+def _step_explicit_list(expr:syntax.ExplicitList, env:ENV, stack:STACK):
+	tail = runtime.NIL
+	for sx in reversed(expr.elts):
+		tail = runtime.CONS.apply((delay(sx, env), tail))
+	return tail
+
+def _step_match_expr(expr:syntax.MatchExpr, env:ENV, stack:STACK):
+	stack.append((_match_expr, (expr, env)))
+	return _Jump(expr.subject.expr, env)
+
+def _match_expr(subject, datum, stack:STACK):
+	expr, env = datum
+	env[expr.subject] = subject
+	try: alternative = expr.dispatch[subject.TAG]
+	except KeyError:
+		assert expr.otherwise is not None, subject
+		return _Jump(expr.otherwise, env)
+	close(env, alternative.where)
+	return _Jump(alternative.sub_expr, env)
+
+def _do_block(expr:syntax.DoBlock, env:ENV):
+	# Actions run one at a time anyway, so there is nothing to gain by doing this on the machine stack.
+	if BUDGET and OPTIMISM.busy: raise _Abandon  # Actions happen only when real demand gets to them.
+	for na in expr.actors:
+		env[na] = _strict(na.expr, env).instantiate()
+	for step in expr.steps:
+		perform(_strict(step, env))
+
+def _step_do_block(expr:syntax.DoBlock, env:ENV, stack:STACK):
+	return _do_block(expr, env)
+
+def _step_skip(expr:syntax.Skip, env:ENV, stack:STACK):
+	return None
+
+def _step_bind_method(expr:syntax.BindMethod, env:ENV, stack:STACK):
+	stack.append((_bind_method, expr.method_name.text))
+	return _Jump(expr.receiver, env)
+
+def _bind_method(receiver, method_name:str, stack:STACK):
+	return BoundMethod(receiver, method_name)
+
+def _step_as_task(expr:syntax.AsTask, env:ENV, stack:STACK):
+	stack.append((_as_task, None))
+	return _Jump(expr.proc_ref, env)
+
+def _as_task(proc, _, stack:STACK):
+	return proc.as_task()
+
+def _step_assign_member(expr:syntax.AssignMember, env:ENV, stack:STACK):
+	stack.append((_assign_member, (expr.dfn, env[SELF])))
+	return _Jump(expr.expr, env)
+
+def _assign_member(value, datum, stack:STACK):
+	member, actor = datum
+	actor.state[member] = value
+
+def _step_absurdity(expr:syntax.Absurdity, env:ENV, stack:STACK):
+	trace_absurdity(env, expr)
+	exit()
+
+STEP = {
+	syntax.Literal: _step_literal,
+	syntax.Lookup: _step_lookup,
+	syntax.LambdaForm: _step_lambda_form,
+	syntax.BinExp: _step_bin_exp,
+	syntax.UnaryExp: _step_unary_exp,
+	syntax.ShortCutExp: _step_shortcut_exp,
+	syntax.Call: _step_call,
+	syntax.Cond: _step_cond,
+	syntax.FieldReference: _step_field_ref,
+	syntax.ExplicitList: _step_explicit_list,
+	syntax.MatchExpr: _step_match_expr,
+	syntax.DoBlock: _step_do_block,
+	syntax.Skip: _step_skip,
+	syntax.BindMethod: _step_bind_method,
+	syntax.AsTask: _step_as_task,
+	syntax.AssignMember: _step_assign_member,
+	syntax.Absurdity: _step_absurdity,
+}
+
+###############################################################################
+# Optimistic evaluation: Many thunks get forced soon after they are made, so with a budget set,
+# `delay` first tries evaluating on the spot for at most that many machine steps.
+# If that finishes, the value goes in place of the thunk. Otherwise, the attempt is abandoned
+# as if it never happened, and `delay` makes the thunk after all.
+#
+# This must not change the meaning of the program. So speculation also gives up on anything
+# which ought to wait until something actually needs the value: errors and absurdities,
+# actions, blocking on another thread's thunk, and native code forcing thunks (which the
+# budget cannot reach). Delays within a speculation speculate too, but out of the same budget.
+#
+# Each delay-site has a credit which failed attempts use up and successful ones restore,
+# so a site where speculation keeps coming to nothing soon stops trying.
+
+BUDGET = 0  # Machine steps per speculation. Zero means never speculate.
+TRUST = 4  # Credit for a fresh delay-site, and the most a site can hold.
+PENALTY = 2  # Credit lost each time speculation at a site comes to nothing.
+CREDIT = {}  # delay-site -> remaining credit
+
+class _Abandon(Exception):
+	""" Speculation ran out of budget, or reached something that must wait for real demand. """
+
+class _Optimism(local):
+	busy = False  # Whether this thread is in the middle of a speculation,
+	left = 0  # and if so, how many more steps it may take.
+
+OPTIMISM = _Optimism()
+
+def speculate(budget:int):
+	global BUDGET
+	BUDGET = budget
+	CREDIT.clear()
+
+def _speculate(expr:syntax.ValueExpression, env:ENV) -> LAZY_VALUE:
+	credit = CREDIT.get(expr, TRUST)
+	if credit > 0:
+		mine = OPTIMISM
+		outer = mine.busy
+		if not outer: mine.left = BUDGET
+		mine.busy = True
+		try: value = _run_within(_Jump(expr, env), mine)
+		except Exception:
+			# That includes errors, which evaluating the thunk will raise again if anything needs it.
+			CREDIT[expr] = credit - PENALTY
+		else:
+			if credit < TRUST: CREDIT[expr] = credit + 1
+			return value
+		finally: mine.busy = outer
+	return StackThunk(expr, env)
+
+def _run_within(start:_Jump, mine:_Optimism) -> STRICT_VALUE:
+	""" Like `_run`, but giving up when the budget runs out or at anything not to be done early. """
+	stack = []
+	value = start
+	try:
+		budget = mine.left
+		while budget:
+			# Steps may speculate in turn, so the budget lives where they can find it.
+			mine.left = budget - 1
+			kind = type(value)
+			if kind is _Jump:
+				expr = value.expr
+				value = SPECULATIVE_STEP[type(expr)](expr, value.env, stack)
+			elif kind is StackThunk:
+				inner = value.value
+				if inner is _ABSENT:
+					expr = value.__dict__.pop("expr", None)
+					if expr is None: raise _Abandon  # Some other thread just now claimed it.
+					value.value = PER_THREAD.hole
+					stack.append((_update, (value, expr)))
+					value = SPECULATIVE_STEP[type(expr)](expr, value.frame, stack)
+				elif type(inner) is Blackhole: raise _Abandon
+				else: value = inner
+			elif kind in THUNK_TYPES: raise _Abandon
+			elif stack:
+				k, datum = stack.pop()
+				value = k(value, datum, stack)
+			else: return value
+			budget = mine.left
+		raise _Abandon
+	except BaseException:
+		_unwind(stack)
+		raise
+
+def _step_premature(expr:syntax.ValueExpression, env:ENV, stack:STACK):
+	raise _Abandon
+
+SPECULATIVE_STEP = {
+	**STEP,
+	syntax.DoBlock: _step_premature,
+	syntax.AssignMember: _step_premature,
+	syntax.Absurdity: _step_premature,
+}
+
+###############################################################################
+
+class StackActor(UserDefinedActor):
+	def handle(self, message, args):
+		behavior = self._vtable[message]
+		env = dict(zip(behavior.params, args))
+		close(env, behavior.where)
+		env.update(self.state)
+		per_thread.current_actor = self
+		perform(_strict(behavior.expr, env))
+
+class StackActorTemplate(ActorTemplate):
+	ACTOR = StackActor
+
+class StackActorClass(ActorClass):
+	TEMPLATE = StackActorTemplate
+
+class StackMachine(Engine):
+	""" Keep the continuation on the heap, so deep recursion needs no deep Python stack. """
+	def close(self, frame:ENV, where:Sequence[syntax.Subroutine]):
+		close(frame, where)
+
+	def strict(self, expr:syntax.ValueExpression, frame:ENV) -> STRICT_VALUE:
+		return _strict(expr, frame)
+
+	def actor(self, uda:syntax.UserActor):
+		return StackActorClass(uda) if uda.fields else StackActorTemplate(uda, ())
+
+	def speculate(self, budget:int):
+		speculate(budget)
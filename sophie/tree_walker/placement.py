@@ -0,0 +1,242 @@
+"""
+Place user-defined actors in worker processes, so CPU-bound actors can use more than one core.
+
+The executive calls `start` once every module is prepared but before any main expression runs.
+That forks the workers, which therefore share (copies of) the whole prepared program.
+From then on, each new user-defined actor goes round-robin to some worker process.
+The main process keeps the pinned and native actors, such as the console, and the main expressions.
+A worker process runs its actors one message at a time on a single thread; more would not help.
+
+Messages cross process boundaries as strict values: Any thunks are forced on the way out,
+and lists are sent whole. (An infinite list therefore makes a poor message.) Anything that
+existed before the fork, such as a top-level function or the console, goes by reference.
+So do actors, wherever they live. Other functions cannot make the trip.
+
+Termination works by counting envelopes in flight. The sender counts one before posting
+and the recipient discounts it once everything it set in motion locally has settled.
+Only the main process can send while the count is zero, so it pins the scheduler then.
+Whoever brings the count back to zero tells the main process, which then unpins.
+"""
+
+import multiprocessing
+import pickle
+import sys
+from collections import deque
+from itertools import count
+from io import BytesIO
+from threading import Thread
+from traceback import format_exc
+from .evaluator import force, THUNK_TYPES
+from .types import SophieValue
+from .values import Record, UserDefinedActor, BoundMethod, place_here
+from . import values, runtime
+from .runtime import GLOBAL_SCOPE
+from .scheduler import MAIN_QUEUE, STATS, Task, Actor, NativeObjectProxy
+
+HOME = 0  # Which process this is. The main process is zero.
+NR_WORKERS = 0  # Zero means placement is switched off.
+SHARED = []  # Things that existed before the fork, so every process can refer to them by position.
+SHARED_INDEX = {}  # id -> position in SHARED
+LOCAL = {}  # key -> actor, for actors here that some other process may know about.
+KEYS = {}  # actor -> key, the other way around.
+ORPHANS = {}  # key -> messages which arrived before their actor did.
+
+_INBOX = []  # One queue per process, which everyone may write and only the owner reads.
+_PROCESSES = []
+_PENDING = None  # Shared count of envelopes in flight.
+_pinned = False  # Only meaningful in the main process.
+_serial = count()  # For making up keys and choosing homes.
+
+def start(nr_workers:int):
+	"""
+	Fork the workers. Only the forking thread carries over into a child, so no other thread may be
+	in the middle of anything: The scheduler must be between jobs, with no event loop or sampler running.
+	The command line refuses the combinations which would break that.
+	"""
+	global NR_WORKERS, _PENDING
+	if "fork" not in multiprocessing.get_all_start_methods(): raise ValueError("Process placement needs a platform that can fork.")
+	if MAIN_QUEUE.loop is not None or STATS.sampling(): raise ValueError("Process placement does not go with the asyncio scheduler or statistics sampling.")
+	assert MAIN_QUEUE.is_between_jobs()
+	context = multiprocessing.get_context("fork")
+	NR_WORKERS = nr_workers
+	_PENDING = context.Value("q", 0)
+	_INBOX[:] = [context.SimpleQueue() for _ in range(nr_workers + 1)]
+	for sym, value in GLOBAL_SCOPE.items():
+		_share(sym)
+		_share(value)
+		if isinstance(value, values.Constructor): _share(value.record)
+		if isinstance(value, Record): _share(type(value))
+	values.PLACE = _place
+	sys.stdout.flush()
+	sys.stderr.flush()
+	# Python warns about forking a process with threads, and rightly so in general.
+	# Between jobs, the scheduler's workers are each parked on a lock of their own,
+	# which nobody in the child will ever touch, and the main thread is right here.
+	for home in range(1, nr_workers + 1):
+		process = context.Process(target=_serve, args=[home], daemon=True, name="placement worker %d" % home)
+		process.start()
+		_PROCESSES.append(process)
+	Thread(target=_receive, daemon=True, name="placement receiver").start()
+
+def stop():
+	global NR_WORKERS
+	for inbox in _INBOX: inbox.put(None)
+	for process in _PROCESSES:
+		process.join(1)
+		if process.is_alive(): process.terminate()
+	values.PLACE = place_here
+	NR_WORKERS = 0
+	for it in _PROCESSES, _INBOX, SHARED: it.clear()
+	for it in SHARED_INDEX, LOCAL, KEYS, ORPHANS: it.clear()
+
+def _share(it):
+	if id(it) not in SHARED_INDEX:
+		SHARED_INDEX[id(it)] = len(SHARED)
+		SHARED.append(it)
+
+###############################################################################
+
+def _place(actor:type[UserDefinedActor], uda, state:dict):
+	serial = next(_serial)
+	home = 1 + (HOME + serial) % NR_WORKERS
+	if home == HOME: return place_here(actor, uda, state)
+	key = (HOME, serial)
+	_send(home, ("new", key, actor, uda, [state[field] for field in uda.fields]))
+	return RemoteActor(home, key)
+
+class RemoteActor:
+	""" Stands in for an actor that lives in some other process, or has yet to arrive in this one. """
+	def __init__(self, home:int, key:tuple):
+		self.home = home
+		self.key = key
+
+	def accept_message(self, method_name, args):
+		if self.home != HOME: _send(self.home, ("msg", self, method_name, args))
+		elif self.key in LOCAL: LOCAL[self.key].accept_message(method_name, args)
+		else: ORPHANS.setdefault(self.key, []).append((method_name, args))
+
+def _address(actor:UserDefinedActor):
+	if actor not in KEYS:
+		KEYS[actor] = key = (HOME, next(_serial))
+		LOCAL[key] = actor
+	return HOME, KEYS[actor]
+
+def _settle(actor:UserDefinedActor, key:tuple):
+	KEYS[actor] = key
+	LOCAL[key] = actor
+	for message in ORPHANS.pop(key, ()): actor.accept_message(*message)
+
+###############################################################################
+
+def _same(it): return it
+def _shared(index): return SHARED[index]
+def _record(index, fields): return SHARED[index](fields)
+def _actor(home, key):
+	if home == HOME and key in LOCAL: return LOCAL[key]
+	return RemoteActor(home, key)
+
+class _Pickler(pickle.Pickler):
+	def reducer_override(self, it):
+		index = SHARED_INDEX.get(id(it))
+		if index is not None: return _shared, (index,)
+		kind = type(it)
+		if kind in THUNK_TYPES: return _same, (force(it),)
+		if isinstance(it, runtime.CONS.record): return runtime.as_sophie_list, (list(runtime.iterate_list(it)),)
+		if isinstance(it, Record): return _record, (SHARED_INDEX[id(kind)], tuple(it))
+		if isinstance(it, UserDefinedActor): return _actor, _address(it)
+		if kind is RemoteActor: return _actor, (it.home, it.key)
+		if kind is BoundMethod: return BoundMethod, (it._receiver, it._method_name)
+		if isinstance(it, (SophieValue, Actor)): raise TypeError("Cannot send %s to another process." % it)
+		return NotImplemented
+
+def _dumps(envelope) -> bytes:
+	buffer = BytesIO()
+	_Pickler(buffer).dump(envelope)
+	return buffer.getvalue()
+
+def _send(home:int, envelope):
+	global _pinned
+	blob = _dumps(envelope)
+	with _PENDING.get_lock():
+		if HOME == 0 and not _pinned:
+			MAIN_QUEUE.pin()
+			_pinned = True
+		_PENDING.value += 1
+	_INBOX[home].put(blob)
+
+def _discount():
+	global _pinned
+	with _PENDING.get_lock():
+		_PENDING.value -= 1
+		if _PENDING.value: return
+		if HOME: _INBOX[0].put(_dumps(("quiet",)))
+		elif _pinned:
+			_pinned = False
+			MAIN_QUEUE.unpin()
+
+def _open(envelope):
+	verb = envelope[0]
+	if verb == "msg":
+		_, receiver, method_name, args = envelope
+		receiver.accept_message(method_name, args)
+	elif verb == "new":
+		_, key, actor, uda, state = envelope
+		_settle(place_here(actor, uda, dict(zip(uda.fields, state))), key)
+	else: raise ValueError(verb)
+
+###############################################################################
+
+def _receive():
+	""" The main process's side: Deliver to native actors, notice quiet, and relay trouble. """
+	global _pinned
+	inbox = _INBOX[0]
+	while True:
+		blob = inbox.get()
+		if blob is None: return
+		envelope = pickle.loads(blob)
+		if envelope[0] == "quiet":
+			with _PENDING.get_lock():
+				if _PENDING.value == 0 and _pinned:
+					_pinned = False
+					MAIN_QUEUE.unpin()
+		elif envelope[0] == "error":
+			MAIN_QUEUE.main_thread.insert_task(RuntimeError(envelope[1]))
+		else:
+			_open(envelope)
+			_discount()
+
+class _Errands:
+	""" A worker process's task queue. It has only the one thread. """
+	def __init__(self):
+		self.tasks = deque()
+
+	def insert_task(self, task):
+		self.tasks.append(task)
+
+class _Ambassador:
+	""" Stands in, within a worker process, for some native object in the main process. """
+	def __init__(self, proxy:NativeObjectProxy):
+		self._proxy = proxy
+
+	def __getattr__(self, method_name):
+		return lambda *args: _send(0, ("msg", self._proxy, method_name, args))
+
+def _serve(home:int):
+	global HOME
+	HOME = home
+	errands = Task.TASK_QUEUE = _Errands()
+	for it in SHARED:
+		if isinstance(it, NativeObjectProxy):
+			it.TASK_QUEUE = errands
+			it._principal = _Ambassador(it)
+	inbox = _INBOX[home]
+	while True:
+		blob = inbox.get()
+		if blob is None: return
+		try:
+			_open(pickle.loads(blob))
+			while errands.tasks: errands.tasks.popleft().proceed()
+		except BaseException:
+			errands.tasks.clear()
+			_INBOX[0].put(_dumps(("error", "In placement worker %d:\n%s" % (home, format_exc()))))
+		_discount()
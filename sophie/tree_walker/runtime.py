@@ -1,12 +1,14 @@
 import sys
+import math
 import operator
-from typing import Optional, Reversible
+from itertools import islice
+from typing import Optional, Sequence, Callable
 from .. import syntax, primitive 
 from ..ontology import SELF
 from ..diagnostics import trace_absurdity, Annotation
 from .types import ENV, STRICT_VALUE, LAZY_VALUE
-from .evaluator import force, delay, evaluate, perform, attach_evaluation_methods
-from .values import Function, Constructor, Closure, close, BoundMethod, UserDefinedActor
+from .evaluator import force, delay, evaluate, perform, attach_evaluation_methods, Engine
+from .values import Function, Constructor, Record, Closure, close, BoundMethod, ActorClass, ActorTemplate
 
 GLOBAL_SCOPE = {}
 
@@ -40,14 +42,52 @@ SHORTCUT = {
 	"OR":True,
 }
 
-def overloaded_bin_op(a:STRICT_VALUE, op:str, b:STRICT_VALUE):
-	signature = _type_class(a), _type_class(b)
-	if op in RELOP_MAP:
-		order = OVERLOAD["<=>", signature].apply((a, b))
-		return order[""] in RELOP_MAP[op]
-	else:
-		return OVERLOAD[op, signature].apply((a, b))
+class OperatorSite:
+	"""
+	An inline cache for the user-defined operators at one operator-expression.
+	
+	Engines try the primitive operator first, which costs nothing extra in the usual case.
+	When that fails, the site maps the operand types straight to the applicable implementation.
+	So overload resolution happens once per combination of types seen at the site,
+	rather than once per operation. Sites rarely see more than a couple of combinations.
+	"""
+	__slots__ = ("glyph", "table")
+	
+	def __init__(self, glyph:str):
+		self.glyph = glyph
+		self.table = {}
+	
+	def binary(self, a:STRICT_VALUE, b:STRICT_VALUE) -> LAZY_VALUE:
+		try: method = self.table[type(a), type(b)]
+		except KeyError: method = self.resolve(a, b)
+		return method(a, b)
 	
+	def unary(self, a:STRICT_VALUE) -> LAZY_VALUE:
+		try: method = self.table[type(a),]
+		except KeyError: method = self.resolve(a)
+		return method(a)
+	
+	def resolve(self, *args:STRICT_VALUE) -> Callable:
+		method = self.table[tuple(map(type, args))] = _overload(self.glyph, args)
+		return method
+
+def _overload(glyph:str, args:Sequence[STRICT_VALUE]) -> Callable:
+	signature = tuple(map(_type_class, args))
+	if glyph in RELOP_MAP:
+		compare, cases = OVERLOAD["<=>", signature], RELOP_MAP[glyph]
+		return lambda a, b: force(compare.apply((a, b))).TAG in cases
+	else:
+		function = OVERLOAD[glyph, signature]
+		return lambda *args: function.apply(args)
+
+def operator_site(expr:syntax.BinExp|syntax.UnaryExp) -> OperatorSite:
+	""" For engines that interpret the syntax directly. Sites last until the runtime resets. """
+	try: return OPERATOR_SITES[expr]
+	except KeyError:
+		site = OPERATOR_SITES[expr] = OperatorSite(expr.op.text)
+		return site
+
+OPERATOR_SITES = {}
 
 RELOP_MAP = {}
 
@@ -56,14 +96,28 @@ OVERLOAD = {}
 PRIMITIVE_TYPE_TOKENS = {}
 
 def _type_class(x:STRICT_VALUE):
-	try: return x[""].as_token()
-	except TypeError: return PRIMITIVE_TYPE_TOKENS[type(x)]
+	try: return x.TAG.as_token()
+	except AttributeError: return PRIMITIVE_TYPE_TOKENS[type(x)]
 
 ###############################################################################
 
 def _strict(expr:syntax.ValueExpression, frame:ENV):
 	return force(evaluate(expr, frame))
 
+def known_strictures(expr:syntax.Call) -> Sequence[int]:
+	"""
+	Which arguments the callee will force anyway, if the call site names the callee directly
+	(or names a parameter that demand analysis has given a signature).
+	Callers may evaluate those arguments on the spot rather than build thunks for them.
+	"""
+	fn_exp = expr.fn_exp
+	if isinstance(fn_exp, syntax.Lookup):
+		dfn = fn_exp.ref.dfn
+		if isinstance(dfn, (syntax.Subroutine, syntax.FormalParameter)): return dfn.strictures
+		if isinstance(dfn, (syntax.RecordSymbol, syntax.RecordTag)): return dfn.spec.strictures
+	elif isinstance(fn_exp, syntax.LambdaForm): return fn_exp.function.strictures
+	return ()
+
 ###############################################################################
 
 def _eval_literal(expr:syntax.Literal, frame:ENV):
@@ -90,13 +144,13 @@ def _eval_lambda_form(expr:syntax.LambdaForm, frame:ENV):
 def _eval_bin_exp(expr:syntax.BinExp, frame:ENV):
 	a = _strict(expr.lhs, frame)
 	b = _strict(expr.rhs, frame)
-	try:
-		return PRIMITIVE_BINARY[expr.op.text](a, b)
-	except TypeError:
-		return overloaded_bin_op(a, expr.op.text, b)
+	try: return PRIMITIVE_BINARY[expr.op.text](a, b)
+	except TypeError: return operator_site(expr).binary(a, b)
 
 def _eval_unary_exp(expr:syntax.UnaryExp, frame:ENV):
-	return PRIMITIVE_UNARY[expr.op.text](_strict(expr.arg, frame))
+	a = _strict(expr.arg, frame)
+	try: return PRIMITIVE_UNARY[expr.op.text](a)
+	except TypeError: return operator_site(expr).unary(a)
 
 def _eval_shortcut_exp(expr:syntax.ShortCutExp, frame:ENV):
 	lhs = _strict(expr.lhs, frame)
@@ -106,8 +160,12 @@ def _eval_shortcut_exp(expr:syntax.ShortCutExp, frame:ENV):
 def _eval_call(expr:syntax.Call, frame:ENV):
 	function = _strict(expr.fn_exp, frame)
 	assert isinstance(function, Function)
-	thunks = tuple(delay(a, frame) for a in expr.args)
-	return function.apply(thunks)
+	strictures = known_strictures(expr)
+	if strictures:
+		args = tuple(_strict(a, frame) if i in strictures else delay(a, frame) for i, a in enumerate(expr.args))
+	else:
+		args = tuple(delay(a, frame) for a in expr.args)
+	return function.apply(args)
 
 def _eval_cond(expr:syntax.Cond, frame:ENV):
 	if_part = _strict(expr.if_part, frame)
@@ -115,14 +173,8 @@ def _eval_cond(expr:syntax.Cond, frame:ENV):
 	return evaluate(sequel, frame)
 
 def _eval_field_ref(expr:syntax.FieldReference, frame:ENV):
-	lhs = _strict(expr.lhs, frame)
-	key = expr.field_name.text
-	if isinstance(lhs, dict):
-		try: return lhs[key]
-		except KeyError:
-			raise
-	else:
-		return getattr(lhs, key)
+	# Works the same for records and for native objects.
+	return getattr(_strict(expr.lhs, frame), expr.field_name.text)
 
 def _eval_explicit_list(expr:syntax.ExplicitList, frame:ENV):
 	tail = NIL
@@ -134,7 +186,7 @@ def _eval_explicit_list(expr:syntax.ExplicitList, frame:ENV):
 def _eval_match_expr(expr:syntax.MatchExpr, frame:ENV):
 	subject = _strict(expr.subject.expr, frame)
 	frame[expr.subject] = subject
-	tag = subject[""]
+	tag = subject.TAG
 	try:
 		alternative = expr.dispatch[tag]
 	except KeyError:
@@ -175,32 +227,125 @@ attach_evaluation_methods(globals())
 
 ###############################################################################
 
-NIL:Optional[dict] = None # Gets replaced at runtime.
-LESS:Optional[dict] = None # Gets replaced at runtime.
-SAME:Optional[dict] = None # Gets replaced at runtime.
-MORE:Optional[dict] = None # Gets replaced at runtime.
-NOPE:Optional[dict] = None # Gets replaced at runtime.
+NIL:Optional[Record] = None # Gets replaced at runtime.
+LESS:Optional[Record] = None # Gets replaced at runtime.
+SAME:Optional[Record] = None # Gets replaced at runtime.
+MORE:Optional[Record] = None # Gets replaced at runtime.
+NOPE:Optional[Record] = None # Gets replaced at runtime.
 CONS:Constructor
 THIS:Constructor
+SEGMENT:type["Segment"]  # Gets replaced at runtime.
+
+class Segment(Record):
+	"""
+	A run of already-strict list elements kept in a Python list, from some offset onward.
+	To everything in Sophie it looks like a cons-cell (reset_runtime makes it a subclass
+	of the cons record-class) but the whole run is one object instead of one per element.
+	The tuple holds (items, offset), so read it by field name rather than by position.
+	"""
+	__slots__ = ()
+	
+	@property
+	def head(self):
+		items, offset = self
+		return items[offset]
+	
+	@property
+	def tail(self):
+		items, offset = self
+		return _segment(items, offset + 1)
+	
+	def __eq__(self, other):
+		if type(other) is SEGMENT: return self.rest() == other.rest()
+		return isinstance(other, Record) and CONS.record((self.head, self.tail)) == other
+	
+	def __hash__(self):
+		# Equal to the same list in cons-cells, so it must hash the same. Built from the end, without recursion.
+		code = hash(NIL)
+		for item in reversed(self.rest()): code = hash((item, _HashCode(code)))
+		return code
+	
+	def __repr__(self):
+		rest = self.rest()
+		return "".join("%s(head=%r, tail="%(self.TAG.nom.text, x) for x in rest) + repr(NIL) + ")"*len(rest)
+	
+	def rest(self) -> list:
+		items, offset = self
+		return items[offset:]
+
+class _HashCode:
+	""" Hashes as the given number. A tuple's hash depends only on those of its members. """
+	__slots__ = ("code",)
+	def __init__(self, code:int): self.code = code
+	def __hash__(self): return self.code
+
+def _segment(items:list, offset:int) -> Record:
+	return SEGMENT((items, offset)) if offset < len(items) else NIL
 
 def iterate_list(lst:LAZY_VALUE):
 	lst = force(lst)
-	while lst[""] == CONS.key:
-		yield force(lst['head'])
-		lst = force(lst['tail'])
-	assert lst[""] == NIL[""]
-
-def as_sophie_list(items:Reversible):
-	lst = NIL
-	for head in reversed(items):
-		lst = {"":CONS.key, "head":head, "tail":lst}
-	return lst
+	cons = CONS.record
+	while type(lst) is cons:
+		head, tail = lst
+		yield force(head)
+		lst = force(tail)
+	if type(lst) is SEGMENT:
+		items, offset = lst
+		yield from islice(items, offset, None)
+	else: assert lst is NIL, lst
+
+def as_sophie_list(items:Sequence):
+	"""
+	The items must be strict already. A list is adopted as-is, not copied,
+	so do not change it afterward.
+	"""
+	return _segment(items if type(items) is list else list(items), 0)
 
 def is_sophie_list(it:STRICT_VALUE):
-	return isinstance(it, dict) and it[""] is CONS.key
+	return isinstance(it, CONS.record)
+
+###############################################################################
+
+class Shortcut(Function):
+	"""
+	Stands in for a list function from the preamble. Given a Segment, it answers straight
+	from the underlying Python list; otherwise, the Sophie definition does the work.
+	"""
+	def __init__(self, general:Function, fast:Callable):
+		self._general = general
+		self._fast = fast
+	
+	def apply(self, args):
+		return self._fast(self._general, args)
+
+def _length_at(general, args):
+	xs = force(args[1])
+	if type(xs) is not SEGMENT: return general.apply(args)
+	items, offset = xs
+	return force(args[0]) + len(items) - offset
+
+def _drop(general, args):
+	n = force(args[0])
+	if n < 1: return args[1]
+	xs = force(args[1])
+	if type(xs) is not SEGMENT: return general.apply((n, xs))
+	items, offset = xs
+	return _segment(items, offset + math.floor(n))
+
+def _reverse(general, args):
+	xs = force(args[0])
+	if type(xs) is not SEGMENT: return general.apply((xs,))
+	return _segment(xs.rest()[::-1], 0)
+
+# `length` and `index` are defined in terms of these, so they go fast too.
+SHORTCUTS = {
+	"length_at": _length_at,
+	"drop": _drop,
+	"reverse": _reverse,
+}
 
 def sophie_nope(): return NOPE
-def sophie_this(item): return {"":THIS.key, "item":item}
+def sophie_this(item): return THIS.record((item,))
 
 ###############################################################################
 
@@ -217,8 +362,14 @@ def reset_runtime(preamble_scope):
 		PRIMITIVE_TYPE_TOKENS[typ] = token
 	
 	OVERLOAD.clear()
+	OPERATOR_SITES.clear()
 	for name in 'nil', 'cons', 'less', 'same', 'more', 'this', 'nope':
 		globals()[name.upper()] = GLOBAL_SCOPE[preamble_scope.terms.symbol(name)]
+	global SEGMENT
+	SEGMENT = type("cons", (Segment, CONS.record), {"__slots__": ()})
+	for name, fast in SHORTCUTS.items():
+		sym = preamble_scope.terms.symbol(name)
+		GLOBAL_SCOPE[sym] = Shortcut(GLOBAL_SCOPE[sym], fast)
 	for relation, cases in {
 		"<":("less",),
 		"==":("same",),
@@ -234,3 +385,16 @@ def install_overrides(overrides):
 		assert isinstance(sub, syntax.UserOperator), "No FFI operator support just yet. Sorry."
 		signature = sub.dispatch_vector()
 		OVERLOAD[sub.nom.key(), signature] = GLOBAL_SCOPE[sub]
+
+###############################################################################
+
+class TreeWalker(Engine):
+	""" The reference engine: Dispatch on the type of each node as it is visited. """
+	def close(self, frame:ENV, where):
+		close(frame, where)
+	
+	def strict(self, expr:syntax.ValueExpression, frame:ENV) -> STRICT_VALUE:
+		return _strict(expr, frame)
+	
+	def actor(self, uda:syntax.UserActor):
+		return ActorClass(uda) if uda.fields else ActorTemplate(uda, ())
@@ -1,13 +1,21 @@
 """
-This is the simple task-queue version of a scheduler.
-At some point I may do a work-stealing version for fun,
-but the semantics of the language are the same regardless.
+This is the simple task-queue version of a scheduler,
+with a work-stealing mode and an asyncio mode you can switch on between jobs.
+The semantics of the language are the same regardless.
+Mailboxes are unbounded unless you set limits; see MailboxLimits.
 """
-from collections import deque
-from threading import Lock, Thread, local
+import asyncio
+import json
+from collections import deque, defaultdict
+from random import randrange
+from threading import Lock, Thread, Event, local
+from time import perf_counter, time
 from typing import Optional
+from inspect import iscoroutine
 
 POOL_SIZE = 3
+MODES = ("shared", "stealing", "asyncio")
+OVERFLOW = ("block", "drop", "signal")
 
 per_thread = local()
 
@@ -15,19 +23,216 @@ def _init_thread_local_storage(name):
 	per_thread.call_stack = []
 	per_thread.name = name
 
+class Statistics:
+	"""
+	Numbers for finding out why an actor program is slow. Recording is off until you
+	call `enable`, and while off it costs one attribute check at each place it would record.
+	
+	Each worker adds to its own busy and idle totals. The mutex numbers and queue high-water mark
+	change only with the scheduler's mutex held. The batch-size histogram and the mailbox marks
+	need a lock of their own. Only the deepest few mailboxes are remembered, by name rather than
+	by actor, so that statistics keep no actor alive.
+	"""
+	on = False
+	MAILBOX_MARKS = 10  # How many of the deepest mailboxes to remember.
+	
+	def __init__(self):
+		self._lock = Lock()
+		self.reset()
+	
+	def enable(self):
+		self.reset()
+		self.on = True
+	
+	def disable(self):
+		self.on = False
+	
+	def reset(self):
+		self.started = perf_counter()
+		self.busy = defaultdict(float)  # worker -> seconds
+		self.idle = defaultdict(float)  # worker -> seconds
+		self.tasks = defaultdict(int)  # worker -> number run
+		self.acquisitions = self.contended = 0
+		self.mutex_wait = 0.0
+		self.queue_high_water = 0
+		self.batches = defaultdict(int)  # power of two -> number of batches at least that size but under twice that
+		self.nr_batches = self.nr_messages = self.largest_batch = 0
+		self.mailboxes = {}  # str(actor) -> most messages ever waiting at once
+		self._shallowest = 0  # Once the marks are full, no mailbox this deep or shallower gets in.
+		self.held = self.dropped = 0  # messages that found a full mailbox
+		self._sampler = None
+	
+	def acquire(self, mutex:Lock):
+		if not mutex.acquire(False):
+			clock = perf_counter()
+			mutex.acquire()
+			self.mutex_wait += perf_counter() - clock
+			self.contended += 1
+		self.acquisitions += 1
+	
+	def batch(self, size:int):
+		with self._lock:
+			self.batches[1 << (size.bit_length() - 1)] += 1
+			self.nr_batches += 1
+			self.nr_messages += size
+			self.largest_batch = max(self.largest_batch, size)
+	
+	def mailbox(self, actor:"Actor", size:int):
+		if size <= self._shallowest: return
+		name = str(actor)
+		with self._lock:
+			marks = self.mailboxes
+			if size <= marks.get(name, 0): return
+			marks[name] = size
+			if len(marks) > self.MAILBOX_MARKS: del marks[min(marks, key=marks.get)]
+			if len(marks) == self.MAILBOX_MARKS: self._shallowest = min(marks.values())
+	
+	def overflow(self, held:int, dropped:int):
+		with self._lock:
+			self.held += held
+			self.dropped += dropped
+	
+	def snapshot(self, nr_mailboxes:int=MAILBOX_MARKS) -> dict:
+		""" The numbers so far, in a form ready for JSON. """
+		marks = sorted(self.mailboxes.items(), key=lambda pair: -pair[1])[:nr_mailboxes]
+		return {
+			"time": round(perf_counter() - self.started, 6),
+			"queue": {"depth": MAIN_QUEUE.depth(), "high_water": self.queue_high_water},
+			"workers": [
+				{"busy": round(self.busy[i], 6), "idle": round(self.idle[i], 6), "tasks": self.tasks[i]}
+				for i in range(MAIN_QUEUE.nr_workers)
+			],
+			"mutex": {"acquisitions": self.acquisitions, "contended": self.contended, "wait": round(self.mutex_wait, 6)},
+			"batches": {
+				"count": self.nr_batches, "messages": self.nr_messages, "largest": self.largest_batch,
+				"sizes": {str(k): self.batches[k] for k in sorted(self.batches)},
+			},
+			"mailboxes": dict(marks),
+			"overflow": {"held": self.held, "dropped": self.dropped},
+		}
+	
+	def report(self, out):
+		""" Write the numbers so far for people to read. """
+		it = self.snapshot()
+		print("Scheduler statistics over %.3f seconds:" % it["time"], file=out)
+		print("  Task queue: %(depth)d waiting now; at most %(high_water)d." % it["queue"], file=out)
+		for i, worker in enumerate(it["workers"]):
+			print("  Worker %d: busy %.3fs, idle %.3fs, %d tasks." % (i, worker["busy"], worker["idle"], worker["tasks"]), file=out)
+		print("  Queue mutex: %(acquisitions)d acquisitions, %(contended)d contended, %(wait).6fs waiting." % it["mutex"], file=out)
+		batches = it["batches"]
+		print("  Actor batches: %(count)d, handling %(messages)d messages; largest %(largest)d." % batches, file=out)
+		if batches["sizes"]:
+			print("    By size: " + ", ".join("%s+: %d" % pair for pair in batches["sizes"].items()), file=out)
+		if it["mailboxes"]:
+			print("  Mailbox high-water marks:", file=out)
+			for actor, mark in it["mailboxes"].items(): print("    %s: %d" % (actor, mark), file=out)
+		if self.held or self.dropped:
+			print("  Full mailboxes: %(held)d messages held back, %(dropped)d dropped." % it["overflow"], file=out)
+	
+	def start_sampling(self, path:str, interval:float):
+		""" Append a snapshot, as one line of JSON, to the named file every so often. """
+		done = Event()
+		def sample():
+			with open(path, "a") as out:
+				while True:
+					finished = done.wait(interval)
+					out.write(json.dumps({"at": time(), **self.snapshot()}) + "\n")
+					out.flush()
+					if finished: return
+		thread = Thread(target=sample, daemon=True, name="statistics sampler")
+		self._sampler = done, thread
+		thread.start()
+	
+	def sampling(self) -> bool:
+		return self._sampler is not None
+	
+	def stop_sampling(self):
+		""" Take one last sample, and stop. """
+		if self._sampler is not None:
+			done, thread = self._sampler
+			done.set()
+			thread.join()
+			self._sampler = None
+
+STATS = Statistics()
+
+class MailboxFull(RuntimeError):
+	""" What an actor with the "signal" overflow policy raises rather than take one message too many. """
+
+class MailboxLimits:
+	"""
+	How many messages each kind of actor may keep waiting, what happens to the next one, and how many
+	an actor handles in one turn before it must go to the back of the queue. The "kind" is the actor's
+	type name, as in the statistics, and "*" stands for the rest. With no capacities, there are no limits.
+	
+	A message that finds a full mailbox either:
+		block:  waits beside the mailbox, and the sender takes no further turns until it is let in;
+		drop:   goes in, but pushes out the oldest message waiting; or
+		signal: raises MailboxFull in the sender.
+	
+	Blocking holds back the sender's next turn, not the thread, so workers never wait on one another.
+	Senders other than actors, and actors sending to themselves, cannot be held back, so their messages go in regardless.
+	A cycle of actors all blocked on each other's full mailboxes is a deadlock; the scheduler reports it once all else is quiet.
+	"""
+	on = False
+	
+	def __init__(self):
+		self._lock = Lock()
+		self.configure()
+	
+	def configure(self, capacities:dict=None, quantum:int=0):
+		""" capacities maps actor kinds to pairs of (capacity, overflow policy). """
+		for capacity, policy in (capacities or {}).values(): assert capacity > 0 and policy in OVERFLOW, (capacity, policy)
+		self.capacities = dict(capacities or {})
+		self.on = bool(self.capacities)
+		self.quantum = quantum  # Zero means an actor takes its whole mailbox each turn.
+		self.parked = 0
+	
+	def limit(self, actor:"Actor") -> tuple[int, str]:
+		return self.capacities.get(actor.kind()) or self.capacities.get("*") or (0, "block")
+	
+	def park(self, delta:int):
+		with self._lock: self.parked += delta
+	
+	def check(self):
+		""" After a job: Complain about any messages still waiting for room, since nothing will ever make room now. """
+		if self.parked:
+			nr, self.parked = self.parked, 0
+			raise RuntimeError("Deadlock: %d messages still wait for room in full mailboxes, but nothing else is happening." % nr)
+
+LIMITS = MailboxLimits()
+
 class ThreadPoolScheduler:
 	"""
 	Responsible for the main task queue and pool of worker threads.
 	Can also trigger shut-down. System threads can influence that by
 	adjusting the number of busy threads via the pin and unpin methods.
+	
+	In work-stealing mode, each worker also has a deque of its own.
+	Tasks enqueued from a worker go there, without taking the mutex.
+	The owner works from the front; an idle worker steals from the back.
+	Only the owner ever adds to a worker's deque, and it looks there
+	before going idle, so quiescence still means there's nothing to do.
+	The shared queue remains for tasks from the main thread and elsewhere.
+	
+	In asyncio mode, the worker threads sit idle. Instead, every task is a
+	callback on an event loop with a thread of its own. Native adapters may
+	then answer with coroutines, which wait for I/O without holding up any task.
+	Each callback or coroutine counts as busy until it finishes, just as a
+	pinned system thread would, so quiescence means the same thing as before.
 	"""
+	
+	stealing = False
+	loop : Optional[asyncio.AbstractEventLoop] = None
 
 	def __init__(self, nr_workers:int):
+		self.nr_workers = nr_workers
 		self.main_thread = MainThread(self)
 		self._is_shutting_down = False
 		self._mutex = Lock()
 		self._tasks = deque()
 		self._idle = deque()
+		self._local = [deque() for _ in range(nr_workers)]
 		self._all_done = Lock()
 		self._all_done.acquire()
 		self._nr_busy = nr_workers
@@ -47,15 +252,89 @@ class ThreadPoolScheduler:
 		task.enqueue()
 		try: self.main_thread.run()
 		finally: self._finish_up()
+		LIMITS.check()
 		
+	def is_between_jobs(self) -> bool:
+		""" True when every worker is idle, waiting for the next call to `execute`. """
+		return self._all_done.locked() and self._nr_busy == 0
+	
+	def depth(self) -> int:
+		""" How many tasks are waiting, just now. """
+		return len(self._tasks) + sum(map(len, self._local))
+	
+	def _acquire(self):
+		if STATS.on: STATS.acquire(self._mutex)
+		else: self._mutex.acquire()
+	
+	def set_mode(self, mode:str):
+		""" Choose one of the MODES. Only between jobs, please. """
+		assert self._all_done.locked() and mode in MODES, mode
+		self.stealing = mode == "stealing"
+		if mode == "asyncio" and self.loop is None:
+			self.loop = asyncio.new_event_loop()
+			Thread(target=self._run_loop, args=[self.loop], daemon=True, name="event loop").start()
+		elif mode != "asyncio" and self.loop is not None:
+			self.loop.call_soon_threadsafe(self.loop.stop)
+			self.loop = None
+	
+	@staticmethod
+	def _run_loop(loop:asyncio.AbstractEventLoop):
+		_init_thread_local_storage("Event loop")
+		asyncio.set_event_loop(loop)
+		try: loop.run_forever()
+		finally: loop.close()
+	
+	def _turn(self, task):
+		try: task.proceed()
+		except BaseException as ex:
+			self.main_thread.insert_task(ex)
+		self.unpin()
+	
+	def perform_io(self, coroutine):
+		""" Run a native adapter's coroutine: on the event loop if there is one, or else right here. """
+		if self.loop is None:
+			# Without a loop, off_loop never suspends, so one step runs the whole thing.
+			# That costs nothing like setting up an event loop per call would.
+			try: coroutine.send(None)
+			except StopIteration: return
+			coroutine.close()
+			raise RuntimeError("A native adapter waited on something other than off_loop, which needs --scheduler asyncio.")
+		else:
+			self.pin()
+			asyncio.run_coroutine_threadsafe(coroutine, self.loop).add_done_callback(self._io_done)
+	
+	def _io_done(self, future):
+		if future.exception() is not None:
+			self.main_thread.insert_task(future.exception())
+		self.unpin()
+	
 	def _finish_up(self):
 		self._all_done.acquire()
 		self._tasks.clear()
+		for mine in self._local: mine.clear()
 		self.main_thread.recover()
 
 	def insert_task(self, task):
-		self._mutex.acquire()
+		if self.loop is not None:
+			self.pin()
+			self.loop.call_soon_threadsafe(self._turn, task)
+			return
+		if self.stealing:
+			mine = getattr(per_thread, "queue", None)
+			if mine is not None:
+				mine.append(task)
+				# The owner will get to the first one soon enough.
+				# Any backlog is worth waking an idle thief.
+				if len(mine) > 1 and self._idle:
+					self._acquire()
+					if self._idle:
+						self._more_busy()
+						self._idle.pop().release()
+					self._mutex.release()
+				return
+		self._acquire()
 		self._tasks.append(task)
+		if STATS.on: STATS.queue_high_water = max(STATS.queue_high_water, len(self._tasks))
 		if self._idle:
 			# Let's wake workers LIFO rather than round-robin:
 			self._more_busy()
@@ -64,21 +343,47 @@ class ThreadPoolScheduler:
 
 	def _worker(self, i):
 		_init_thread_local_storage("Thread " + str(i))
+		mine = per_thread.queue = self._local[i]
 		notify_me = Lock()
 		notify_me.acquire()
 		while True:
-			self._mutex.acquire()
-			while self._is_shutting_down or not self._tasks:
-				self._idle.append(notify_me)
-				self._less_busy()
-				self._mutex.release()
-				notify_me.acquire()
-				self._mutex.acquire()
-			task = self._tasks.popleft()
-			self._mutex.release()
+			try: task = mine.popleft()
+			except IndexError:
+				task = self._steal(mine)
+				if task is None:
+					task = self._take(i, notify_me)
+					if task is None: continue
+			clock = STATS.on and perf_counter()
 			try: task.proceed()
 			except BaseException as ex:
 				self.main_thread.insert_task(ex)
+			if clock:
+				STATS.busy[i] += perf_counter() - clock
+				STATS.tasks[i] += 1
+	
+	def _steal(self, mine):
+		if not self.stealing: return
+		nr = len(self._local)
+		start = randrange(nr)
+		for k in range(nr):
+			victim = self._local[(start + k) % nr]
+			if victim is not mine:
+				try: return victim.pop()
+				except IndexError: pass
+	
+	def _take(self, i, notify_me):
+		""" Take from the shared queue, or else go idle and return None once woken. """
+		self._acquire()
+		if self._tasks and not self._is_shutting_down:
+			task = self._tasks.popleft()
+			self._mutex.release()
+			return task
+		self._idle.append(notify_me)
+		self._less_busy()
+		self._mutex.release()
+		clock = STATS.on and perf_counter()
+		notify_me.acquire()
+		if clock: STATS.idle[i] += perf_counter() - clock
 	
 	def _less_busy(self):
 		# Precondition: self.mutex is held
@@ -97,16 +402,18 @@ class ThreadPoolScheduler:
 		Add one to the busy-thread count, thus preventing shut-down.
 		For use by system-threads with pinned actors.
 		"""
-		with self._mutex:
-			self._more_busy()
+		self._acquire()
+		try: self._more_busy()
+		finally: self._mutex.release()
 	
 	def unpin(self):
 		"""
 		Subtract one from the busy-thread count, thus allowing shut-down.
 		For use by system-threads with pinned actors.
 		"""
-		with self._mutex:
-			self._less_busy()
+		self._acquire()
+		try: self._less_busy()
+		finally: self._mutex.release()
 
 class MainThread:
 	"""
@@ -205,37 +512,110 @@ class Actor(Task):
 	setting its instance attribute "TASK_QUEUE".
 	The turtle-graphics / tkinter actor must use
 	this to stay on the main thread.
+	
+	An actor may be "stalled": It has had its turn, but some message it sent
+	still waits for room in a full mailbox. It is neither idle nor in a queue
+	until the last such message goes in. (See MailboxLimits.)
 	"""
 	
-	_mailbox : Optional[list]
+	_mailbox : deque
 	def __init__(self):
 		self._mutex = Lock()
-		self._mailbox = None
+		self._mailbox = deque()
 		self._idle = True
+		self._parked = deque()  # (sender, message) pairs waiting for room
+		self._holds = 0  # how many of this actor's messages are parked somewhere
+		self._stalled = False
 	
 	def proceed(self):
+		quantum = LIMITS.quantum
 		with self._mutex:
-			batch_of_messages = self._mailbox
-			self._mailbox = None
-		for message in batch_of_messages:
-			self.handle(*message)
+			mailbox = self._mailbox
+			if quantum and len(mailbox) > quantum:
+				batch_of_messages = [mailbox.popleft() for _ in range(quantum)]
+			else:
+				batch_of_messages, self._mailbox = mailbox, deque()
+			admitted = self._admit() if self._parked else ()
+		for sender in admitted: sender._release()
+		if STATS.on: STATS.batch(len(batch_of_messages))
+		per_thread.turn = self
+		try:
+			for message in batch_of_messages:
+				self.handle(*message)
+		finally: per_thread.turn = None
 		with self._mutex:
-			if self._mailbox:
+			if self._holds > 0:
+				self._stalled = True
+			elif self._mailbox:
 				self.enqueue()
 			else:
 				self._idle = True
 	
 	def accept_message(self, method_name, args):
+		message = method_name, args
+		sender = None
 		with self._mutex:
-			if self._mailbox is None:
-				self._mailbox = []
-			self._mailbox.append((method_name, args))
-			if self._idle:
-				self.enqueue()
-				self._idle = False
+			if LIMITS.on:
+				capacity, policy = LIMITS.limit(self)
+				if capacity and len(self._mailbox) >= capacity:
+					sender = self._overflow(policy, message)
+			if sender is None:
+				self._mailbox.append(message)
+				if STATS.on: STATS.mailbox(self, len(self._mailbox))
+				if self._idle:
+					self.enqueue()
+					self._idle = False
+		# Outside the mutex, lest two actors blocked on each other also lock each other.
+		if sender is not None: sender._hold()
+	
+	def _overflow(self, policy, message) -> Optional["Actor"]:
+		""" Deal with a message that finds the mailbox full. Returns the sender to hold back, if any. """
+		# Precondition: self._mutex is held
+		if policy == "signal":
+			raise MailboxFull("%s has %d messages waiting already; cannot take %s." % (self, len(self._mailbox), message[0]))
+		if policy == "drop":
+			self._mailbox.popleft()
+			if STATS.on: STATS.overflow(0, 1)
+			return
+		sender = getattr(per_thread, "turn", None)
+		if sender is None or sender is self: return
+		self._parked.append((sender, message))
+		LIMITS.park(1)
+		if STATS.on: STATS.overflow(1, 0)
+		return sender
+	
+	def _admit(self) -> list:
+		""" Let parked messages in, as far as there is room. Returns their senders, to be released. """
+		# Precondition: self._mutex is held
+		capacity, policy = LIMITS.limit(self)
+		admitted = []
+		while self._parked and not (capacity and len(self._mailbox) >= capacity):
+			sender, message = self._parked.popleft()
+			self._mailbox.append(message)
+			admitted.append(sender)
+		LIMITS.park(-len(admitted))
+		return admitted
+	
+	def _hold(self):
+		with self._mutex: self._holds += 1
+	
+	def _release(self):
+		# The hold and its release may happen in either order, so the count may dip below zero briefly.
+		with self._mutex:
+			self._holds -= 1
+			if self._holds == 0 and self._stalled:
+				self._stalled = False
+				if self._mailbox: self.enqueue()
+				else: self._idle = True
 	
 	def handle(self, message, args):
 		raise NotImplementedError(type(self))
+	
+	def __str__(self):
+		return "%s@%x" % (self.kind(), id(self))
+	
+	def kind(self) -> str:
+		return type(self).__name__
 
 class NativeObjectProxy(Actor):
 	""" Wrap Python objects in one of these to use them as actors. """
@@ -246,8 +626,17 @@ class NativeObjectProxy(Actor):
 			self.TASK_QUEUE = MAIN_QUEUE.main_thread
 	def handle(self, method_name, args):
 		method = getattr(self._principal, method_name)
-		method(*args)
+		outcome = method(*args)
+		if iscoroutine(outcome): MAIN_QUEUE.perform_io(outcome)
+	
+	def kind(self) -> str:
+		return type(self._principal).__name__
+
 
+async def off_loop(fn, *args):
+	""" For native adapters: Call a blocking function without blocking the event loop, if there is one. """
+	if MAIN_QUEUE.loop is None: return fn(*args)
+	return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
 
 class SimpleTask(Task):
 	def __init__(self, job, *args, **kwargs):
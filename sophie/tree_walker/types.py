@@ -8,7 +8,7 @@ from typing import Sequence, Union
 from ..ontology import TermSymbol
 
 
-NATIVE_DATA = Union[int, float, str, dict]
+NATIVE_DATA = Union[int, float, str, tuple]
 
 class SophieValue(ABC):
 	""" Root for classes that implement specialized run-time data structures """
@@ -3,12 +3,15 @@ This module defines the specialized value-types that the tree-walker operates in
 Basic primitive values play themselves, but special things like closures need more help.
 """
 from abc import abstractmethod
-from typing import Iterable
+from collections import OrderedDict
+from operator import itemgetter
+from threading import Lock
+from typing import Iterable, Sequence
 from ..ontology import SELF
 from .. import syntax
 from .scheduler import Task, Actor, per_thread
 from .types import ARGS, STRICT_VALUE, SophieValue, ENV, STRICT_ARGS, LAZY_VALUE
-from .evaluator import force, evaluate, perform, delay
+from .evaluator import force, evaluate, perform, tail_call, Thunk, THUNK_TYPES, TAIL_CALL_TYPES, Blackhole, _ABSENT, WAITERS, wake_waiters
 
 def _frame(sub:syntax.Subroutine, args: ARGS) -> ENV:
 	assert len(sub.params) == len(args), (sub, args)
@@ -18,7 +21,8 @@ def _frame(sub:syntax.Subroutine, args: ARGS) -> ENV:
 
 def close(frame:ENV, where:Iterable[syntax.Subroutine]):
 	for sub in where:
-		frame[sub] = delay(sub.expr, frame) if sub.is_thunk() else Closure(sub)
+		# A thunk may refer to its neighbors, so it must not run before they are all in place.
+		frame[sub] = Thunk(sub.expr, frame) if sub.is_thunk() else memoize(Closure(sub))
 	for sub in where:
 		if sub.is_thunk(): close(frame, sub.where)
 		else: frame[sub].perform_capture(frame) # NOQA
@@ -47,6 +51,9 @@ class Closure(Function):
 	
 	def _name(self): return self._sub.nom.text
 	
+	def captured(self) -> Iterable[LAZY_VALUE]:
+		return self._captures.values()
+	
 	def apply(self, args: ARGS) -> LAZY_VALUE:
 		for i in self._sub.strictures: force(args[i])
 		inner = dict(zip(self._sub.params, args))
@@ -55,17 +62,136 @@ class Closure(Function):
 		
 		# Important Tech Note:
 		# 
-		# We return a thunk here (via `delay`) instead of directly
+		# We return a tail-call here (via `tail_call`) instead of directly
 		# evaluating the expression (via `evaluate`) in order to
 		# emulate tail-call elimination and avoid stack overflow.
 		
-		return delay(self._sub.expr, inner) 
+		return tail_call(self._sub.expr, inner)
 	
 	def perform(self): return self.apply(())
 	
 	def as_task(self):
 		return ParametricTask(self) if self._sub.params else PlainTask(self, ())
 
+###############################################################################
+
+class MemoTable:
+	""" Remembered results for one memoized function, forgetting the least-recently used. """
+	def __init__(self, sub:syntax.Subroutine, size:int):
+		self.sub = sub
+		self.size = size
+		self.entries = OrderedDict()
+		self.lock = Lock()
+		self.hits = self.misses = self.evictions = self.unhashable = 0
+	
+	def __str__(self):
+		calls = self.hits + self.misses
+		rate = self.hits / calls if calls else 0.0
+		return "%s: %d hits, %d misses (%.1f%%), %d evictions, %d unhashable" % (
+			self.sub.nom.text, self.hits, self.misses, 100 * rate, self.evictions, self.unhashable
+		)
+
+MEMO_TABLES : dict[syntax.Subroutine, MemoTable] = {}
+
+def memoize(closure:Closure) -> Function:
+	""" Engines call this on each new closure, to wrap it if the user asked to memoize that function. """
+	table = MEMO_TABLES.get(closure._sub)
+	return closure if table is None else Memoized(closure, table)
+
+def _settled(arg:LAZY_VALUE):
+	""" The value of a thunk already evaluated, or else the thunk itself, which then keys by identity. """
+	if type(arg) in THUNK_TYPES:
+		value = getattr(arg, "value", _ABSENT)
+		if value is not _ABSENT and type(value) is not Blackhole: return value
+	return arg
+
+def _published(value:LAZY_VALUE) -> LAZY_VALUE:
+	""" Follow thunks to whatever value they have published, as far as that goes. """
+	while True:
+		inner = _settled(value)
+		if inner is value: return value
+		value = inner
+
+class Memoized(Function):
+	"""
+	A closure which remembers its results. The key is the arguments the function
+	actually uses, according to the resolver's memo-schedule, plus the values it captured.
+	Strict arguments get forced, as they would be anyway. Any other argument contributes
+	its value if that's already known, or else its identity. Either way, a hit can only
+	ever give the same answer as a call would, so memoizing never changes what a program means.
+	
+	Sophie thinks 1 and 1.0 are different, even though Python says they're equal,
+	so the key also carries the type of each part.
+	"""
+	def __init__(self, closure:Closure, table:MemoTable):
+		self._closure = closure
+		self._sub = closure._sub
+		self._table = table
+		self._positions = tuple((i, i in self._sub.strictures) for i in self._sub.memo_schedule.arguments)
+	
+	def perform_capture(self, frame):
+		self._closure.perform_capture(frame)
+	
+	def __str__(self):
+		return str(self._closure)
+	
+	def _name(self): return self._closure._name()
+	
+	def apply(self, args: ARGS) -> LAZY_VALUE:
+		table = self._table
+		parts = [force(args[i]) if strict else _settled(args[i]) for i, strict in self._positions]
+		parts.extend(map(_settled, self._closure.captured()))
+		key = (*parts, *map(type, parts))
+		try:
+			with table.lock:
+				value = table.entries.get(key, _ABSENT)
+				if value is _ABSENT: table.misses += 1
+				else:
+					table.hits += 1
+					settled = _published(value)
+					if settled is not value: table.entries[key] = settled
+					table.entries.move_to_end(key)
+					return settled
+		except TypeError:
+			# Something in there is not hashable, so this call cannot be remembered.
+			table.unhashable += 1
+			return self._closure.apply(args)
+		# Forcing the result here would nest a Python call for each memoized tail-call.
+		return MemoThunk(self, key, args)
+	
+	def remember(self, key:tuple, value:LAZY_VALUE):
+		table = self._table
+		with table.lock:
+			table.entries[key] = value
+			if len(table.entries) > table.size:
+				table.entries.popitem(last=False)
+				table.evictions += 1
+
+class MemoThunk(Thunk):
+	"""
+	The result of a memoized call, to be worked out on demand like any other.
+	Publishing the value also puts it in the memo-table. That value may still be lazy,
+	which keeps tail-recursion flat; later hits follow it as far as it has been forced.
+	"""
+	CLAIM = "args"
+	
+	def __init__(self, memoized:Memoized, key:tuple, args:ARGS):
+		self.memoized = memoized
+		self.key = key
+		self.args = args
+		self.value = _ABSENT
+	
+	def compute(self, args:ARGS) -> LAZY_VALUE:
+		value = self.memoized._closure.apply(args)
+		while type(value) in TAIL_CALL_TYPES: value = value.force()
+		return value
+	
+	def publish(self, value:LAZY_VALUE):
+		self.value = value
+		self.memoized.remember(self.key, value)
+		del self.memoized, self.key
+		if WAITERS: wake_waiters(self)
+
 class Primitive(Function):
 	""" All parameters to primitive procedures are strict. Also a kind of value, like a closure. """
 	def __init__(self, fn: callable):
@@ -74,44 +200,81 @@ class Primitive(Function):
 	def apply(self, args: ARGS) -> STRICT_VALUE:
 		return self._fn(*map(force, args))
 
+class Record(tuple):
+	"""
+	Records and variant-cases are tuples of their fields, in declaration order.
+	Each record-type and each case gets its own subclass (via `record_class`)
+	which knows the tag and names the fields, so instances carry no overhead.
+	Tag checks are identity comparisons on `TAG`.
+	"""
+	__slots__ = ()
+	TAG : syntax.Symbol
+	FIELDS : tuple[str, ...]
+	
+	# Equality means what it did for dictionaries: same tag and same contents.
+	# Ordering is not structural, and neither is tuple concatenation or repetition,
+	# so these fall through to user-defined operators.
+	def __eq__(self, other): return isinstance(other, Record) and self.TAG is other.TAG and tuple.__eq__(self, other)
+	def __ne__(self, other): return not self == other
+	def __lt__(self, other): return NotImplemented
+	__le__ = __gt__ = __ge__ = __add__ = __mul__ = __rmul__ = __lt__
+	__hash__ = tuple.__hash__
+	
+	def __repr__(self):
+		if not self.FIELDS: return self.TAG.nom.text
+		return "%s(%s)"%(self.TAG.nom.text, ", ".join("%s=%r"%pair for pair in zip(self.FIELDS, self)))
+
+def record_class(tag: syntax.Symbol, fields: Sequence[str]) -> type[Record]:
+	namespace = {name: property(itemgetter(i)) for i, name in enumerate(fields)}
+	namespace.update(__slots__=(), TAG=tag, FIELDS=tuple(fields))
+	return type(tag.nom.text, (Record,), namespace)
+
 class Constructor(Function):
-	def __init__(self, key: syntax.Symbol, fields: list[str]):
+	def __init__(self, key: syntax.Symbol, fields: list[str], strictures: Sequence[int] = ()):
 		self.key = key
 		self.fields = fields
+		self.strictures = strictures
+		self.record = record_class(key, fields)
 	
 	def apply(self, args: ARGS) -> STRICT_VALUE:
-		# TODO: It would be well to handle tagged values as Python pairs.
-		#  This way any value could be tagged, and various case-matching
-		#  things could work more nicely (and completely).
 		assert len(args) == len(self.fields)
-		structure = dict(zip(self.fields, args))
-		structure[""] = self.key
-		return structure
-
-class ActorClass(Function):
-	def __init__(self, uda: syntax.UserActor):
-		self._uda = uda
-	
-	def apply(self, args: ARGS) -> "ActorTemplate":
-		assert len(args) == len(self._uda.fields)
-		return ActorTemplate(self._uda, args)
+		if self.strictures:
+			args = list(args)
+			for i in self.strictures: args[i] = force(args[i])
+		return self.record(args)
 
 class ActorTemplate(SophieValue):
+	# Alternative engines may substitute their own kind of actor.
+	ACTOR : type["UserDefinedActor"]
+	
 	def __init__(self, uda: syntax.UserActor, args: ARGS):
 		self._uda = uda
 		self._args = args
 	
 	def instantiate(self):
 		state = dict(zip(self._uda.fields, map(force, self._args)))
-		vtable = self._uda.behavior_space._symbol
-		return UserDefinedActor(state, vtable)
+		return PLACE(self.ACTOR, self._uda, state)
+
+class ActorClass(Function):
+	TEMPLATE = ActorTemplate
+	
+	def __init__(self, uda: syntax.UserActor):
+		self._uda = uda
+	
+	def apply(self, args: ARGS) -> ActorTemplate:
+		assert len(args) == len(self._uda.fields)
+		return self.TEMPLATE(self._uda, args)
 
 class UserDefinedActor(Actor):
-	def __init__(self, state: dict, vtable: dict):
+	def __init__(self, state: dict, vtable: dict, name: str = "actor"):
 		super().__init__()
 		self.state = state
 		self.state[SELF] = self
 		self._vtable = vtable
+		self._name = name
+	
+	def kind(self) -> str:
+		return self._name
 	
 	def handle(self, message, args):
 		behavior = self._vtable[message]
@@ -120,6 +283,13 @@ class UserDefinedActor(Actor):
 		per_thread.current_actor = self
 		perform(evaluate(behavior.expr, frame))
 
+ActorTemplate.ACTOR = UserDefinedActor
+
+def place_here(actor:type[UserDefinedActor], uda: syntax.UserActor, state:dict):
+	return actor(state, uda.behavior_space._symbol, uda.nom.text)
+
+PLACE = place_here  # Process placement substitutes its own. (See placement.py)
+
 ###############################################################################
 
 class MessageTask:
@@ -1,18 +1,23 @@
 from pathlib import Path
+from io import StringIO
+from contextlib import redirect_stdout
 import unittest
 from unittest.mock import patch
 from sophie.static.check import TypeChecker
 from sophie import diagnostics, resolution
 from sophie.tree_walker import executive
 from sophie.intermediate import translate
+from sophie.fusion import fuse
 from sophie.demand import analyze_demand
+from sophie.optimize import optimize
+from sophie.cheapness import analyze_cheapness
 
 base_folder = Path(__file__).parent.parent
 examples = base_folder/"examples"
 zoo_ok = base_folder/"zoo/ok"
 
 
-def _good(folder, which) -> resolution.RoadMap:
+def _good(folder, which, memo=()) -> resolution.RoadMap:
 	report = diagnostics.Report(verbose=False)
 	try:
 		roadmap = resolution.RoadMap(folder / (which + ".sg"), report)
@@ -24,12 +29,20 @@ def _good(folder, which) -> resolution.RoadMap:
 		report.assert_no_issues("Ostensibly-good example broke before type-check, but failed to fail properly.")
 		TypeChecker(report).check_program(roadmap)
 		report.assert_no_issues("Ostensibly-good example failed to type-check.")
+		fuse(roadmap, report)
 		analyze_demand(roadmap)
+		optimize(roadmap, report, memo)
+		analyze_cheapness(roadmap)
 		with patch("sophie.intermediate.emit", lambda *args:None):
 			with patch("sophie.intermediate.newline", lambda indent="":None):
 				translate(roadmap)
 		return roadmap
 
+def _transcript(roadmap, engine, **kwargs):
+	with redirect_stdout(StringIO()) as out:
+		executive.run_program(roadmap, executive.ENGINES[engine], **kwargs)
+	return out.getvalue()
+
 class ExampleSmokeTests(unittest.TestCase):
 	""" Run all the examples; Test for no smoke. """
 	
@@ -78,6 +91,318 @@ class ExampleSmokeTests(unittest.TestCase):
 				roadmap = _good(zoo_ok, name)
 				executive.run_program(roadmap)
 
+	def test_other_engines_agree_with_walker(self):
+		for name in [
+			"hello_actors",
+			"algorithm",
+			"laziness",
+			"tutorial/case_when",
+			"tutorial/explicit_list_construction",
+			"mathematics/Fibonacci",
+			"mathematics/primes",
+			"mathematics/Newton_3",
+		]:
+			with self.subTest(name):
+				roadmap = _good(examples, name)
+				reference = _transcript(roadmap, "walk")
+				self.assertTrue(reference)
+				for engine in "closure", "stack", "tiered":
+					self.assertEqual(reference, _transcript(roadmap, engine), engine)
+
+	def test_tiered_engine_agrees_once_everything_is_hot(self):
+		from sophie.tree_walker.codegen import TieredTemplate
+		cases = [(examples, name) for name in ("algorithm", "laziness", "mathematics/primes", "mathematics/Newton_3")]
+		# Here `twice` first translates with inline arithmetic, and then meets a record.
+		cases.append((zoo_ok, "operators"))
+		with patch.object(TieredTemplate, "TIER_UP", 1):
+			for folder, name in cases:
+				with self.subTest(name):
+					roadmap = _good(folder, name)
+					self.assertEqual(_transcript(roadmap, "walk"), _transcript(roadmap, "tiered"))
+
+	def test_native_lists_act_like_cons_cells(self):
+		roadmap = _good(zoo_ok, "segments")
+		expect = "\n".join([
+			"4",
+			"['gamma', 'delta']",
+			"['delta', 'gamma', 'beta', 'alpha']",
+			"beta",
+			"alpha",
+			"8",
+			"['alpha', 'beta', 'gamma']",
+			"nil",
+		]) + "\n"
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual(expect, _transcript(roadmap, engine))
+
+	def test_stack_engine_survives_deep_recursion(self):
+		roadmap = _good(zoo_ok, "deep_recursion")
+		self.assertEqual("12497500\n10000\n", _transcript(roadmap, "stack"))
+
+	def test_thunks_capture_only_what_they_use(self):
+		roadmap = _good(zoo_ok, "captures")
+		[stats] = [fn for fn in roadmap.each_module[-1].all_fns if fn.nom.text == "stats"]
+		[total] = stats.where
+		later = stats.expr.args[1]
+		self.assertEqual((total,), later.captures)
+		self.assertEqual((total,), later.elts[0].captures)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("990100\n", _transcript(roadmap, engine))
+
+	def test_optimizer(self):
+		from sophie import syntax
+		roadmap = _good(zoo_ok, "optimize")
+		module = roadmap.each_module[-1]
+		self.assertEqual([12, 9], [expr.value for expr in module.main[:2] if isinstance(expr, syntax.Literal)])
+		[pick] = [fn for fn in module.top_subs if fn.nom.text == "pick"]
+		self.assertEqual(["answer"], [sub.nom.text for sub in pick.where])
+		self.assertEqual(2, sum(isinstance(fn.expr, syntax.ExplicitList) and not fn.params for fn in module.top_subs))
+		[count_digits] = [fn for fn in module.top_subs if fn.nom.text == "count_digits"]
+		self.assertEqual((), count_digits.where)
+		[go] = [fn for fn in module.top_subs if fn.nom.text == "count_digits:go"]
+		self.assertEqual(set(), go.captures)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("12\n9\n[1, 2, 3]\n5\n1\n5\n", _transcript(roadmap, engine))
+
+	def test_optimizer_leaves_memoized_calls_alone(self):
+		from sophie.tree_walker.values import MEMO_TABLES
+		roadmap = _good(zoo_ok, "optimize", memo=["square"])
+		module = roadmap.each_module[-1]
+		self.assertEqual("square", module.main[1].fn_exp.ref.dfn.nom.text)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("12\n9\n[1, 2, 3]\n5\n1\n5\n", _transcript(roadmap, engine, memoize=["square"]))
+				[table] = MEMO_TABLES.values()
+				self.assertEqual((0, 2), (table.hits, table.misses))
+
+	def test_list_fusion(self):
+		roadmap = _good(zoo_ok, "fusion")
+		subs = {fn.nom.text: fn for fn in roadmap.each_module[-1].top_subs}
+		def callee(expr): return expr.fn_exp.ref.dfn.nom.text
+		self.assertEqual("reduce_range", callee(subs["sum_of_squares"].expr))
+		self.assertEqual(["map", "filter"], [callee(subs["odd_cubes"].expr), callee(subs["odd_cubes"].expr.args[1])])
+		self.assertEqual("reduce", callee(subs["count_small"].expr))
+		self.assertEqual("xs", subs["count_small"].expr.args[2].ref.nom.text)
+		self.assertEqual("reduce_take", callee(subs["leading"].expr))
+		self.assertEqual("reduce_while", callee(subs["prefix"].expr))
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("385\n[9, 1, 81]\n5\n6\n4\n8\n", _transcript(roadmap, engine))
+
+	def test_speculation(self):
+		from sophie.tree_walker import machine
+		roadmap = _good(zoo_ok, "speculate")
+		expect = "1\n2\n3\n[4, 5, 6]\n[50, 1]\n"
+		for budget in (0, 5, 100):
+			with self.subTest(budget):
+				with redirect_stdout(StringIO()) as out:
+					executive.run_program(roadmap, executive.ENGINES["stack"], speculate=budget)
+				self.assertEqual(expect, out.getvalue())
+		self.assertTrue(any(credit < machine.TRUST for credit in machine.CREDIT.values()))
+		machine.speculate(0)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual(expect, _transcript(roadmap, engine))
+
+	def test_cheap_arguments(self):
+		roadmap = _good(zoo_ok, "cheap")
+		subs = {fn.nom.text: fn for fn in roadmap.each_module[-1].top_subs}
+		self.assertEqual([True, True], [arg.cheap for arg in subs["sum_squares"].expr.else_part.args])
+		self.assertEqual([True, True], [elt.cheap for elt in subs["spread"].expr.elts])
+		self.assertFalse(subs["swap"].expr.cheap)
+		self.assertFalse(roadmap.each_module[-1].main[-1].args[1].cheap)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("385\n[8, 2]\n2\n7\n", _transcript(roadmap, engine))
+
+	def test_strict_fields(self):
+		roadmap = _good(zoo_ok, "strict_fields")
+		module = roadmap.each_module[-1]
+		[box] = module.types
+		self.assertEqual((0,), box.spec.strictures)
+		[boxed] = [fn for fn in module.top_subs if fn.nom.text == "boxed"]
+		self.assertTrue(boxed.params[0].is_strict)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("3\n4.5\n2\n", _transcript(roadmap, engine))
+
+	def test_higher_order_strictness(self):
+		roadmap = _good(zoo_ok, "higher_order")
+		subs = {fn.nom.text: fn for fn in roadmap.each_module[-1].top_subs}
+		self.assertEqual(((0,), True), (subs["twice"].params[0].strictures, subs["twice"].params[1].is_strict))
+		self.assertEqual(((), False), (subs["apply"].params[0].strictures, subs["apply"].params[1].is_strict))
+		self.assertTrue(subs["offset"].params[0].is_strict)
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual("7\n20\n2\n0\n11\n", _transcript(roadmap, engine))
+
+	def test_memoized_fib(self):
+		from sophie.tree_walker.values import MEMO_TABLES
+		roadmap = _good(zoo_ok, "fib")
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				with redirect_stdout(StringIO()) as out:
+					executive.run_program(roadmap, executive.ENGINES[engine], ["fib"], memo_size=5)
+				self.assertEqual("514229\n", out.getvalue())
+				[table] = MEMO_TABLES.values()
+				self.assertEqual((27, 30), (table.hits, table.misses))
+				self.assertEqual(5, len(table.entries))
+
+	def test_memoized_tail_recursion(self):
+		from sophie.tree_walker.values import MEMO_TABLES
+		roadmap = _good(zoo_ok, "countdown")
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				with redirect_stdout(StringIO()) as out:
+					executive.run_program(roadmap, executive.ENGINES[engine], ["down"])
+				self.assertEqual("0\n0\n", out.getvalue())
+				[table] = MEMO_TABLES.values()
+				self.assertEqual(1, table.hits)
+
+	def test_user_defined_operators(self):
+		roadmap = _good(zoo_ok, "operators")
+		expect = "\n".join([
+			"6",
+			"money(cents=10)",
+			"complex(re=2, im=4)",
+			"money(cents=-21)",
+			"complex(re=-1, im=-2)",
+			"complex(re=-1.5, im=2.0)",
+			"more",
+			"less",
+		]) + "\n"
+		for engine in executive.ENGINES:
+			with self.subTest(engine):
+				self.assertEqual(expect, _transcript(roadmap, engine))
+
+	def test_segments_hash_like_cons_cells(self):
+		from sophie.tree_walker import runtime
+		_transcript(_good(zoo_ok, "segments"), "walk")  # Just to set up the runtime.
+		segment = runtime.as_sophie_list([1, 2, 3])
+		cells = runtime.CONS.record((1, runtime.CONS.record((2, runtime.CONS.record((3, runtime.NIL))))))
+		self.assertIs(runtime.SEGMENT, type(segment))
+		self.assertEqual(cells, segment)
+		self.assertEqual(hash(cells), hash(segment))
+		self.assertEqual(hash(cells.tail), hash(segment.tail))
+		self.assertIn(segment, {cells})
+
+	def test_display_streams_infinite_lists(self):
+		from sophie.tree_walker import runtime
+		from sophie.tree_walker.compiler import CompiledThunk
+		_transcript(_good(zoo_ok, "segments"), "walk")  # Just to set up the runtime.
+		def ones(_): return runtime.CONS.apply((1, CompiledThunk(ones, None)))
+		class Engine:
+			@staticmethod
+			def strict(expr, frame): return ones(None)
+		class Enough(Exception): pass
+		class Screen(StringIO):
+			def write(self, text):
+				if self.tell() > 100: raise Enough
+				return super().write(text)
+		with redirect_stdout(Screen()) as out, self.assertRaises(Enough):
+			executive._display(Engine, None)
+		self.assertTrue(out.getvalue().startswith("[1, 1, 1, "))
+
+	def test_scheduler_modes(self):
+		for name, expect in [
+			("benchmarks/ping_pong", "Rally over after 10000 hits.\n"),
+			("benchmarks/fan_out", "Tally: 1592\n"),
+		]:
+			with self.subTest(name):
+				roadmap = _good(examples, name)
+				for mode in "shared", "stealing", "asyncio":
+					self.assertEqual(expect, _transcript(roadmap, "closure", scheduler=mode), mode)
+
+	def test_console_input_in_each_mode(self):
+		roadmap = _good(zoo_ok, "conversation")
+		for engine in executive.ENGINES:
+			for mode in "shared", "asyncio":
+				with self.subTest(engine=engine, mode=mode), patch("sys.stdin", StringIO("Alice\nWonderland\n")):
+					self.assertEqual(
+						"What is your name?\nHello, Alice! Where are you from?\nWonderland is nice.\n",
+						_transcript(roadmap, engine, scheduler=mode),
+					)
+
+	def test_scheduler_statistics(self):
+		from json import dumps
+		from sophie.tree_walker.scheduler import STATS
+		roadmap = _good(examples, "benchmarks/ping_pong")
+		STATS.enable()
+		try: _transcript(roadmap, "closure")
+		finally: STATS.disable()
+		it = STATS.snapshot()
+		dumps(it)
+		self.assertEqual(20002, it["batches"]["messages"])  # Every ping, plus the echo.
+		self.assertEqual(3, len(it["workers"]))
+		self.assertGreater(it["mutex"]["acquisitions"], 0)
+		self.assertEqual({1}, set(it["mailboxes"].values()))
+
+	def test_statistics_keep_only_the_deepest_mailboxes(self):
+		from gc import collect
+		from weakref import ref
+		from sophie.tree_walker.scheduler import Statistics, NativeObjectProxy
+		stats = Statistics()
+		actors = [NativeObjectProxy(object()) for _ in range(25)]
+		for depth, actor in enumerate(actors, 1): stats.mailbox(actor, depth)
+		self.assertEqual(set(range(16, 26)), set(stats.mailboxes.values()))
+		self.assertEqual(str(actors[-1]), max(stats.mailboxes, key=stats.mailboxes.get))
+		deepest = ref(actors[-1])
+		del actors, actor
+		collect()
+		self.assertIsNone(deepest())
+
+	def test_bounded_mailboxes(self):
+		from sophie.tree_walker.scheduler import STATS, MailboxFull
+		roadmap = _good(examples, "benchmarks/pipeline")
+		STATS.enable()
+		try:
+			held = _transcript(roadmap, "tiered", mailboxes={"Consumer": (100, "block")})
+			blocking = STATS.snapshot()
+			STATS.enable()
+			dropped = _transcript(roadmap, "tiered", mailboxes={"*": (100, "drop")}, quantum=10)
+			dropping = STATS.snapshot()
+		finally: STATS.disable()
+		self.assertEqual("Consumed 5000 for a total of 214627500\n", held)
+		self.assertEqual(100, max(blocking["mailboxes"].values()))
+		self.assertGreater(blocking["overflow"]["held"], 0)
+		self.assertTrue(dropped.startswith("Consumed "), dropped)
+		self.assertGreater(dropping["overflow"]["dropped"], 0)
+		self.assertEqual(10, dropping["batches"]["largest"])
+		with self.assertRaises(MailboxFull):
+			_transcript(roadmap, "tiered", mailboxes={"Consumer": (100, "signal")})
+
+	def test_process_placement(self):
+		roadmap = _good(examples, "benchmarks/ping_pong")
+		for engine in "walk", "stack":
+			self.assertEqual("Rally over after 10000 hits.\n", _transcript(roadmap, engine, processes=2), engine)
+		with self.assertRaises(ValueError):
+			_transcript(roadmap, "walk", processes=2, scheduler="asyncio")
+
+	def test_thunk_is_shared_between_threads(self):
+		from threading import Thread, Barrier
+		from time import sleep
+		from sophie.tree_walker.compiler import CompiledThunk
+		from sophie.tree_walker.evaluator import InfiniteLoop
+		calls, results, gate = [], [], Barrier(8)
+		def code(frame):
+			calls.append(frame)
+			sleep(0.05)
+			return 42
+		thunk = CompiledThunk(code, "frame")
+		def worker():
+			gate.wait()
+			results.append(thunk.force())
+		threads = [Thread(target=worker) for _ in range(8)]
+		for t in threads: t.start()
+		for t in threads: t.join()
+		self.assertEqual(["frame"], calls)
+		self.assertEqual([42]*8, results)
+		ouroboros = CompiledThunk(lambda frame: ouroboros.force(), None)
+		with self.assertRaises(InfiniteLoop): ouroboros.force()
+
 
 if __name__ == '__main__':
 	unittest.main()